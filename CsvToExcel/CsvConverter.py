@@ -8,297 +8,66 @@ Features:
 - Append to existing Excel files with duplicate detection
 - Option to override and merge into existing files
 - User-defined key columns for duplicate detection
+- Normalized and fuzzy duplicate matching
 """
 
 import sys
 import os
-import re
-from pathlib import Path
-from collections import defaultdict
-import pandas as pd
+import multiprocessing
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
                              QWidget, QPushButton, QLabel, QFileDialog, QTextEdit,
                              QProgressBar, QMessageBox, QGroupBox, QCheckBox,
-                             QListWidget, QRadioButton, QButtonGroup, QLineEdit) # Added QLineEdit
+                             QListWidget, QRadioButton, QButtonGroup, QLineEdit, QSpinBox,
+                             QComboBox)
 from PyQt5.QtCore import QThread, pyqtSignal, Qt
 from PyQt5.QtGui import QFont
 
+import csv_sources
+from checkpoint_journal import DEFAULT_DIR as JOURNAL_DIR
+from conversion_engine import ConversionEngine, group_similar_files
+from conversion_tasks import CSV_ENGINES
+from file_manifest import FileManifest
+from conversion_cache import DEFAULT_PATH as CONVERSION_CACHE_PATH
+from schema_cache import DEFAULT_PATH as SCHEMA_CACHE_PATH
+from stage_metrics import DEFAULT_LOG_PATH as STAGE_LOG_PATH, summarize, summary_lines
+
 class ConversionWorker(QThread):
     """Worker thread for CSV to Excel conversion to prevent GUI freezing"""
 
     progress = pyqtSignal(int)
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
+    # Emitted instead of finished when the user cancelled the conversion
+    cancelled = pyqtSignal(str)
+    stage = pyqtSignal(dict)
 
-    def __init__(self, csv_files, output_path, combine_sheets, sheet_names,
-                 detect_similar, append_mode, override_mode, existing_file_path,
-                 duplicate_keys):
+    def __init__(self, *args, **kwargs):
         super().__init__()
-        self.csv_files = csv_files
-        self.output_path = output_path
-        self.combine_sheets = combine_sheets
-        self.sheet_names = sheet_names
-        self.detect_similar = detect_similar
-        self.append_mode = append_mode
-        self.override_mode = override_mode
-        self.existing_file_path = existing_file_path
-        self.duplicate_keys = duplicate_keys
+        self.engine = ConversionEngine(*args, progress_callback=self.progress.emit,
+                                       status_callback=self.status.emit,
+                                       stage_callback=self.stage.emit, **kwargs)
 
     def run(self):
-        try:
-            if self.append_mode and self.existing_file_path:
-                self.append_to_existing_file()
-            elif self.detect_similar:
-                grouped_files = self.group_similar_files(self.csv_files)
-                self.process_grouped_files(grouped_files)
-            elif self.combine_sheets:
-                self.status.emit("Creating combined Excel file...")
-                output_file = self.get_unique_filename(self.output_path)
-                with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-                    for i, csv_file in enumerate(self.csv_files):
-                        self.status.emit(f"Processing {os.path.basename(csv_file)}...")
-                        df = pd.read_csv(csv_file)
-                        if i < len(self.sheet_names) and self.sheet_names[i].strip():
-                            sheet_name = self.sheet_names[i].strip()
-                        else:
-                            sheet_name = Path(csv_file).stem
-                        sheet_name = self.sanitize_sheet_name(sheet_name)
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                        progress_value = int((i + 1) / len(self.csv_files) * 100)
-                        self.progress.emit(progress_value)
-                self.finished.emit(True, f"Successfully created combined Excel file: {output_file}")
-            else:
-                for i, csv_file in enumerate(self.csv_files):
-                    self.status.emit(f"Converting {os.path.basename(csv_file)}...")
-                    df = pd.read_csv(csv_file)
-                    csv_path = Path(csv_file)
-                    output_file = Path(self.output_path) / f"{csv_path.stem}.xlsx"
-                    final_output_path = self.get_unique_filename(output_file)
-                    df.to_excel(final_output_path, index=False)
-                    progress_value = int((i + 1) / len(self.csv_files) * 100)
-                    self.progress.emit(progress_value)
-                self.finished.emit(True, f"Successfully converted {len(self.csv_files)} files to Excel format")
-        except Exception as e:
-            self.finished.emit(False, f"Error during conversion: {str(e)}")
-
-    def get_unique_filename(self, file_path):
-        if self.override_mode:
-            return file_path
-
-        p = Path(file_path)
-        if not p.exists():
-            return file_path
-
-        parent = p.parent
-        stem = p.stem
-        suffix = p.suffix
-        counter = 1
-        while True:
-            new_stem = f"{stem}_updated_{counter}"
-            new_path = parent / f"{new_stem}{suffix}"
-            if not new_path.exists():
-                return new_path
-            counter += 1
-
-    def append_to_existing_file(self):
-        self.status.emit("Loading existing Excel file...")
-        
-        source_file = self.existing_file_path
-        if self.override_mode:
-            self.output_path = self.existing_file_path
-
-        if not os.path.exists(source_file):
-            self.finished.emit(False, f"Existing file not found: {source_file}")
-            return
-            
-        existing_sheets = pd.read_excel(source_file, sheet_name=None)
-        # --- FIX: Create a copy of the sheets to modify. This is the key change. ---
-        updated_sheets = existing_sheets.copy()
-        
-        total_files = len(self.csv_files)
-        duplicates_found = 0
-        new_rows_added = 0
-
-        for i, csv_file in enumerate(self.csv_files):
-            self.status.emit(f"Processing {os.path.basename(csv_file)} for append...")
-            new_df = pd.read_csv(csv_file)
-            
-            csv_stem = Path(csv_file).stem
-            
-            # Determine the target sheet name based on whether similar file detection is on
-            if self.detect_similar:
-                target_sheet_name = self.sanitize_sheet_name(self.extract_base_name(csv_stem))
-            else:
-                target_sheet_name = self.sanitize_sheet_name(csv_stem)
-
-            # Check if this sheet exists in our dictionary of sheets to be written
-            if target_sheet_name in updated_sheets:
-                # If it exists, merge the new data into it
-                existing_df = updated_sheets[target_sheet_name]
-                merged_df, file_duplicates, file_new_rows = self.merge_with_duplicate_detection(
-                    existing_df, new_df, csv_file
-                )
-                duplicates_found += file_duplicates
-                new_rows_added += file_new_rows
-                updated_sheets[target_sheet_name] = merged_df
-            else:
-                # If it's a new sheet, just add it
-                new_df["Source_File"] = os.path.basename(csv_file)
-                cols = new_df.columns.tolist()
-                cols = ["Source_File"] + [col for col in cols if col != "Source_File"]
-                new_df = new_df[cols]
-                updated_sheets[target_sheet_name] = new_df
-                new_rows_added += len(new_df)
-
-            progress_value = int((i + 1) / total_files * 100)
-            self.progress.emit(progress_value)
-
-        self.status.emit("Saving updated Excel file...")
-        final_output_path = self.get_unique_filename(self.output_path)
-        with pd.ExcelWriter(final_output_path, engine='openpyxl') as writer:
-            # Write all sheets from the updated_sheets dictionary, preserving unmodified ones
-            for sheet_name, df in updated_sheets.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        message = f"Successfully processed data. Added {new_rows_added} new rows, skipped {duplicates_found} duplicates. Saved to {os.path.basename(final_output_path)}"
-        self.finished.emit(True, message)
-
-    def merge_with_duplicate_detection(self, existing_df, new_df, source_file):
-        new_df = new_df.copy()
-        new_df["Source_File"] = os.path.basename(source_file)
-        if "Source_File" not in existing_df.columns:
-            existing_df["Source_File"] = "Unknown"
-        
-        original_columns = existing_df.columns.tolist()
-        all_columns = list(set(original_columns) | set(new_df.columns))
-        
-        new_df = new_df.reindex(columns=all_columns, fill_value="")
-        existing_df = existing_df.reindex(columns=all_columns, fill_value="")
-        
-        final_column_order = original_columns + [col for col in new_df.columns if col not in original_columns]
-        existing_df = existing_df[final_column_order]
-        new_df = new_df[final_column_order]
-        
-        if self.duplicate_keys:
-            check_cols = [col for col in self.duplicate_keys if col in new_df.columns]
-            if not check_cols:
-                check_cols = [col for col in final_column_order if col != "Source_File"]
+        success, message = self.engine.run()
+        if self.engine.cancelled:
+            self.cancelled.emit(message)
         else:
-            check_cols = [col for col in final_column_order if col != "Source_File"]
+            self.finished.emit(success, message)
 
-        existing_rows = set(tuple(row) for row in existing_df[check_cols].to_numpy())
-        
-        duplicates_mask = new_df[check_cols].apply(
-            lambda row: tuple(row) in existing_rows, axis=1
-        )
-        
-        duplicates_count = duplicates_mask.sum()
-        new_rows = new_df[~duplicates_mask]
-        new_rows_count = len(new_rows)
-        
-        merged_df = pd.concat([existing_df, new_rows], ignore_index=True, sort=False)
-        return merged_df, duplicates_count, new_rows_count
-
-    def group_similar_files(self, csv_files):
-        groups = defaultdict(list)
-        for file_path in csv_files:
-            file_name = Path(file_path).stem
-            base_name = self.extract_base_name(file_name)
-            groups[base_name].append(file_path)
-        return groups
-
-    def extract_base_name(self, file_name):
-        patterns = [
-            r'_\d{8}$', r'_\d{4}-\d{2}-\d{2}$', r'_\d{4}_\d{2}_\d{2}$', r'_\d{6}$',
-            r'_\d{4}$', r'-\d{8}$', r'-\d{4}-\d{2}-\d{2}$', r'-\d{4}_\d{2}_\d{2}$',
-            r'-\d{6}$', r'-\d{4}$', r'\d{8}$', r'\d{4}-\d{2}-\d{2}$',
-            r'\d{4}_\d{2}_\d{2}$', r'\d{6}$', r'_\d+$', r'-\d+$', r'\d+$'
-        ]
-        base_name = file_name
-        for pattern in patterns:
-            base_name = re.sub(pattern, '', base_name)
-        return base_name.rstrip('_-\t ')
-
-    def process_grouped_files(self, grouped_files):
-        if self.combine_sheets:
-            self.status.emit("Creating Excel file with merged similar files...")
-            output_file = self.get_unique_filename(self.output_path)
-            with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-                sheet_index = 0
-                total_groups = len(grouped_files)
-                for base_name, file_list in grouped_files.items():
-                    if len(file_list) > 1:
-                        self.status.emit(f"Merging {len(file_list)} similar files for '{base_name}'...")
-                        merged_df = self.merge_csv_files(file_list)
-                        sheet_name = self.sanitize_sheet_name(base_name)
-                        merged_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    else:
-                        csv_file = file_list[0]
-                        self.status.emit(f"Processing {os.path.basename(csv_file)}...")
-                        df = pd.read_csv(csv_file)
-                        if sheet_index < len(self.sheet_names) and self.sheet_names[sheet_index].strip():
-                            sheet_name = self.sheet_names[sheet_index].strip()
-                        else:
-                            sheet_name = Path(csv_file).stem
-                        sheet_name = self.sanitize_sheet_name(sheet_name)
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    sheet_index += 1
-                    progress_value = int(sheet_index / total_groups * 100)
-                    self.progress.emit(progress_value)
-            merged_count = sum(1 for files in grouped_files.values() if len(files) > 1)
-            self.finished.emit(True, f"Successfully created Excel file with {merged_count} merged groups: {os.path.basename(output_file)}")
-        else:
-            output_dir = Path(self.output_path)
-            total_groups = len(grouped_files)
-            processed_groups = 0
-            for base_name, file_list in grouped_files.items():
-                if len(file_list) > 1:
-                    self.status.emit(f"Merging {len(file_list)} similar files for '{base_name}'...")
-                    merged_df = self.merge_csv_files(file_list)
-                    output_file = output_dir / f"{base_name}_merged.xlsx"
-                    final_output_path = self.get_unique_filename(output_file)
-                    merged_df.to_excel(final_output_path, index=False)
-                else:
-                    csv_file = file_list[0]
-                    self.status.emit(f"Converting {os.path.basename(csv_file)}...")
-                    df = pd.read_csv(csv_file)
-                    csv_path = Path(csv_file)
-                    output_file = output_dir / f"{csv_path.stem}.xlsx"
-                    final_output_path = self.get_unique_filename(output_file)
-                    df.to_excel(final_output_path, index=False)
-                processed_groups += 1
-                progress_value = int(processed_groups / total_groups * 100)
-                self.progress.emit(progress_value)
-            merged_count = sum(1 for files in grouped_files.values() if len(files) > 1)
-            self.finished.emit(True, f"Successfully processed {total_groups} file groups with {merged_count} merged groups")
-
-    def merge_csv_files(self, file_list):
-        dataframes = []
-        for csv_file in file_list:
-            df = pd.read_csv(csv_file)
-            df['Source_File'] = os.path.basename(csv_file)
-            dataframes.append(df)
-        merged_df = pd.concat(dataframes, ignore_index=True, sort=False)
-        cols = merged_df.columns.tolist()
-        cols = ['Source_File'] + [col for col in cols if col != 'Source_File']
-        merged_df = merged_df[cols]
-        return merged_df
-
-    def sanitize_sheet_name(self, name):
-        invalid_chars = ['\\', '/', '?', '*', '[', ']', ':']
-        for char in invalid_chars:
-            name = name.replace(char, '_')
-        if len(name) > 31:
-            name = name[:31]
-        return name
+    def cancel(self):
+        """Stop the conversion before its next file or chunk"""
+        self.engine.cancel()
 
 class CSVToExcelConverter(QMainWindow):
     def __init__(self):
         super().__init__()
         self.csv_files = []
+        self.folder_manifest = None
         self.output_path = ""
         self.existing_file_path = ""
         self.worker = None
+        # (stage, item) -> latest stage record of the running conversion
+        self.stage_records = {}
         self.init_ui()
 
     def init_ui(self):
@@ -365,6 +134,43 @@ class CSVToExcelConverter(QMainWindow):
         self.sheet_names_text.setPlaceholderText("Enter sheet names, one per line...")
         new_file_layout.addWidget(self.sheet_names_label)
         new_file_layout.addWidget(self.sheet_names_text)
+        self.streaming_checkbox = QCheckBox("Stream large CSVs in chunks (low memory usage)")
+        self.streaming_checkbox.setChecked(False)
+        new_file_layout.addWidget(self.streaming_checkbox)
+        self.fast_writer_checkbox = QCheckBox("Write with xlsxwriter (faster, constant memory; when installed)")
+        self.fast_writer_checkbox.setChecked(False)
+        new_file_layout.addWidget(self.fast_writer_checkbox)
+        formats_layout = QHBoxLayout()
+        formats_layout.addWidget(QLabel("Output files (Parquet and Feather need pyarrow):"))
+        self.formats_combo = QComboBox()
+        for label, formats in (("Excel only", ("xlsx",)),
+                               ("Excel + Parquet", ("xlsx", "parquet")),
+                               ("Excel + Feather", ("xlsx", "feather")),
+                               ("Parquet only", ("parquet",)),
+                               ("Feather only", ("feather",))):
+            self.formats_combo.addItem(label, formats)
+        formats_layout.addWidget(self.formats_combo)
+        formats_layout.addStretch()
+        new_file_layout.addLayout(formats_layout)
+        self.workers_widget = QWidget()
+        workers_layout = QHBoxLayout(self.workers_widget)
+        workers_layout.setContentsMargins(0, 0, 0, 0)
+        workers_layout.addWidget(QLabel("Parallel worker processes (one Excel file per CSV or group):"))
+        self.workers_spinbox = QSpinBox()
+        self.workers_spinbox.setRange(1, os.cpu_count() or 1)
+        self.workers_spinbox.setValue(1)
+        workers_layout.addWidget(self.workers_spinbox)
+        workers_layout.addStretch()
+        self.workers_widget.setVisible(False)
+        new_file_layout.addWidget(self.workers_widget)
+        self.skip_unchanged_checkbox = QCheckBox("Skip CSVs whose Excel file is already up to date")
+        self.skip_unchanged_checkbox.setChecked(False)
+        self.skip_unchanged_checkbox.setVisible(False)
+        new_file_layout.addWidget(self.skip_unchanged_checkbox)
+        self.resume_checkbox = QCheckBox("Resume interrupted conversions where they left off")
+        self.resume_checkbox.setChecked(False)
+        self.resume_checkbox.setVisible(False)
+        new_file_layout.addWidget(self.resume_checkbox)
         self.output_new_layout = QHBoxLayout()
         self.output_new_label = QLabel("No output location selected")
         self.output_new_button = QPushButton("Select Output Location")
@@ -415,6 +221,50 @@ class CSVToExcelConverter(QMainWindow):
         self.duplicate_keys_input.setPlaceholderText("e.g., ID,Name,Date")
         options_layout.addWidget(self.duplicate_keys_label)
         options_layout.addWidget(self.duplicate_keys_input)
+        self.duplicate_match_widget = QWidget()
+        duplicate_match_layout = QHBoxLayout(self.duplicate_match_widget)
+        duplicate_match_layout.setContentsMargins(0, 0, 0, 0)
+        duplicate_match_layout.addWidget(QLabel("Compare keys:"))
+        self.duplicate_match_combo = QComboBox()
+        for label, match in (("Exactly", "exact"),
+                             ("Ignoring case, spacing and rounding", "normalized"),
+                             ("Also similar text (fuzzy)", "fuzzy")):
+            self.duplicate_match_combo.addItem(label, match)
+        self.duplicate_match_combo.currentIndexChanged.connect(self.update_ui_state)
+        duplicate_match_layout.addWidget(self.duplicate_match_combo)
+        self.match_threshold_label = QLabel("Minimum similarity:")
+        duplicate_match_layout.addWidget(self.match_threshold_label)
+        self.match_threshold_spinbox = QSpinBox()
+        self.match_threshold_spinbox.setRange(50, 100)
+        self.match_threshold_spinbox.setValue(90)
+        self.match_threshold_spinbox.setSuffix(" %")
+        duplicate_match_layout.addWidget(self.match_threshold_spinbox)
+        duplicate_match_layout.addStretch()
+        options_layout.addWidget(self.duplicate_match_widget)
+
+        self.schema_cache_checkbox = QCheckBox("Remember column types of recurring files (faster, consistent types)")
+        self.schema_cache_checkbox.setChecked(False)
+        options_layout.addWidget(self.schema_cache_checkbox)
+
+        csv_engine_layout = QHBoxLayout()
+        csv_engine_layout.addWidget(QLabel("CSV parser:"))
+        self.csv_engine_combo = QComboBox()
+        labels = {"c": "Default (one CPU core)",
+                  "pyarrow": "Parse CSVs on all CPU cores (uses pyarrow when installed)",
+                  "parallel": "Split very large CSVs into parts parsed by all CPU cores"}
+        for engine in CSV_ENGINES:
+            self.csv_engine_combo.addItem(labels[engine], engine)
+        csv_engine_layout.addWidget(self.csv_engine_combo)
+        csv_engine_layout.addStretch()
+        options_layout.addLayout(csv_engine_layout)
+
+        self.changed_only_checkbox = QCheckBox("Only convert files that are new or changed since the last run (folder selection)")
+        self.changed_only_checkbox.setChecked(False)
+        options_layout.addWidget(self.changed_only_checkbox)
+
+        self.stage_log_checkbox = QCheckBox("Save stage timings and memory use to a log file")
+        self.stage_log_checkbox.setChecked(False)
+        options_layout.addWidget(self.stage_log_checkbox)
         
         main_layout.addWidget(options_group)
         
@@ -432,7 +282,14 @@ class CSVToExcelConverter(QMainWindow):
         convert_font.setPointSize(12)
         convert_font.setBold(True)
         self.convert_button.setFont(convert_font)
-        main_layout.addWidget(self.convert_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        self.cancel_button.setMinimumHeight(40)
+        self.cancel_button.setEnabled(False)
+        convert_layout = QHBoxLayout()
+        convert_layout.addWidget(self.convert_button, 3)
+        convert_layout.addWidget(self.cancel_button, 1)
+        main_layout.addLayout(convert_layout)
         log_group = QGroupBox("Log")
         log_layout = QVBoxLayout(log_group)
         self.log_text = QTextEdit()
@@ -450,6 +307,7 @@ class CSVToExcelConverter(QMainWindow):
         else:
             self.csv_button.setText("Select Folder")
         self.csv_files = []
+        self.folder_manifest = None
         self.csv_label.setText("No CSV files selected")
         self.file_list.clear()
         self.update_ui_state()
@@ -469,16 +327,22 @@ class CSVToExcelConverter(QMainWindow):
 
     def select_csv_files(self):
         if self.files_radio.isChecked():
-            files, _ = QFileDialog.getOpenFileNames(self, "Select CSV Files", "", "CSV Files (*.csv);;All Files (*)")
+            files, _ = QFileDialog.getOpenFileNames(
+                self, "Select CSV Files", "",
+                "CSV Files (*.csv *.csv.gz *.csv.bz2 *.csv.xz *.csv.zst *.zip);;All Files (*)")
+            # A zip archive stands for the CSVs inside it
+            files = [csv_file for file_path in files for csv_file in csv_sources.expand(file_path)]
             if files:
                 self.csv_files = files
+                self.folder_manifest = None
                 self.csv_label.setText(f"{len(files)} CSV file(s) selected")
                 self.update_file_list()
                 self.log(f"Selected {len(files)} CSV files")
         else:
             folder = QFileDialog.getExistingDirectory(self, "Select Folder to Search for CSV Files")
             if folder:
-                self.csv_files = self.find_csv_files_recursive(folder)
+                self.folder_manifest = FileManifest(folder)
+                self.csv_files = self.folder_manifest.scan()
                 if self.csv_files:
                     self.csv_label.setText(f"{len(self.csv_files)} CSV file(s) found in folder")
                     self.update_file_list()
@@ -491,13 +355,6 @@ class CSVToExcelConverter(QMainWindow):
             self.preview_similar_files()
         self.update_ui_state()
 
-    def find_csv_files_recursive(self, folder_path):
-        csv_files = []
-        folder = Path(folder_path)
-        for csv_file in folder.rglob("*.csv"):
-            csv_files.append(str(csv_file))
-        return sorted(csv_files)
-
     def update_file_list(self):
         self.file_list.clear()
         for file_path in self.csv_files:
@@ -535,31 +392,15 @@ class CSVToExcelConverter(QMainWindow):
     def preview_similar_files(self):
         if not self.csv_files:
             return
-        groups = defaultdict(list)
-        for file_path in self.csv_files:
-            file_name = Path(file_path).stem
-            base_name = self.extract_base_name_preview(file_name)
-        groups[base_name].append(os.path.basename(file_path))
+        groups = group_similar_files(self.csv_files)
         similar_groups = {k: v for k, v in groups.items() if len(v) > 1}
         if similar_groups:
             self.log("Similar files detected:")
             for base_name, files in similar_groups.items():
-                self.log(f"  Group '{base_name}': {', '.join(files)}")
+                self.log(f"  Group '{base_name}': {', '.join(os.path.basename(f) for f in files)}")
         else:
             self.log("No similar files detected for merging.")
 
-    def extract_base_name_preview(self, file_name):
-        patterns = [
-            r'_\d{8}$', r'_\d{4}-\d{2}-\d{2}$', r'_\d{4}_\d{2}_\d{2}$', r'_\d{6}$',
-            r'_\d{4}$', r'-\d{8}$', r'-\d{4}-\d{2}-\d{2}$', r'-\d{4}_\d{2}_\d{2}$',
-            r'-\d{6}$', r'-\d{4}$', r'\d{8}$', r'\d{4}-\d{2}-\d{2}$',
-            r'\d{4}_\d{2}_\d{2}$', r'\d{6}$', r'_\d+$', r'-\d+$', r'\d+$'
-        ]
-        base_name = file_name
-        for pattern in patterns:
-            base_name = re.sub(pattern, '', base_name)
-        return base_name.rstrip('_-\t ')
-
     def on_detect_similar_changed(self):
         if self.detect_similar_checkbox.isChecked() and self.csv_files:
             self.preview_similar_files()
@@ -569,6 +410,9 @@ class CSVToExcelConverter(QMainWindow):
         is_combine = self.combine_checkbox.isChecked()
         self.sheet_names_label.setVisible(is_combine)
         self.sheet_names_text.setVisible(is_combine)
+        self.workers_widget.setVisible(not is_combine)
+        self.skip_unchanged_checkbox.setVisible(not is_combine)
+        self.resume_checkbox.setVisible(not is_combine)
         self.output_path = ""
         self.output_new_label.setText("No output location selected")
         self.update_ui_state()
@@ -586,6 +430,10 @@ class CSVToExcelConverter(QMainWindow):
         # Show duplicate key input only when appending/merging
         self.duplicate_keys_label.setVisible(is_append_mode)
         self.duplicate_keys_input.setVisible(is_append_mode)
+        self.duplicate_match_widget.setVisible(is_append_mode)
+        is_fuzzy = self.duplicate_match_combo.currentData() == "fuzzy"
+        self.match_threshold_label.setVisible(is_fuzzy)
+        self.match_threshold_spinbox.setVisible(is_fuzzy)
 
         has_files = len(self.csv_files) > 0
         ready_to_convert = False
@@ -609,6 +457,9 @@ class CSVToExcelConverter(QMainWindow):
         else:
             self.status_label.setText("Ready to convert")
 
+    def csv_engine(self):
+        return self.csv_engine_combo.currentData()
+
     def start_conversion(self):
         self.update_ui_state() 
         if not self.convert_button.isEnabled():
@@ -642,14 +493,30 @@ class CSVToExcelConverter(QMainWindow):
             self.append_file_radio.isChecked(),
             self.override_checkbox.isChecked(),
             self.existing_file_path,
-            duplicate_keys
+            duplicate_keys,
+            streaming=self.new_file_radio.isChecked() and self.streaming_checkbox.isChecked(),
+            max_workers=self.workers_spinbox.value(),
+            schema_cache_path=SCHEMA_CACHE_PATH if self.schema_cache_checkbox.isChecked() else None,
+            csv_engine=self.csv_engine(),
+            manifests=[self.folder_manifest] if self.folder_manifest and self.changed_only_checkbox.isChecked() else None,
+            conversion_cache_path=CONVERSION_CACHE_PATH if self.skip_unchanged_checkbox.isChecked() else None,
+            writer_engine="xlsxwriter" if self.fast_writer_checkbox.isChecked() else "openpyxl",
+            output_formats=self.formats_combo.currentData() if self.new_file_radio.isChecked() else ("xlsx",),
+            duplicate_match=self.duplicate_match_combo.currentData(),
+            match_threshold=self.match_threshold_spinbox.value() / 100,
+            stage_log_path=STAGE_LOG_PATH if self.stage_log_checkbox.isChecked() else None,
+            journal_dir=JOURNAL_DIR if self.new_file_radio.isChecked() and self.resume_checkbox.isChecked() else None
         )
+        self.stage_records = {}
 
         self.worker.progress.connect(self.progress_bar.setValue)
         self.worker.status.connect(self.status_label.setText)
+        self.worker.stage.connect(self.on_stage_record)
         self.worker.finished.connect(self.on_conversion_finished)
+        self.worker.cancelled.connect(self.on_conversion_cancelled)
 
         self.worker.start()
+        self.cancel_button.setEnabled(True)
 
         mode_desc = "append mode" if self.append_file_radio.isChecked() else "new file mode"
         similar_desc = " with similar file detection" if self.detect_similar_checkbox.isChecked() else ""
@@ -659,28 +526,67 @@ class CSVToExcelConverter(QMainWindow):
         
         self.log(f"Starting {mode_desc}{similar_desc}{override_desc}...")
 
+    def on_stage_record(self, record):
+        self.stage_records[(record["stage"], record["item"])] = record
+
+    def cancel_conversion(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling after the current file or chunk...")
+        self.log("Cancelling...")
+
     def on_conversion_finished(self, success, message):
         """Handle conversion completion"""
-        # Re-enable UI
-        self.convert_button.setEnabled(True)
-        self.csv_button.setEnabled(True)
-        self.output_new_button.setEnabled(True)
-        self.existing_file_button.setEnabled(True)
-        self.output_copy_button.setEnabled(True)
+        self.enable_inputs()
 
         if success:
             self.progress_bar.setValue(100)
             self.status_label.setText("Conversion completed successfully!")
             self.log("✓ " + message)
-            QMessageBox.information(self, "Success", message)
         else:
             self.status_label.setText("Conversion failed!")
             self.log("✗ " + message)
+        self.log_stage_summary()
+
+        if success:
+            QMessageBox.information(self, "Success", message)
+        else:
             QMessageBox.critical(self, "Error", message)
 
         self.worker = None
         self.update_ui_state()
 
+    def on_conversion_cancelled(self, message):
+        """Handle a conversion stopped with the Cancel button"""
+        self.enable_inputs()
+        self.status_label.setText("Conversion cancelled")
+        self.log("■ " + message)
+        self.log_stage_summary()
+
+        QMessageBox.information(self, "Cancelled", message)
+
+        self.worker = None
+        self.update_ui_state()
+
+    def enable_inputs(self):
+        """Re-enable the controls that are locked while a conversion runs"""
+        self.cancel_button.setEnabled(False)
+        self.convert_button.setEnabled(True)
+        self.csv_button.setEnabled(True)
+        self.output_new_button.setEnabled(True)
+        self.existing_file_button.setEnabled(True)
+        self.output_copy_button.setEnabled(True)
+
+    def log_stage_summary(self):
+        if self.stage_records:
+            self.log("Stage summary:")
+            for line in summary_lines(summarize(self.stage_records.values())):
+                self.log("  " + line)
+            if self.stage_log_checkbox.isChecked():
+                self.log(f"  (saved to {STAGE_LOG_PATH})")
+
     def log(self, message):
         """Add message to log area"""
         self.log_text.append(message)
@@ -706,4 +612,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Needed for the conversion process pool in frozen Windows builds
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark for appending to one sheet of a workbook with many sheets.
+
+Writes a workbook of --sheets sheets of --rows rows each and a CSV of new
+rows (half of them duplicates) for one of its sheets, then appends the CSV
+with ConversionEngine in override mode with duplicate keys. The "cold" run
+has no duplicate index yet, so the existing rows of the touched sheet have
+to be parsed; the "warm" run appends again with the index the cold run
+left behind. Only the touched sheet should be parsed, so neither run should
+grow with the number of sheets.
+
+Before timing, rows are appended to small workbooks whose sheet XML is
+written in less common ways (elements with a namespace prefix, rows and
+cells without r attributes), and read back to check them.
+
+Usage: python bench_append.py [--sheets 40] [--rows 20000]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, APP_DIR)
+import excel_writers
+from conversion_engine import ConversionEngine
+from key_index import KeyIndex
+from xlsx_append import MAIN_NS, XlsxAppender
+
+
+def make_frame(rows, start=0, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ID": np.arange(start, start + rows),
+        "Amount": rng.integers(0, 100_000, rows) / 100,
+        "Region": rng.choice(["north", "south", "east", "west"], rows),
+    })
+
+
+def make_workbook(path, sheets, rows):
+    with pd.ExcelWriter(path, engine="xlsxwriter" if excel_writers.xlsxwriter_available() else "openpyxl") as writer:
+        for i in range(sheets):
+            make_frame(rows, seed=i).to_excel(writer, sheet_name=f"sheet{i}", index=False)
+
+
+def with_prefix(xml):
+    """<worksheet xmlns="..."><row> -> <x:worksheet xmlns:x="..."><x:row>"""
+    xml = xml.replace(f'xmlns="{MAIN_NS}"', f'xmlns:x="{MAIN_NS}"')
+    return re.sub(r"<(/?)(?!\?)(\w+)(?=[\s>/])", r"<\1x:\2", xml)
+
+
+def without_refs(xml):
+    return re.sub(r'<(row|c)\b([^>]*?)\sr="[^"]*"', r"<\1\2", xml)
+
+
+# Ways to write a worksheet that Excel reads, and XlsxAppender has to append to
+SHEET_LAYOUTS = {
+    "prefixed": with_prefix,
+    "without r": without_refs,
+    "prefixed without r": lambda xml: with_prefix(without_refs(xml)),
+}
+
+
+def check_layouts(tmp):
+    plain = os.path.join(tmp, "plain.xlsx")
+    make_frame(3).to_excel(plain, sheet_name="data", index=False)
+    for label, rewrite in SHEET_LAYOUTS.items():
+        workbook = os.path.join(tmp, "layout.xlsx")
+        with zipfile.ZipFile(plain) as source, zipfile.ZipFile(workbook, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                data = source.read(info)
+                if info.filename == "xl/worksheets/sheet1.xml":
+                    data = rewrite(data.decode("utf-8")).encode("utf-8")
+                target.writestr(info, data)
+        appender = XlsxAppender(workbook)
+        appender.append_rows("data", [[3, 1.5, "north", "new"]], ["Extra"])
+        appender.save()
+        df = pd.read_excel(workbook)
+        if df.columns.tolist() != ["ID", "Amount", "Region", "Extra"] or df["ID"].tolist() != [0, 1, 2, 3]:
+            raise AssertionError(f"Append to a sheet {label}: got\n{df}")
+
+
+def append(workbook, csv_file):
+    # Override mode, without detect-similar, so sheet0.csv goes to the sheet "sheet0"
+    engine = ConversionEngine([csv_file], workbook, True, [], False, True, True, workbook, ["ID"])
+    start = time.perf_counter()
+    success, message = engine.run()
+    if not success:
+        raise RuntimeError(message)
+    return time.perf_counter() - start, message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=20_000, help="rows per existing sheet")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        check_layouts(tmp)
+        template = os.path.join(tmp, "template.xlsx")
+        start = time.perf_counter()
+        make_workbook(template, args.sheets, args.rows)
+        print(f"Wrote {args.sheets} sheets of {args.rows} rows in {time.perf_counter() - start:.1f} s")
+        csv_file = os.path.join(tmp, "sheet0.csv")
+        make_frame(args.rows // 2, start=args.rows - args.rows // 4, seed=99).to_csv(csv_file, index=False)
+
+        workbook = os.path.join(tmp, "master.xlsx")
+        shutil.copyfile(template, workbook)
+        for run in ("cold", "warm"):
+            if run == "cold" and os.path.exists(KeyIndex.index_path(workbook)):
+                os.remove(KeyIndex.index_path(workbook))
+            seconds, message = append(workbook, csv_file)
+            print(f"{run:>5}: {seconds:6.2f} s  {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark for conversion_tasks.read_csv with the C, the pyarrow and the
+parallel engine. Parses a tall file (many rows, few columns) and a wide file
+(few rows, many columns) with each engine and checks that they return
+identical frames. Before timing, a few small files that Arrow would read
+differently (hexadecimal text, integers written as +5, ...) are checked to
+come out the same as well. The parallel engine is timed on the whole file whatever
+its size, with --workers processes (default: one per core).
+
+Usage: python bench_csv_engine.py [--tall-rows 2000000] [--wide-rows 20000]
+                                  [--wide-cols 400] [--repeat 3] [--workers N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import conversion_tasks
+import parallel_csv
+
+
+def make_frame(rows, cols, seed=0):
+    """Mixed columns: integers, floats with blanks, low-cardinality text, dates"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 4
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            values = rng.integers(0, 100_000, rows) / 100
+            values[rng.random(rows) < 0.05] = np.nan
+            data[f"float_{i}"] = values
+        elif kind == 2:
+            data[f"text_{i}"] = rng.choice(["alpha", "beta", "gamma", "delta", "with, comma"], rows)
+        else:
+            days = rng.integers(0, 3650, rows)
+            data[f"date_{i}"] = (np.datetime64("2015-01-01") + days).astype(str)
+    return pd.DataFrame(data)
+
+
+# Columns Arrow types differently than the C parser, which read_csv has to catch
+EDGE_CASES = {
+    "hex": ["0x10", "0xff"],
+    "plus": ["+5", "+1"],
+    "late_hex": ["1"] * 20_000 + ["0x10"],
+    "late_plus": ["1"] * 20_000 + ["+5"],
+    "repeated_names": None,
+    "header_only": [],
+}
+
+
+def check_edge_cases(tmp):
+    for label, values in EDGE_CASES.items():
+        csv_file = os.path.join(tmp, f"{label}.csv")
+        with open(csv_file, "w") as f:
+            if values is None:
+                f.write("a,a\n1,2\n")
+            else:
+                f.write("a,b\n" + "".join(f"{value},1\n" for value in values))
+        pd.testing.assert_frame_equal(conversion_tasks.read_csv(csv_file),
+                                      conversion_tasks.read_csv(csv_file, csv_engine="pyarrow"),
+                                      obj=label)
+
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tall-rows", type=int, default=2_000_000)
+    parser.add_argument("--tall-cols", type=int, default=8)
+    parser.add_argument("--wide-rows", type=int, default=20_000)
+    parser.add_argument("--wide-cols", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per engine, the best one is reported")
+    parser.add_argument("--workers", type=int, default=parallel_csv.parse_workers(),
+                        help="processes for the parallel engine (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not conversion_tasks.arrow_available():
+        sys.exit("pyarrow is not installed; both engines would use the C parser")
+
+    shapes = [("tall", args.tall_rows, args.tall_cols), ("wide", args.wide_rows, args.wide_cols)]
+    print(f"{'file':>6} {'rows':>10} {'cols':>5} {'MB':>7} {'c s':>8} {'pyarrow s':>10} {'speedup':>8} "
+          f"{'parallel s':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        check_edge_cases(tmp)
+        for label, rows, cols in shapes:
+            csv_file = os.path.join(tmp, f"{label}.csv")
+            make_frame(rows, cols).to_csv(csv_file, index=False)
+            size_mb = os.path.getsize(csv_file) / 1e6
+
+            c_time, c_df = best_time(lambda: conversion_tasks.read_csv(csv_file), args.repeat)
+            arrow_time, arrow_df = best_time(
+                lambda: conversion_tasks.read_csv(csv_file, csv_engine="pyarrow"), args.repeat)
+            pd.testing.assert_frame_equal(c_df, arrow_df)
+            parallel_time, parallel_df = best_time(
+                lambda: parallel_csv.read_csv(csv_file, workers=args.workers), args.repeat)
+            pd.testing.assert_frame_equal(c_df, parallel_df)
+
+            print(f"{label:>6} {rows:>10} {cols:>5} {size_mb:>7.1f} {c_time:>8.2f} {arrow_time:>10.2f} "
+                  f"{c_time / arrow_time:>7.1f}x {parallel_time:>11.2f} {c_time / parallel_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
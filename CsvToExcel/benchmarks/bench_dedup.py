@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark for ConversionEngine.merge_into_indexed_sheet, the duplicate check
+of an append: the existing sheet is indexed like index_sheet() does and the
+new CSV is merged into it.
+Compares the old tuple/set lookup with the hashed key lookup and checks
+that both report the same number of duplicates and new rows. With --match
+normalized or fuzzy, times that duplicate match mode instead (the legacy
+lookup only does exact matching, so it is skipped).
+
+With --files N, the new rows arrive as N CSVs for the same sheet instead,
+and the running KeySet of an append is compared with re-running isin()
+against all hashes collected so far for every file.
+
+Usage: python bench_dedup.py [--sizes 10000 1000000 10000000] [--legacy-limit N] [--match fuzzy]
+       python bench_dedup.py --sizes 1000000 --files 1000
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from conversion_engine import ConversionEngine
+from key_index import KeyIndex, KeySet
+from near_duplicates import DUPLICATE_MATCHES
+
+
+def make_frames(rows, seed=0):
+    """Existing sheet with `rows` rows and a new CSV half made of duplicates"""
+    rng = np.random.default_rng(seed)
+    existing = pd.DataFrame({
+        "ID": np.arange(rows),
+        "Name": rng.choice(["alpha", "beta", "gamma", "delta"], rows),
+        "Amount": rng.integers(0, 10000, rows) / 100,
+    })
+    existing["Source_File"] = "existing.csv"
+    fresh = pd.DataFrame({
+        "ID": np.arange(rows, rows + rows // 2),
+        "Name": rng.choice(["alpha", "beta", "gamma", "delta"], rows // 2),
+        "Amount": rng.integers(0, 10000, rows // 2) / 100,
+    })
+    repeated = existing.drop(columns="Source_File").sample(rows - rows // 2, random_state=seed)
+    new = pd.concat([fresh, repeated], ignore_index=True)
+    return existing, new
+
+
+def legacy_merge(existing_df, new_df, check_cols):
+    existing_rows = set(tuple(row) for row in existing_df[check_cols].to_numpy())
+    duplicates_mask = new_df[check_cols].apply(lambda row: tuple(row) in existing_rows, axis=1)
+    new_rows = new_df[~duplicates_mask]
+    return int(duplicates_mask.sum()), len(new_rows)
+
+
+def make_engine(duplicate_keys, match="exact"):
+    return ConversionEngine([], "", False, [], False, True, True, "", duplicate_keys, duplicate_match=match)
+
+
+def indexed_merge(engine, existing_df, new_df):
+    """(duplicates, new rows) of appending new_df to a sheet holding existing_df"""
+    key_index = KeyIndex("bench.xlsx")
+    check_cols = engine.duplicate_check_columns(existing_df.columns.tolist())
+    hashes, keys = engine.index_rows(existing_df, check_cols)
+    key_index.set_sheet("Sheet1", existing_df.columns, check_cols, len(existing_df), hashes,
+                        engine.match_spec(), keys)
+    return engine.merge_into_indexed_sheet(key_index, "Sheet1", new_df, "new.csv", defaultdict(list), "bench.xlsx")
+
+
+def run(rows, legacy_limit, match="exact"):
+    existing, new = make_frames(rows)
+    results = []
+    for keys in (["ID"], []):
+        label = ",".join(keys) or "all columns"
+        engine = make_engine(keys, match)
+
+        start = time.perf_counter()
+        duplicates, added = indexed_merge(engine, existing, new)
+        hashed_time = time.perf_counter() - start
+
+        legacy_time = None
+        if rows <= legacy_limit and match == "exact":
+            check_cols = keys or ["ID", "Name", "Amount"]
+            start = time.perf_counter()
+            legacy_duplicates, legacy_added = legacy_merge(existing, new, check_cols)
+            legacy_time = time.perf_counter() - start
+            if (legacy_duplicates, legacy_added) != (duplicates, added):
+                raise AssertionError(f"Mismatch for {rows} rows ({label}): "
+                                     f"legacy {legacy_duplicates}/{legacy_added}, hashed {duplicates}/{added}")
+        results.append((rows, label, legacy_time, hashed_time, len(new)))
+    return results
+
+
+def run_files(rows, files):
+    """Seconds to dedup the new rows split into files batches: (per-file isin, running KeySet)"""
+    existing, new = make_frames(rows)
+    engine = make_engine(["ID"])
+    existing_keys = engine.hash_key_rows(existing, ["ID"]).to_numpy()
+    new = new.assign(Source_File="new.csv")
+    bounds = np.linspace(0, len(new), files + 1).astype(int)
+    batches = [new.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    start = time.perf_counter()
+    hashes = existing_keys
+    legacy_new = 0
+    for batch in batches:
+        keys = engine.hash_key_rows(batch, ["ID"])
+        mask = keys.isin(hashes) | keys.duplicated()
+        hashes = np.concatenate([hashes, keys[~mask].to_numpy()])
+        legacy_new += int((~mask).sum())
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    key_set = KeySet(existing_keys)
+    running_new = 0
+    for batch in batches:
+        keys = engine.hash_key_rows(batch, ["ID"])
+        mask = engine.duplicate_mask(key_set, batch, keys, ["ID"])
+        key_set.add(keys[~mask].to_numpy())
+        running_new += int((~mask).sum())
+    running_time = time.perf_counter() - start
+    if legacy_new != running_new:
+        raise AssertionError(f"Mismatch for {rows} rows in {files} files: {legacy_new} vs {running_new} new rows")
+    return legacy_time, running_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=1_000_000,
+                        help="skip the slow legacy lookup above this many rows")
+    parser.add_argument("--match", choices=DUPLICATE_MATCHES, default="exact",
+                        help="duplicate match mode to time (default: %(default)s)")
+    parser.add_argument("--files", type=int, default=0,
+                        help="split the new rows into this many CSVs for the same sheet")
+    args = parser.parse_args()
+
+    if args.files:
+        print(f"{'rows':>10} {'files':>6} {'per-file isin s':>16} {'KeySet s':>10} {'speedup':>8}")
+        for rows in args.sizes:
+            legacy_time, running_time = run_files(rows, args.files)
+            print(f"{rows:>10} {args.files:>6} {legacy_time:>16.2f} {running_time:>10.2f} "
+                  f"{legacy_time / running_time:>7.1f}x")
+        return
+
+    print(f"{'rows':>10} {'keys':>12} {'legacy rows/s':>15} {'hashed rows/s':>15} {'speedup':>8}")
+    for rows in args.sizes:
+        for rows, label, legacy_time, hashed_time, new_count in run(rows, args.legacy_limit, args.match):
+            hashed_rate = new_count / hashed_time
+            if legacy_time is None:
+                legacy_col, speedup = "skipped", "-"
+            else:
+                legacy_col = f"{new_count / legacy_time:,.0f}"
+                speedup = f"{legacy_time / hashed_time:.1f}x"
+            print(f"{rows:>10} {label:>12} {legacy_col:>15} {hashed_rate:>15,.0f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark for the CSV to Excel converter modules.
+Each module is imported in a fresh interpreter several times and the
+median wall time is reported, together with whether pandas was loaded.
+With --max-ms the script exits with status 1 if the engine or the CLI
+take longer than that, so it can guard startup time in CI.
+
+Usage: python bench_import.py [--repeat 7] [--max-ms 150]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# (label, module, checked against --max-ms)
+MODULES = [
+    ("python (baseline)", None, False),
+    ("conversion_engine", "conversion_engine", True),
+    ("csv_to_excel_cli", "csv_to_excel_cli", True),
+    ("CsvConverter (GUI)", "CsvConverter", False),
+    ("pandas", "pandas", False),
+]
+
+
+def time_import(module, repeat):
+    code = "import sys"
+    if module:
+        code += f"; import {module}; print('pandas' in sys.modules)"
+    timings = []
+    pandas_loaded = False
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR,
+                                capture_output=True, text=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        pandas_loaded = result.stdout.strip() == "True"
+    return statistics.median(timings), pandas_loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--max-ms", type=float, help="fail if the engine or CLI import takes longer")
+    args = parser.parse_args()
+
+    too_slow = []
+    print(f"{'module':<22} {'median ms':>10} {'pandas loaded':>14}")
+    for label, module, checked in MODULES:
+        median, pandas_loaded = time_import(module, args.repeat)
+        if median is None:
+            print(f"{label:<22} {'skipped':>10}   ({pandas_loaded})")
+            continue
+        print(f"{label:<22} {median:>10.1f} {str(pandas_loaded):>14}")
+        if checked and args.max_ms is not None and median > args.max_ms:
+            too_slow.append(label)
+
+    if too_slow:
+        print(f"Import time above {args.max_ms} ms: {', '.join(too_slow)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
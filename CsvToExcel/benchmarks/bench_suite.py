@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite for ConversionEngine, the code ConversionWorker
+runs on its thread, so no display is needed.
+
+Generates synthetic CSVs (a tall file, a wide file, many small files,
+groups of similar file names and a batch full of duplicates of an existing
+workbook) and times each conversion mode on them: combine, one file per
+CSV, detect-similar (combined and per group, in memory and streaming) and
+append with and without duplicate key columns. Every run happens in a fresh
+process; the suite reports wall time, rows per second and peak resident
+memory (reset just before the conversion on Linux, the whole process
+elsewhere).
+
+Save the results with --json and pass that file as --baseline on a later
+run to see how a change affected each scenario.
+
+Usage: python bench_suite.py [--scale 1.0] [--repeat 1] [--only combine_tall append_keys]
+                             [--writer openpyxl] [--csv-engine c] [--json results.json]
+                             [--baseline old.json] [--data-dir DIR]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, APP_DIR)
+from conversion_engine import ConversionEngine
+from conversion_tasks import CSV_ENGINES
+from excel_writers import WRITER_ENGINES
+
+# Rows of each dataset at --scale 1
+TALL_ROWS = 50_000
+WIDE_ROWS, WIDE_COLS = 2_000, 200
+SMALL_FILES, SMALL_ROWS = 100, 300
+SIMILAR_BASES, SIMILAR_FILES, SIMILAR_ROWS = ("sales", "orders", "stock", "visits"), 8, 1_000
+MASTER_ROWS, NEW_FILES, NEW_ROWS = 20_000, 4, 5_000
+
+# name -> (dataset, engine options, description)
+SCENARIOS = {
+    "combine_tall": ("tall", {"combine_sheets": True}, "one tall CSV into a combined workbook"),
+    "combine_tall_stream": ("tall", {"combine_sheets": True, "streaming": True}, "the same, streaming"),
+    "combine_wide": ("wide", {"combine_sheets": True}, "one wide CSV into a combined workbook"),
+    "combine_many_small": ("many_small", {"combine_sheets": True}, "many small CSVs, one sheet each"),
+    "per_file_many_small": ("many_small", {}, "many small CSVs, one workbook each"),
+    "similar_combine": ("similar", {"combine_sheets": True, "detect_similar": True},
+                        "similar names merged into one sheet per group"),
+    "similar_combine_stream": ("similar", {"combine_sheets": True, "detect_similar": True, "streaming": True},
+                               "the same, streaming"),
+    "similar_per_group": ("similar", {"detect_similar": True}, "similar names merged into one workbook per group"),
+    "append": ("duplicates", {"append_mode": True}, "half-duplicate batch appended, full-row duplicate check"),
+    "append_keys": ("duplicates", {"append_mode": True, "duplicate_keys": ["ID"]},
+                    "half-duplicate batch appended, duplicates by ID"),
+}
+
+
+def make_frame(rows, cols, rng, first_id=0):
+    """An ID column followed by integers, decimals, short text and date strings"""
+    data = {"ID": np.arange(first_id, first_id + rows)}
+    for i in range(1, cols):
+        kind = i % 4
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            data[f"amount_{i}"] = rng.integers(0, 100_000, rows) / 100
+        elif kind == 2:
+            data[f"text_{i}"] = rng.choice(["alpha", "beta", "gamma", "delta"], rows)
+        else:
+            data[f"date_{i}"] = (np.datetime64("2015-01-01") + rng.integers(0, 3650, rows)).astype(str)
+    return pd.DataFrame(data)
+
+
+def write_csv(df, folder, name):
+    os.makedirs(folder, exist_ok=True)
+    df.to_csv(os.path.join(folder, name), index=False)
+    return len(df)
+
+
+def generate(data_dir, scale):
+    """Write every dataset below data_dir; returns dataset -> data rows converted"""
+    rng = np.random.default_rng(0)
+    scaled = lambda rows: max(1, int(rows * scale))
+    rows = {}
+    rows["tall"] = write_csv(make_frame(scaled(TALL_ROWS), 8, rng), os.path.join(data_dir, "tall"), "tall.csv")
+    rows["wide"] = write_csv(make_frame(scaled(WIDE_ROWS), WIDE_COLS, rng), os.path.join(data_dir, "wide"),
+                             "wide.csv")
+    rows["many_small"] = sum(write_csv(make_frame(scaled(SMALL_ROWS), 6, rng), os.path.join(data_dir, "many_small"),
+                                       f"export_{i:03d}_part.csv")
+                             for i in range(SMALL_FILES))
+    rows["similar"] = sum(write_csv(make_frame(scaled(SIMILAR_ROWS), 6, rng), os.path.join(data_dir, "similar"),
+                                    f"{base}_2024-01-{day + 1:02d}.csv")
+                          for base in SIMILAR_BASES for day in range(SIMILAR_FILES))
+
+    # An existing workbook, and new exports of which half the rows are already in it
+    folder = os.path.join(data_dir, "duplicates")
+    os.makedirs(os.path.join(folder, "new"), exist_ok=True)
+    master = make_frame(scaled(MASTER_ROWS), 6, rng)
+    with pd.ExcelWriter(os.path.join(folder, "master.xlsx")) as writer:
+        master.to_excel(writer, sheet_name="orders", index=False)
+    rows["duplicates"] = 0
+    for i in range(NEW_FILES):
+        new_rows = scaled(NEW_ROWS)
+        fresh = make_frame(new_rows - new_rows // 2, 6, rng, first_id=len(master) + i * new_rows)
+        repeated = master.sample(new_rows // 2, random_state=i)
+        batch = pd.concat([fresh, repeated], ignore_index=True)
+        rows["duplicates"] += write_csv(batch, os.path.join(folder, "new"), f"orders_2024-02-{i + 1:02d}.csv")
+    with open(os.path.join(data_dir, "rows.json"), "w", encoding="utf-8") as handle:
+        json.dump(rows, handle)
+    return rows
+
+
+def csv_files_of(data_dir, dataset):
+    folder = os.path.join(data_dir, dataset, "new" if dataset == "duplicates" else "")
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".csv"))
+
+
+def memory_mb(field):
+    """VmRSS (current) or VmHWM (peak) resident memory of this process, None off Linux"""
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak():
+    # Writing 5 to clear_refs resets VmHWM to the current VmRSS (Linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+    except OSError:
+        pass
+
+
+def peak_mb():
+    peak = memory_mb("VmHWM")
+    if peak is None:
+        import resource
+
+        # Peak of the whole process; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+    return peak
+
+
+def run_child(scenario, data_dir, work_dir, writer_engine, csv_engine):
+    """Body of one measured run; prints its numbers as JSON"""
+    dataset, options, _ = SCENARIOS[scenario]
+    csv_files = csv_files_of(data_dir, dataset)
+    existing_file = ""
+    if options.get("append_mode"):
+        # A fresh copy without a duplicate index, so every run does the same work
+        existing_file = os.path.join(work_dir, "master.xlsx")
+        shutil.copyfile(os.path.join(data_dir, dataset, "master.xlsx"), existing_file)
+        output_path = existing_file
+    elif options.get("combine_sheets"):
+        output_path = os.path.join(work_dir, "combined.xlsx")
+    else:
+        output_path = work_dir
+    engine = ConversionEngine(
+        csv_files, output_path,
+        options.get("combine_sheets", False) or options.get("append_mode", False),
+        [],
+        options.get("detect_similar", False) or options.get("append_mode", False),
+        options.get("append_mode", False),
+        options.get("append_mode", False),
+        existing_file,
+        options.get("duplicate_keys", []),
+        streaming=options.get("streaming", False),
+        csv_engine=csv_engine,
+        writer_engine=writer_engine,
+    )
+    import openpyxl  # noqa: F401  (imported before the baseline, like pandas)
+    reset_peak()
+    start = time.perf_counter()
+    success, message = engine.run()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "peak_mb": peak_mb(), "success": success, "message": message}))
+
+
+def measure(scenario, data_dir, writer_engine, csv_engine):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{scenario}_")
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--child", scenario, data_dir, work_dir,
+                   "--writer", writer_engine, "--csv-engine", csv_engine]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            return {"success": False, "message": result.stderr.strip().splitlines()[-1]}
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the rows of every dataset")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario, the fastest one is reported")
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS), metavar="SCENARIO",
+                        help=f"run only these scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("--writer", choices=WRITER_ENGINES, default="openpyxl")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="c")
+    parser.add_argument("--json", metavar="PATH", help="save the results to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by --json")
+    parser.add_argument("--data-dir", metavar="DIR",
+                        help="keep the generated CSVs in DIR and reuse them when they are already there")
+    parser.add_argument("--child", nargs=3, metavar=("SCENARIO", "DATA_DIR", "WORK_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.writer, args.csv_engine)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = {result["scenario"]: result for result in json.load(handle)["results"]}
+
+    temp_dir = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix="bench_suite_")
+        data_dir = temp_dir
+    try:
+        rows_file = os.path.join(data_dir, "rows.json")
+        if os.path.exists(rows_file):
+            with open(rows_file, encoding="utf-8") as handle:
+                dataset_rows = json.load(handle)
+        else:
+            print(f"Generating datasets in {data_dir}...", flush=True)
+            dataset_rows = generate(data_dir, args.scale)
+
+        results = []
+        header = f"{'scenario':<24} {'files':>5} {'rows':>9} {'wall s':>8} {'rows/s':>9} {'peak MB':>8}"
+        print(header + ("  vs baseline" if baseline else ""))
+        for scenario in args.only or SCENARIOS:
+            dataset = SCENARIOS[scenario][0]
+            runs = [measure(scenario, data_dir, args.writer, args.csv_engine) for _ in range(args.repeat)]
+            failed = next((run for run in runs if not run["success"]), None)
+            if failed:
+                print(f"{scenario:<24} FAILED: {failed['message']}", flush=True)
+                continue
+            best = min(runs, key=lambda run: run["seconds"])
+            rows = dataset_rows[dataset]
+            result = {"scenario": scenario, "files": len(csv_files_of(data_dir, dataset)), "rows": rows,
+                      "seconds": best["seconds"], "rows_per_second": rows / best["seconds"],
+                      "peak_mb": max(run["peak_mb"] for run in runs)}
+            results.append(result)
+            line = (f"{scenario:<24} {result['files']:>5} {rows:>9} {result['seconds']:>8.2f} "
+                    f"{result['rows_per_second']:>9.0f} {result['peak_mb']:>8.0f}")
+            if scenario in baseline:
+                line += f"  {baseline[scenario]['seconds'] / result['seconds']:>5.2f}x"
+            print(line, flush=True)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"scale": args.scale, "writer": args.writer, "csv_engine": args.csv_engine,
+                       "results": results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
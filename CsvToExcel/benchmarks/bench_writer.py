@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Excel writer backends (excel_writers.WRITER_ENGINES).
+Converts the same CSV with conversion_tasks.convert_to_excel, in memory and
+streaming, once per backend. Each run happens in a fresh process whose
+peak resident memory is reset just before the conversion starts; "growth"
+is how far the peak rose above the memory in use at that point. Reads
+/proc/self/status, so Linux only.
+
+Usage: python bench_writer.py [--rows 300000] [--cols 12] [--chunk-size 50000]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, APP_DIR)
+import conversion_tasks
+import excel_writers
+
+
+def make_frame(rows, cols, seed=0):
+    """Integers, floats, short text and date strings"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 4
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            data[f"float_{i}"] = rng.integers(0, 100_000, rows) / 100
+        elif kind == 2:
+            data[f"text_{i}"] = rng.choice(["alpha", "beta", "gamma", "delta"], rows)
+        else:
+            data[f"date_{i}"] = (np.datetime64("2015-01-01") + rng.integers(0, 3650, rows)).astype(str)
+    return pd.DataFrame(data)
+
+
+def memory_mb(field):
+    """VmRSS (current) or VmHWM (peak) resident memory of this process"""
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} not found in /proc/self/status")
+
+
+def reset_peak():
+    # Writing 5 to clear_refs resets VmHWM to the current VmRSS
+    with open("/proc/self/clear_refs", "w") as handle:
+        handle.write("5")
+
+
+def run_child(csv_file, output_file, writer_engine, streaming, chunk_size):
+    """Body of one measured run; prints its numbers as JSON"""
+    # Import everything before taking the baseline
+    import openpyxl  # noqa: F401
+    if excel_writers.xlsxwriter_available():
+        import xlsxwriter  # noqa: F401
+    reset_peak()
+    baseline = memory_mb("VmRSS")
+    start = time.perf_counter()
+    conversion_tasks.convert_to_excel([csv_file], output_file, streaming, chunk_size, writer_engine=writer_engine)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "peak": memory_mb("VmHWM"), "baseline": baseline,
+                      "size": os.path.getsize(output_file)}))
+
+
+def measure(csv_file, output_file, writer_engine, streaming, chunk_size):
+    command = [sys.executable, os.path.abspath(__file__), "--child", csv_file, output_file, writer_engine,
+               "--chunk-size", str(chunk_size)]
+    if streaming:
+        command.append("--stream")
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--child", nargs=3, metavar=("CSV", "XLSX", "WRITER"), help=argparse.SUPPRESS)
+    parser.add_argument("--stream", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.stream, args.chunk_size)
+        return
+    if not excel_writers.xlsxwriter_available():
+        sys.exit("xlsxwriter is not installed; both backends would write with openpyxl")
+
+    print(f"{'mode':>9} {'writer':>10} {'rows':>8} {'cols':>5} {'write s':>8} {'peak MB':>8} "
+          f"{'growth MB':>10} {'xlsx MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "data.csv")
+        make_frame(args.rows, args.cols).to_csv(csv_file, index=False)
+        for streaming in (False, True):
+            mode = "streaming" if streaming else "in-memory"
+            for writer_engine in excel_writers.WRITER_ENGINES:
+                output_file = os.path.join(tmp, f"{mode}_{writer_engine}.xlsx")
+                stats = measure(csv_file, output_file, writer_engine, streaming, args.chunk_size)
+                print(f"{mode:>9} {writer_engine:>10} {args.rows:>8} {args.cols:>5} {stats['seconds']:>8.2f} "
+                      f"{stats['peak']:>8.0f} {stats['peak'] - stats['baseline']:>10.0f} "
+                      f"{stats['size'] / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
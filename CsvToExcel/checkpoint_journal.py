@@ -0,0 +1,101 @@
+"""
+Checkpoint journal of a conversion job.
+
+A job that writes one Excel file per CSV (or per group of similar CSVs)
+notes every task in a journal: the output path it was given when it was
+planned, and that file's size and modification time once it is finished.
+The journal is saved after every finished task. If the job is cancelled or
+the process dies, running the same job again skips the tasks whose output
+is finished and untouched, and writes the unfinished ones to the paths they
+had before, replacing any partial file. The journal is deleted once the job
+completes without failures.
+
+A job is identified by its output folder, options and input files, a task
+by its output name and the size and modification time of its input files.
+"""
+
+import hashlib
+import json
+import os
+
+from csv_sources import source_stat
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".csv_to_excel", "journals")
+
+
+def input_signature(csv_files):
+    signature = []
+    for csv_file in csv_files:
+        size, mtime_ns = source_stat(csv_file)
+        signature.append([os.path.abspath(csv_file), size, mtime_ns])
+    return signature
+
+
+class ConversionJournal:
+    """Planned and finished outputs of one job, persisted as JSON"""
+
+    VERSION = 1
+
+    def __init__(self, job, journal_dir=DEFAULT_DIR):
+        self.job = json.loads(json.dumps(job, default=str))
+        name = hashlib.sha1(json.dumps(self.job, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(journal_dir, f"{name}.json")
+        # task key -> {"output": path, "done": path of the finished file or None, "size": int, "mtime_ns": int}
+        self.tasks = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION and data.get("job") == self.job:
+            self.tasks = data.get("tasks", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"version": self.VERSION, "job": self.job, "tasks": self.tasks}, handle)
+        os.replace(temp_path, self.path)
+
+    def discard(self):
+        """Forget the job, e.g. once it has completed"""
+        self.tasks = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def task_key(self, csv_files, output_name):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([output_name, input_signature(csv_files)]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """("done", finished file) if the task's output is finished and untouched,
+        ("started", planned output path) if it was planned but not finished,
+        otherwise None"""
+        entry = self.tasks.get(key)
+        if entry is None:
+            return None
+        if entry["done"] is None:
+            return "started", entry["output"]
+        try:
+            stat = os.stat(entry["done"])
+        except OSError:
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        return "done", entry["done"]
+
+    def start(self, key, output_file):
+        self.tasks[key] = {"output": str(output_file), "done": None, "size": None, "mtime_ns": None}
+
+    def finish(self, key, finished_file):
+        """Record the task's finished file and save the journal"""
+        path = os.path.abspath(finished_file)
+        stat = os.stat(path)
+        self.tasks[key].update(done=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self.save()
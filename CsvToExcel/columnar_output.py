@@ -0,0 +1,211 @@
+"""
+Parquet and Feather copies of the sheets written to Excel.
+
+Each sheet can also be written as a columnar file next to its workbook, so
+the data can be loaded back into pandas quickly without going through the
+Excel file. Sheets that are too long for Excel are not split here. Needs
+pyarrow.
+
+ColumnarWriter takes a sheet one DataFrame chunk at a time, so streaming
+conversions keep their low memory use. Chunks go straight into the file
+while they have the column types of the first chunk (or types that convert
+to them without loss, such as integers into a float column). If a later
+chunk does not fit, for instance text in a column that started out numeric,
+the data written so far and the remaining chunks are kept as pieces and
+combined with widened column types when the writer is closed.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from lazy_import import lazy_module
+
+pa = lazy_module("pyarrow")
+
+COLUMNAR_FORMATS = ("parquet", "feather")
+
+
+def columnar_path(output_file, fmt, sheet_name=None):
+    """book.xlsx -> book.parquet, or book_<sheet>.parquet for one sheet of a workbook"""
+    output_file = Path(output_file)
+    stem = f"{output_file.stem}_{sheet_name}" if sheet_name else output_file.stem
+    return output_file.with_name(f"{stem}.{fmt}")
+
+
+def arrow_table(df):
+    """df as an Arrow table without its index; columns that mix numbers and text become text"""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        arrays = []
+        for col in df.columns:
+            values = df[col]
+            try:
+                arrays.append(pa.array(values, from_pandas=True))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                text = values.where(values.isna(), values.astype(str))
+                arrays.append(pa.array(text, from_pandas=True, type=pa.large_string()))
+        table = pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+    # Categories differ between chunks, which the Feather file format cannot hold
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+
+def fits(schema, target):
+    """True if a table with schema can be cast to target without changing any value"""
+    if schema.names != target.names:
+        return False
+    for field, target_field in zip(schema, target):
+        if field.type.equals(target_field.type) or pa.types.is_null(field.type):
+            continue
+        if pa.types.is_integer(field.type) and pa.types.is_floating(target_field.type):
+            continue
+        return False
+    return True
+
+
+def widened_type(types):
+    """One type every type in types can be cast to: floats for mixed numbers, text otherwise"""
+    types = [t for t in types if not pa.types.is_null(t)]
+    if not types:
+        return pa.null()
+    if all(t.equals(types[0]) for t in types):
+        return types[0]
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.large_string()
+
+
+def widened_schema(schemas):
+    """Every column of schemas, in order of first appearance, with widened types"""
+    names = []
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name not in types:
+                names.append(field.name)
+                types[field.name] = []
+            types[field.name].append(field.type)
+    return pa.schema([(name, widened_type(types[name])) for name in names])
+
+
+def cast_table(table, schema):
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            if not column.type.equals(field.type):
+                column = column.cast(field.type)
+        else:
+            column = pa.nulls(table.num_rows, field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def open_writer(path, schema, fmt):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(str(path), schema)
+    # Feather version 2 is the Arrow IPC file format; lz4 like pyarrow.feather
+    return pa.ipc.new_file(str(path), schema, options=pa.ipc.IpcWriteOptions(compression="lz4"))
+
+
+def read_schema(path, fmt):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(str(path))
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def iter_batches(path, fmt):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        yield from pq.ParquetFile(str(path)).iter_batches()
+        return
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+class ColumnarWriter:
+    """Writes one sheet to a Parquet or Feather file, one DataFrame chunk at a time"""
+
+    def __init__(self, path, fmt):
+        self.path = str(path)
+        self.fmt = fmt
+        self.writer = None
+        self.schema = None
+        # Set once a chunk did not fit the first chunk's types
+        self.spool_dir = None
+        self.pieces = []
+
+    def write(self, df):
+        table = arrow_table(df)
+        if self.spool_dir is not None:
+            self.spool(table)
+            return
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = open_writer(self.path, self.schema, self.fmt)
+        elif not fits(table.schema, self.schema):
+            self.writer.close()
+            self.writer = None
+            self.spool_dir = tempfile.mkdtemp(prefix=".columnar_", dir=os.path.dirname(os.path.abspath(self.path)))
+            first_piece = os.path.join(self.spool_dir, f"0.{self.fmt}")
+            os.replace(self.path, first_piece)
+            self.pieces.append(first_piece)
+            self.spool(table)
+            return
+        self.writer.write_table(cast_table(table, self.schema))
+
+    def spool(self, table):
+        piece = os.path.join(self.spool_dir, f"{len(self.pieces)}.{self.fmt}")
+        writer = open_writer(piece, table.schema, self.fmt)
+        writer.write_table(table)
+        writer.close()
+        self.pieces.append(piece)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        elif self.spool_dir is not None:
+            try:
+                schema = widened_schema(read_schema(piece, self.fmt) for piece in self.pieces)
+                writer = open_writer(self.path, schema, self.fmt)
+                for piece in self.pieces:
+                    for batch in iter_batches(piece, self.fmt):
+                        writer.write_table(cast_table(pa.Table.from_batches([batch]), schema))
+                writer.close()
+            finally:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+                self.spool_dir = None
+        else:
+            # No rows at all
+            open_writer(self.path, pa.schema([]), self.fmt).close()
+
+    def discard(self):
+        """Give up on the file, e.g. when the conversion is cancelled; nothing partial is left"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            os.remove(self.path)
+        if self.spool_dir is not None:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+            self.spool_dir = None
+
+
+def write_columnar(df, path, fmt):
+    """Write a whole DataFrame to a Parquet or Feather file"""
+    writer = ColumnarWriter(path, fmt)
+    writer.write(df)
+    writer.close()
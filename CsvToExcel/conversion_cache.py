@@ -0,0 +1,95 @@
+"""
+Content-addressed cache of converted Excel files.
+
+A conversion is identified by the content hash of its input CSVs, the name
+of the Excel file it produces and the options that change the output. The
+cache remembers which file each conversion was written to, with that file's
+size and modification time, so a later run can skip the conversion as long
+as the output is still there untouched. Input hashes are remembered per
+path, size and modification time, so unchanged inputs are not read again.
+"""
+
+import hashlib
+import json
+import os
+
+from csv_sources import source_stat
+from file_manifest import file_hash
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".csv_to_excel", "conversion_cache.json")
+
+
+class ConversionCache:
+    """Maps conversion keys to the Excel files they produced, persisted as JSON"""
+
+    VERSION = 1
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = str(path)
+        # key -> {"output": path, "size": int, "mtime_ns": int}
+        self.outputs = {}
+        # input path -> [size, mtime_ns, content hash]
+        self.inputs = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.outputs = data.get("outputs", {})
+            self.inputs = data.get("inputs", {})
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"version": self.VERSION, "outputs": self.outputs, "inputs": self.inputs}, handle)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def input_hash(self, csv_file):
+        path = os.path.abspath(csv_file)
+        size, mtime_ns = source_stat(path)
+        known = self.inputs.get(path)
+        if known and known[0] == size and known[1] == mtime_ns:
+            return known[2]
+        digest = file_hash(path)
+        self.inputs[path] = [size, mtime_ns, digest]
+        self.changed = True
+        return digest
+
+    def key(self, csv_files, output_name, options):
+        """Key of converting csv_files into a file called output_name with options"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([output_name, options], sort_keys=True, default=str).encode("utf-8"))
+        for csv_file in csv_files:
+            digest.update(self.input_hash(csv_file).encode("ascii"))
+        return digest.hexdigest()
+
+    def lookup(self, key, output_dir):
+        """The untouched output recorded for key in output_dir, or None"""
+        entry = self.outputs.get(key)
+        if entry is None:
+            return None
+        output = entry["output"]
+        if os.path.normcase(os.path.dirname(output)) != os.path.normcase(os.path.abspath(output_dir)):
+            return None
+        try:
+            stat = os.stat(output)
+        except OSError:
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        return output
+
+    def record(self, key, output_file):
+        output = os.path.abspath(output_file)
+        stat = os.stat(output)
+        self.outputs[key] = {"output": output, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self.changed = True
@@ -0,0 +1,1018 @@
+"""
+Conversion engine of the CSV to Excel converter.
+
+Holds all grouping, merging, duplicate detection and writing logic without
+any Qt dependency, so it can be driven by the GUI (CsvConverter.py) as well
+as by the command line (csv_to_excel_cli.py).
+"""
+
+import glob
+import numbers
+import os
+import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from pathlib import Path
+
+import columnar_output
+import conversion_tasks
+import csv_sources
+import excel_writers
+import near_duplicates
+from checkpoint_journal import ConversionJournal
+from conversion_cache import ConversionCache
+from file_manifest import walk_csv_files
+from key_index import KeyIndex, KeySet
+from lazy_import import lazy_module
+from schema_cache import SchemaCache
+from stage_metrics import StageRecorder, summary_lines
+from xlsx_append import XlsxAppender
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+
+# Date and counter suffixes stripped from file names to find similar files.
+# They used to be removed with one re.sub per pattern, in this order:
+#   _\d{8}  _\d{4}-\d{2}-\d{2}  _\d{4}_\d{2}_\d{2}  _\d{6}  _\d{4}
+#   -\d{8}  -\d{4}-\d{2}-\d{2}  -\d{4}_\d{2}_\d{2}  -\d{6}  -\d{4}
+#   \d{8}   \d{4}-\d{2}-\d{2}   \d{4}_\d{2}_\d{2}   \d{6}   _\d+  -\d+  \d+
+# followed by rstrip('_-\t '). Each step strips its suffix from what the
+# previous steps left, so matching the same patterns, spelled backwards, as
+# optional groups at the start of the reversed name gives the same result in
+# a single pass.
+BASE_NAME_SUFFIXES = re.compile(
+    r'(?:\d{8}_)?(?:\d{2}-\d{2}-\d{4}_)?(?:\d{2}_\d{2}_\d{4}_)?(?:\d{6}_)?(?:\d{4}_)?'
+    r'(?:\d{8}-)?(?:\d{2}-\d{2}-\d{4}-)?(?:\d{2}_\d{2}_\d{4}-)?(?:\d{6}-)?(?:\d{4}-)?'
+    r'(?:\d{8})?(?:\d{2}-\d{2}-\d{4})?(?:\d{2}_\d{2}_\d{4})?(?:\d{6})?(?:\d+_)?(?:\d+-)?(?:\d+)?'
+    r'[_\-\t ]*'
+)
+
+
+@lru_cache(maxsize=1 << 18)
+def extract_base_name(file_name):
+    """Strip date and counter suffixes: 'sales_2024-01-31' and 'sales-7' give 'sales'"""
+    return file_name[:len(file_name) - BASE_NAME_SUFFIXES.match(file_name[::-1]).end()]
+
+
+# Multiplier that mixes a value's hash with the hash of its kind
+KIND_MIX = 0x9E3779B97F4A7C15
+
+
+@lru_cache(maxsize=None)
+def kind_hash(kind):
+    return pd.util.hash_array(np.array([kind], dtype=object))[0]
+
+
+def tagged_hashes(hashes, kind):
+    """Value hashes mixed with their kind, so equal-looking values of different kinds differ"""
+    return hashes * np.uint64(KIND_MIX) + kind_hash(kind)
+
+
+def is_large_int(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool) and abs(value) > 2 ** 53
+
+
+def value_kind(value):
+    """Kind of a key value that is not compared as a float"""
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, numbers.Integral):
+        return "int"
+    return type(value).__name__
+
+
+def group_similar_files(csv_files):
+    """Group CSV paths by the base name of their file name, keeping order"""
+    groups = defaultdict(list)
+    for file_path in csv_files:
+        groups[extract_base_name(csv_sources.csv_stem(file_path))].append(file_path)
+    return groups
+
+
+def find_csv_files_recursive(folder_path):
+    return sorted(walk_csv_files(folder_path))
+
+
+class ConversionEngine:
+    """Runs a CSV to Excel conversion job and reports back through callbacks.
+
+    run() returns (success, message). Progress (0-100) and status messages
+    are passed to progress_callback and status_callback when given. cancel()
+    (or setting cancel_event) stops the job before the next file or chunk.
+    """
+
+    def __init__(self, csv_files, output_path, combine_sheets, sheet_names,
+                 detect_similar, append_mode, override_mode, existing_file_path,
+                 duplicate_keys, streaming=False, chunk_size=50000, max_workers=1,
+                 schema_cache_path=None, csv_engine="c", manifests=None, conversion_cache_path=None,
+                 writer_engine="openpyxl", output_formats=("xlsx",), duplicate_match="exact", match_decimals=6,
+                 match_threshold=0.9, stage_log_path=None, journal_dir=None,
+                 cancel_event=None, progress_callback=None, status_callback=None, stage_callback=None):
+        self.csv_files = csv_files
+        self.output_path = output_path
+        self.combine_sheets = combine_sheets
+        self.sheet_names = sheet_names
+        self.detect_similar = detect_similar
+        self.append_mode = append_mode
+        self.override_mode = override_mode
+        self.existing_file_path = existing_file_path
+        self.duplicate_keys = duplicate_keys
+        # "exact", "normalized" or "fuzzy" key comparison when appending; see near_duplicates.py
+        self.duplicate_match = duplicate_match
+        self.match_decimals = match_decimals
+        self.match_threshold = match_threshold
+        # Key hashes and, for fuzzy matching, the blocking index of every sheet
+        # appended to, kept up to date as each CSV is merged
+        self.key_sets = {}
+        self.fuzzy_indexes = {}
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        # Remembered column dtypes per family of similar files, when enabled
+        self.schema_cache = SchemaCache(schema_cache_path) if schema_cache_path else None
+        self.csv_engine = csv_engine
+        # Backend for new workbooks; appending always edits the existing file in place
+        self.writer_engine = writer_engine
+        # "xlsx" and/or columnar copies of each sheet; new-file modes only
+        self.output_formats = tuple(output_formats)
+        self.columnar_formats = [fmt for fmt in self.output_formats if fmt in columnar_output.COLUMNAR_FORMATS]
+        self.columnar_files = []
+        # FileManifests of the scanned folders: only new or changed files are converted
+        self.manifests = manifests or []
+        self.failed_files = set()
+        # Skips per-file conversions whose output is already up to date, when enabled
+        self.conversion_cache = ConversionCache(conversion_cache_path) if conversion_cache_path else None
+        self.task_keys = {}
+        self.cache_hits = 0
+        # Checkpoint journals of per-file jobs go here, so an interrupted job resumes, when enabled
+        self.journal_dir = journal_dir
+        self.journal = None
+        self.journal_keys = {}
+        self.resumed_tasks = 0
+        self.outputs_written = 0
+        self.cancel_event = cancel_event or threading.Event()
+        # True once run() has stopped because of a cancel
+        self.cancelled = False
+        # Output paths handed out during this run, so parallel tasks never collide
+        self.reserved_paths = set()
+        self.progress_callback = progress_callback
+        self.status_callback = status_callback
+        # Duration, rows and peak memory per stage and file; stage_callback gets each update
+        self.stages = StageRecorder(stage_callback)
+        # JSON Lines file that gets one entry with the stage records per run, when set
+        self.stage_log_path = stage_log_path
+
+    def report_progress(self, value):
+        if self.progress_callback:
+            self.progress_callback(value)
+
+    def report_status(self, message):
+        if self.status_callback:
+            self.status_callback(message)
+
+    def cancel(self):
+        """Ask the running job to stop; it does at the next file or chunk"""
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        conversion_tasks.check_cancelled(self.cancel_event)
+
+    def run(self):
+        try:
+            success, message = self.run_conversion()
+        except conversion_tasks.ConversionCancelled:
+            self.cancelled = True
+            success, message = False, self.cancelled_message()
+        except Exception as e:
+            success, message = False, f"Error during conversion: {str(e)}"
+        finally:
+            self.save_caches()
+        if self.stage_log_path:
+            try:
+                self.stages.save(self.stage_log_path, success=success, message=message,
+                                 files=len(self.csv_files))
+            except OSError as e:
+                self.report_status(f"Could not write stage log: {e}")
+        return success, message
+
+    def stage_summary(self):
+        """One line per stage with its total time, rows and peak memory"""
+        return summary_lines(self.stages.summary())
+
+    def run_conversion(self):
+        if excel_writers.resolve_engine(self.writer_engine) != self.writer_engine:
+            self.report_status(f"{self.writer_engine} is not installed; writing with openpyxl")
+            self.writer_engine = "openpyxl"
+        if self.columnar_formats and not self.append_mode and not conversion_tasks.arrow_available():
+            return False, "Parquet and Feather output need pyarrow (pip install pyarrow)"
+        if self.manifests:
+            self.csv_files = self.changed_csv_files()
+            if not self.csv_files:
+                return True, "No new or changed CSV files since the last run"
+        if self.journal_dir and not self.append_mode and not self.combine_sheets:
+            self.journal = ConversionJournal(self.job_description(), self.journal_dir)
+        success, message = self.convert()
+        if success and self.manifests:
+            self.record_converted_files()
+        if self.journal is not None and not self.failed_files:
+            self.journal.discard()
+        return success, message
+
+    def job_description(self):
+        """What identifies this job in its checkpoint journal"""
+        return {"output": os.path.abspath(self.output_path), "detect_similar": self.detect_similar,
+                "inputs": sorted(os.path.abspath(csv_file) for csv_file in self.csv_files),
+                "streaming": self.streaming, "writer": self.writer_engine, "formats": self.output_formats}
+
+    def cancelled_message(self):
+        message = "Conversion cancelled"
+        if self.outputs_written:
+            message += f" after writing {self.outputs_written} file{'s' if self.outputs_written != 1 else ''}"
+            if self.journal is not None:
+                message += "; run the same job again to resume from there"
+        return message
+
+    def report_chunk_progress(self, value):
+        """Progress after a streamed chunk, which is also where a cancelled job stops"""
+        self.report_progress(value)
+        self.check_cancelled()
+
+    def convert(self):
+        if self.append_mode and self.existing_file_path:
+            return self.append_to_existing_file()
+        elif self.detect_similar:
+            grouped_files = self.group_similar_files(self.csv_files)
+            return self.process_grouped_files(grouped_files)
+        elif self.combine_sheets:
+            self.report_status("Creating combined Excel file...")
+            output_file = self.get_unique_filename(self.output_path)
+            if self.streaming:
+                workbook = self.new_workbook(output_file)
+                total_files = len(self.csv_files)
+                with self.combined_output(workbook):
+                    for i, csv_file in enumerate(self.csv_files):
+                        self.check_cancelled()
+                        self.report_status(f"Streaming {os.path.basename(csv_file)}...")
+                        sheet_name = self.combined_sheet_name(i, csv_file)
+                        columnar = self.columnar_writers(output_file, sheet_name)
+                        try:
+                            rows = conversion_tasks.stream_csv_to_sheet(
+                                workbook, csv_file, sheet_name, self.chunk_size,
+                                lambda fraction: self.report_chunk_progress(int((i + fraction) / total_files * 100)),
+                                self.csv_dtypes(csv_file), columnar, self.stages, csv_engine=self.csv_engine
+                            )
+                        except BaseException:
+                            conversion_tasks.discard_columnar(columnar)
+                            raise
+                        conversion_tasks.close_columnar(columnar, sheet_name, self.stages)
+                        self.report_split(sheet_name, rows)
+                        self.report_progress(int((i + 1) / total_files * 100))
+                self.save_workbook(workbook, output_file)
+            else:
+                with self.combined_output(), self.frame_writer(output_file) as writer:
+                    for i, csv_file in enumerate(self.csv_files):
+                        self.check_cancelled()
+                        self.report_status(f"Processing {os.path.basename(csv_file)}...")
+                        df = self.read_csv(csv_file)
+                        sheet_name = self.combined_sheet_name(i, csv_file)
+                        self.report_split(sheet_name, len(df))
+                        self.write_sheet(writer, df, output_file, sheet_name)
+                        progress_value = int((i + 1) / len(self.csv_files) * 100)
+                        self.report_progress(progress_value)
+            return True, self.combined_message(f"Successfully created combined Excel file: {output_file}")
+        else:
+            tasks = []
+            for csv_file in self.csv_files:
+                output_file = Path(self.output_path) / f"{csv_sources.csv_stem(csv_file)}.xlsx"
+                task = self.plan_task([csv_file], output_file)
+                if task:
+                    tasks.append(task)
+            if not tasks:
+                return True, f"All {len(self.csv_files)} files are already converted and unchanged"
+            failures = self.run_conversion_tasks(tasks)
+            if failures:
+                return (len(failures) < len(self.csv_files),
+                        f"Converted {len(tasks) - len(failures)} of {len(tasks)} files to {self.output_label()}"
+                        f"{self.copies_note()}{self.skipped_note()}. Failed: {'; '.join(failures)}")
+            else:
+                return True, (f"Successfully converted {len(tasks)} files to {self.output_label()}"
+                              f"{self.copies_note()}{self.skipped_note()}")
+
+    def changed_csv_files(self):
+        """The CSV files that are new or changed since they were last converted.
+
+        An output made from several CSVs, a combined workbook or a group of
+        similar files, is built again from all of them when any one changed;
+        converting only the changed ones would replace it with a partial file.
+        Appends only add the rows of the changed files.
+        """
+        changed = set()
+        for csv_file in self.csv_files:
+            manifest = next((m for m in self.manifests if m.contains(csv_file)), None)
+            if manifest is None or manifest.is_changed(csv_file):
+                changed.add(csv_file)
+        if changed and not self.append_mode:
+            if self.combine_sheets:
+                changed = set(self.csv_files)
+            elif self.detect_similar:
+                for file_list in self.group_similar_files(self.csv_files).values():
+                    if changed.intersection(file_list):
+                        changed.update(file_list)
+        skipped = len(self.csv_files) - len(changed)
+        if skipped:
+            self.report_status(f"Skipping {skipped} unchanged CSV files")
+        return [csv_file for csv_file in self.csv_files if csv_file in changed]
+
+    def record_converted_files(self):
+        converted = [csv_file for csv_file in self.csv_files if csv_file not in self.failed_files]
+        for manifest in self.manifests:
+            manifest.mark_done(csv_file for csv_file in converted if manifest.contains(csv_file))
+            try:
+                manifest.save()
+            except OSError as e:
+                self.report_status(f"Could not save file manifest: {e}")
+
+    def report_split(self, sheet_name, rows):
+        """Tell when a sheet of rows data rows is split because it exceeds Excel's row limit.
+
+        Streamed sheets report it once they are written, from the rows written,
+        so their CSVs are not read an extra time just to count them.
+        """
+        parts = excel_writers.sheet_parts(rows)
+        if parts > 1:
+            self.report_status(f"'{sheet_name}' has {rows:,} rows, more than one Excel sheet holds; "
+                               f"it is split over {parts} sheets: {sheet_name}, "
+                               f"{excel_writers.part_sheet_name(sheet_name, 2)}, ...")
+
+    def combined_sheet_name(self, index, csv_file):
+        if index < len(self.sheet_names) and self.sheet_names[index].strip():
+            sheet_name = self.sheet_names[index].strip()
+        else:
+            sheet_name = csv_sources.csv_stem(csv_file)
+        return self.sanitize_sheet_name(sheet_name)
+
+    def plan_task(self, csv_files, output_file):
+        """The (csv_files, output path) task to run, or None when the conversion
+        cache holds an untouched output of the same input and options"""
+        key = None
+        if self.conversion_cache is not None:
+            options = {"streaming": self.streaming, "dtypes": self.group_dtypes(csv_files),
+                       "writer": self.writer_engine, "formats": self.output_formats}
+            key = self.conversion_cache.key(csv_files, Path(output_file).name, options)
+            cached_output = self.conversion_cache.lookup(key, Path(output_file).parent)
+            if cached_output:
+                self.cache_hits += 1
+                names = ", ".join(os.path.basename(csv_file) for csv_file in csv_files)
+                self.report_status(f"Unchanged, skipped: {names} -> {os.path.basename(cached_output)}")
+                return None
+        journal_key = None
+        resumed = None
+        if self.journal is not None:
+            journal_key = self.journal.task_key(csv_files, Path(output_file).name)
+            resumed = self.journal.lookup(journal_key)
+        if resumed and resumed[0] == "done":
+            self.resumed_tasks += 1
+            names = ", ".join(os.path.basename(csv_file) for csv_file in csv_files)
+            self.report_status(f"Finished in an earlier run, skipped: {names} -> {os.path.basename(resumed[1])}")
+            return None
+        if resumed:
+            # Planned before the job was interrupted: write it again, over any partial file
+            output_file = Path(resumed[1])
+            self.reserved_paths.add(output_file)
+        else:
+            output_file = self.get_unique_filename(output_file)
+        if key:
+            self.task_keys[str(output_file)] = key
+        if journal_key:
+            self.journal.start(journal_key, output_file)
+            self.journal_keys[str(output_file)] = journal_key
+        return csv_files, output_file
+
+    def new_workbook(self, output_file):
+        """Write-only workbook for output_file, or None when no Excel file is written"""
+        if "xlsx" not in self.output_formats:
+            return None
+        return excel_writers.new_workbook(output_file, self.writer_engine)
+
+    def frame_writer(self, output_file):
+        if "xlsx" not in self.output_formats:
+            return nullcontext()
+        return excel_writers.frame_writer(output_file, self.writer_engine, self.stages)
+
+    def columnar_writers(self, output_file, sheet_name):
+        """ColumnarWriters for the columnar copies of one sheet of output_file"""
+        writers = []
+        for fmt in self.columnar_formats:
+            path = columnar_output.columnar_path(output_file, fmt, sheet_name)
+            self.columnar_files.append(path)
+            writers.append(columnar_output.ColumnarWriter(path, fmt))
+        return writers
+
+    @contextmanager
+    def combined_output(self, workbook=None):
+        """Wraps the writing of a combined file: if it raises, e.g. because the
+        job was cancelled, the unsaved workbook and the columnar copies written
+        so far are dropped"""
+        try:
+            yield
+        except BaseException:
+            if workbook is not None:
+                workbook.discard()
+            for path in self.columnar_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise
+
+    def save_workbook(self, workbook, output_file):
+        if workbook is not None:
+            with self.stages.stage("write", os.path.basename(str(output_file))):
+                workbook.save()
+
+    def write_sheet(self, writer, df, output_file, sheet_name):
+        """df as sheet_name of a frame_writer() target plus its columnar copies"""
+        if writer is not None:
+            with self.stages.stage("write", sheet_name, len(df)):
+                excel_writers.write_frame(writer, df, sheet_name)
+        for columnar_writer in self.columnar_writers(output_file, sheet_name):
+            with self.stages.stage("columnar", sheet_name, len(df)):
+                columnar_writer.write(df)
+                columnar_writer.close()
+
+    def primary_output(self, output_file):
+        """The file a task writes: its workbook, or its first columnar copy without one"""
+        if "xlsx" in self.output_formats or not self.columnar_formats:
+            return output_file
+        return columnar_output.columnar_path(output_file, self.columnar_formats[0])
+
+    def output_label(self):
+        if "xlsx" in self.output_formats:
+            return "Excel format"
+        return " and ".join(fmt.capitalize() for fmt in self.columnar_formats) + " format"
+
+    def copies_note(self):
+        if "xlsx" not in self.output_formats or not self.columnar_formats:
+            return ""
+        return f" with {' and '.join(fmt.capitalize() for fmt in self.columnar_formats)} copies"
+
+    def formats_note(self):
+        return self.copies_note() if "xlsx" in self.output_formats else f" in {self.output_label()}"
+
+    def combined_message(self, message):
+        """message about a combined workbook, or a list of the columnar files when it was not written"""
+        if "xlsx" in self.output_formats:
+            return message + self.copies_note()
+        names = ", ".join(os.path.basename(str(path)) for path in self.columnar_files)
+        return f"Successfully wrote {len(self.columnar_files)} columnar files: {names}"
+
+    def skipped_note(self):
+        notes = []
+        if self.cache_hits:
+            notes.append(f"{self.cache_hits} unchanged skipped")
+        if self.resumed_tasks:
+            notes.append(f"{self.resumed_tasks} finished in an earlier run")
+        return f" ({', '.join(notes)})" if notes else ""
+
+    def run_conversion_tasks(self, tasks):
+        """Convert (csv_files, output_file) tasks, inline or in a process pool.
+
+        Status and progress are reported in task order; a failing task is
+        logged and skipped. Returns the list of failure descriptions.
+        """
+        total = len(tasks)
+        failures = []
+        done = [0]
+        if self.conversion_cache is not None:
+            self.report_status(f"Conversion cache: {self.cache_hits} hits, {total} misses")
+        if self.resumed_tasks:
+            self.report_status(f"Resuming an interrupted job: {self.resumed_tasks} outputs were already written")
+        if self.journal is not None:
+            # The planned output paths, so a restart after a crash reuses them
+            self.journal.save()
+        if self.max_workers > 1 and total > 1:
+            self.report_status(f"Writing {total} Excel files with {min(self.max_workers, total)} worker processes...")
+        else:
+            self.report_status(f"Writing {total} Excel files...")
+
+        def on_chunk(fraction):
+            self.report_progress(int((done[0] + fraction) / total * 100))
+            self.check_cancelled()
+
+        dtypes = {}
+        for csv_files, _ in tasks:
+            dtypes.update(self.group_dtypes(csv_files))
+        results = conversion_tasks.run_tasks(tasks, self.max_workers, self.streaming, self.chunk_size,
+                                             on_chunk, dtypes, self.csv_engine, self.writer_engine,
+                                             self.output_formats, self.stages, self.cancel_event)
+        for (csv_files, output_file), error in results:
+            names = ", ".join(os.path.basename(csv_file) for csv_file in csv_files)
+            if isinstance(error, conversion_tasks.ConversionCancelled):
+                continue
+            if error is None:
+                primary_output = self.primary_output(output_file)
+                self.report_status(f"Converted {names} -> {os.path.basename(str(primary_output))}")
+                self.outputs_written += 1
+                key = self.task_keys.get(str(output_file))
+                if key:
+                    self.conversion_cache.record(key, primary_output)
+                journal_key = self.journal_keys.get(str(output_file))
+                if journal_key:
+                    self.journal.finish(journal_key, primary_output)
+            else:
+                failures.append(f"{names}: {error}")
+                self.failed_files.update(csv_files)
+                self.report_status(f"Failed to convert {names}: {error}")
+            done[0] += 1
+            self.report_progress(int(done[0] / total * 100))
+        # Tasks stopped by a cancel in a worker process end up here
+        self.check_cancelled()
+        return failures
+
+    def schema_key(self, csv_file):
+        return self.extract_base_name(csv_sources.csv_stem(csv_file)) or csv_sources.csv_stem(csv_file)
+
+    def csv_dtypes(self, csv_file):
+        """Pinned dtypes for csv_file from the schema cache, or None when it is off"""
+        if self.schema_cache is None:
+            return None
+        try:
+            return self.schema_cache.dtypes_for(self.schema_key(csv_file), csv_file)
+        except (OSError, ValueError):
+            return None
+
+    def group_dtypes(self, csv_files):
+        return {csv_file: self.csv_dtypes(csv_file) for csv_file in csv_files}
+
+    def read_csv(self, csv_file):
+        dtypes = self.csv_dtypes(csv_file)
+        with self.stages.stage("parse", os.path.basename(csv_file)) as measured:
+            df = conversion_tasks.read_csv(csv_file, dtypes, self.csv_engine)
+            measured["rows"] = len(df)
+        if dtypes and any(str(df[col].dtype) != dtype for col, dtype in dtypes.items() if col in df.columns):
+            # The file no longer fits the remembered types; learn them again
+            self.schema_cache.record(self.schema_key(csv_file), df)
+        return df
+
+    def save_caches(self):
+        for label, cache in (("schema cache", self.schema_cache), ("conversion cache", self.conversion_cache)):
+            if cache is None:
+                continue
+            try:
+                cache.save()
+            except OSError as e:
+                self.report_status(f"Could not save {label}: {e}")
+
+    def get_unique_filename(self, file_path):
+        if self.override_mode:
+            return file_path
+
+        p = Path(file_path)
+        if not self.is_path_taken(p):
+            self.reserved_paths.add(p)
+            return file_path
+
+        parent = p.parent
+        stem = p.stem
+        suffix = p.suffix
+        counter = 1
+        while True:
+            new_stem = f"{stem}_updated_{counter}"
+            new_path = parent / f"{new_stem}{suffix}"
+            if not self.is_path_taken(new_path):
+                self.reserved_paths.add(new_path)
+                return new_path
+            counter += 1
+
+    def is_path_taken(self, path):
+        """True if this run already planned path, or a file the job would write
+        there exists: the workbook or any of its columnar copies"""
+        if path in self.reserved_paths:
+            return True
+        if "xlsx" in self.output_formats and path.exists():
+            return True
+        for fmt in self.columnar_formats:
+            if self.combine_sheets:
+                # One copy per sheet, book_<sheet>.parquet, and the sheets are not named yet
+                pattern = f"{glob.escape(path.stem)}_*.{fmt}"
+                if next(path.parent.glob(pattern), None) is not None:
+                    return True
+            elif columnar_output.columnar_path(path, fmt).exists():
+                return True
+        return False
+
+    def append_to_existing_file(self):
+        self.report_status("Loading existing Excel file...")
+        
+        source_file = self.existing_file_path
+        if self.override_mode:
+            self.output_path = self.existing_file_path
+
+        if not os.path.exists(source_file):
+            return False, f"Existing file not found: {source_file}"
+
+        # Only the sheet names are read up front. The sidecar index tells us the
+        # layout and row hashes of the sheets it covers, so duplicates can be
+        # decided without parsing the existing workbook; a sheet it does not
+        # cover is parsed when the first CSV for it arrives, and sheets that
+        # receive no rows are never parsed.
+        appender = XlsxAppender(source_file)
+        key_index = KeyIndex.load(source_file)
+        self.existing_sheets = {}
+        self.key_sets = {}
+        self.fuzzy_indexes = {}
+        if key_index is None:
+            key_index = KeyIndex(source_file)
+        else:
+            self.report_status("Using saved duplicate index for existing Excel file...")
+
+        # Layout of each touched sheet before this run, used when writing
+        initial_layout = {}
+        pending_rows = defaultdict(list)
+        
+        total_files = len(self.csv_files)
+        duplicates_found = 0
+        new_rows_added = 0
+
+        for i, csv_file in enumerate(self.csv_files):
+            # Nothing is written before all files are read, so the workbook is left as it was
+            self.check_cancelled()
+            self.report_status(f"Processing {os.path.basename(csv_file)} for append...")
+            new_df = self.read_csv(csv_file)
+            
+            csv_stem = csv_sources.csv_stem(csv_file)
+            
+            # Determine the target sheet name based on whether similar file detection is on
+            if self.detect_similar:
+                target_sheet_name = self.sanitize_sheet_name(self.extract_base_name(csv_stem))
+            else:
+                target_sheet_name = self.sanitize_sheet_name(csv_stem)
+
+            # Excel sheet names are case-insensitive: sales.csv goes to an existing "Sales"
+            target_sheet_name = self.matching_sheet_name(target_sheet_name, appender, initial_layout)
+            if target_sheet_name not in initial_layout:
+                entry = key_index.sheets.get(target_sheet_name)
+                if entry is None and target_sheet_name in appender.sheet_parts:
+                    entry = self.index_sheet(key_index, source_file, target_sheet_name)
+                if entry is None:
+                    # A new sheet starts out empty and is filled like any other
+                    key_index.set_sheet(target_sheet_name, [], [], 0, [], self.match_spec())
+                    initial_layout[target_sheet_name] = None
+                else:
+                    initial_layout[target_sheet_name] = (list(entry["columns"]), entry["rows"])
+
+            file_duplicates, file_new_rows = self.merge_into_indexed_sheet(
+                key_index, target_sheet_name, new_df, csv_file, pending_rows, source_file
+            )
+            duplicates_found += file_duplicates
+            new_rows_added += file_new_rows
+
+            progress_value = int((i + 1) / total_files * 100)
+            self.report_progress(progress_value)
+
+        self.report_status("Saving updated Excel file...")
+        final_output_path = self.get_unique_filename(self.output_path)
+        with self.stages.stage("write", os.path.basename(final_output_path), new_rows_added):
+            self.write_pending_rows(appender, final_output_path, key_index, initial_layout, pending_rows)
+        for sheet_name, key_set in self.key_sets.items():
+            key_index.sheets[sheet_name]["hashes"] = key_set.values()
+        key_index.save(final_output_path)
+        self.existing_sheets = {}
+
+        message = f"Successfully processed data. Added {new_rows_added} new rows, skipped {duplicates_found} duplicates. Saved to {os.path.basename(final_output_path)}"
+        return True, message
+
+    def matching_sheet_name(self, sheet_name, appender, initial_layout):
+        """Name of the existing or planned sheet that sheet_name refers to, ignoring case"""
+        existing = appender.find_sheet(sheet_name)
+        if existing is not None:
+            return existing
+        folded = sheet_name.casefold()
+        return next((name for name in initial_layout if name.casefold() == folded), sheet_name)
+
+    def index_sheet(self, key_index, workbook_path, sheet_name):
+        """Parse one existing sheet and add its layout and row keys to key_index"""
+        self.report_status(f"Building duplicate index for sheet '{sheet_name}'...")
+        with self.stages.stage("index", sheet_name) as measured:
+            df = pd.read_excel(workbook_path, sheet_name=sheet_name)
+            check_cols = self.duplicate_check_columns(df.columns.tolist())
+            hashes, keys = self.index_rows(df, check_cols)
+            key_index.set_sheet(sheet_name, df.columns, check_cols, len(df), hashes, self.match_spec(), keys)
+            measured["rows"] = len(df)
+        # Kept in case the sheet has to be re-indexed with new columns during this run
+        self.existing_sheets[sheet_name] = df
+        return key_index.sheets[sheet_name]
+
+    def merge_into_indexed_sheet(self, key_index, sheet_name, new_df, source_file, pending_rows, workbook_path):
+        """Dedup new_df against the indexed sheet and queue the remaining rows.
+
+        Returns (duplicates, new rows).
+        """
+        entry = key_index.sheets[sheet_name]
+        columns = self.merged_column_order(entry["columns"], new_df.columns)
+        new_df = new_df.copy()
+        new_df["Source_File"] = os.path.basename(source_file)
+        new_df = new_df.reindex(columns=columns, fill_value="")
+        check_cols = self.duplicate_check_columns(columns)
+        fuzzy = self.duplicate_match == "fuzzy"
+
+        if not entry["rows"]:
+            entry["hashes"] = np.empty(0, dtype=np.uint64)
+            entry["keys"] = [] if fuzzy else None
+            self.key_sets.pop(sheet_name, None)
+            self.fuzzy_indexes.pop(sheet_name, None)
+        elif check_cols != entry["key_cols"] or entry.get("match", "exact") != self.match_spec():
+            # The key layout changed (new columns, other duplicate keys or another
+            # match mode), so the stored hashes no longer apply and the sheet has
+            # to be read once.
+            self.report_status(f"Re-indexing sheet '{sheet_name}'...")
+            with self.stages.stage("index", sheet_name) as measured:
+                sheet_df = self.load_sheet_rows(workbook_path, sheet_name, pending_rows)
+                entry["hashes"], entry["keys"] = self.index_rows(sheet_df.reindex(columns=columns, fill_value=""),
+                                                                 check_cols)
+                measured["rows"] = len(sheet_df)
+            self.key_sets.pop(sheet_name, None)
+            self.fuzzy_indexes.pop(sheet_name, None)
+
+        if sheet_name not in self.key_sets:
+            self.key_sets[sheet_name] = KeySet(entry["hashes"])
+        key_set = self.key_sets[sheet_name]
+
+        with self.stages.stage("dedup", os.path.basename(source_file), len(new_df)):
+            if fuzzy:
+                match_keys = self.match_keys(new_df, check_cols)
+                new_keys = pd.util.hash_pandas_object(match_keys, index=False)
+            else:
+                new_keys = self.hash_key_rows(new_df, check_cols)
+            duplicates_mask = self.duplicate_mask(key_set, new_df, new_keys, check_cols)
+            if fuzzy:
+                if sheet_name not in self.fuzzy_indexes:
+                    self.fuzzy_indexes[sheet_name] = near_duplicates.FuzzyIndex(self.match_threshold, entry["keys"])
+                duplicates_mask = self.near_duplicate_mask(self.fuzzy_indexes[sheet_name], match_keys,
+                                                           duplicates_mask)
+                added_keys = match_keys[~duplicates_mask].dropna().tolist()
+                entry["keys"].extend(added_keys)
+                self.fuzzy_indexes[sheet_name].add(added_keys)
+            new_rows = new_df[~duplicates_mask]
+            key_set.add(new_keys[~duplicates_mask].to_numpy())
+
+        entry["columns"] = columns
+        entry["key_cols"] = check_cols
+        entry["match"] = self.match_spec()
+        entry["rows"] += len(new_rows)
+        pending_rows[sheet_name].append(new_rows)
+        return int(duplicates_mask.sum()), len(new_rows)
+
+    def load_sheet_rows(self, workbook_path, sheet_name, pending_rows):
+        """All rows of a sheet as they will be after this run: on disk plus queued"""
+        frames = []
+        if sheet_name in self.existing_sheets:
+            frames.append(self.existing_sheets[sheet_name])
+        else:
+            try:
+                frames.append(pd.read_excel(workbook_path, sheet_name=sheet_name))
+            except ValueError:
+                # Sheet does not exist in the workbook yet
+                pass
+        frames.extend(pending_rows[sheet_name])
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    def write_pending_rows(self, appender, output_path, key_index, initial_layout, pending_rows):
+        """Append the queued rows to their sheets; sheets without new rows are copied as-is.
+
+        A new sheet longer than Excel's row limit continues in _part2, _part3,
+        ... sheets like SheetWriter's. Rows that do not fit below the data of
+        an existing sheet raise ValueError before anything is written.
+        """
+        step = excel_writers.MAX_SHEET_ROWS - 1
+        for sheet_name, layout in initial_layout.items():
+            columns = key_index.sheets[sheet_name]["columns"]
+            frames = [df for df in pending_rows[sheet_name] if not df.empty]
+            if frames:
+                new_rows = pd.concat(frames, ignore_index=True, sort=False).reindex(columns=columns, fill_value="")
+            else:
+                new_rows = pd.DataFrame(columns=columns)
+            if layout is None:
+                header = [str(col) for col in columns]
+                parts = excel_writers.sheet_parts(len(new_rows))
+                if parts > 1:
+                    self.report_split(sheet_name, len(new_rows))
+                for part in range(1, parts + 1):
+                    rows = excel_writers.iter_sheet_rows(new_rows.iloc[(part - 1) * step:part * step])
+                    appender.add_sheet(excel_writers.part_sheet_name(sheet_name, part), header, rows)
+            else:
+                old_columns, old_rows = layout
+                if old_rows + len(new_rows) > step:
+                    raise ValueError(
+                        f"Sheet '{sheet_name}' has {old_rows:,} rows; adding {len(new_rows):,} more would exceed "
+                        f"Excel's limit of {step:,} rows per sheet. Append them to a new sheet or workbook instead")
+                extra_header = [str(col) for col in columns[len(old_columns):]]
+                if frames or extra_header:
+                    appender.append_rows(sheet_name, excel_writers.iter_sheet_rows(new_rows), extra_header)
+        appender.save(output_path)
+
+    def merged_column_order(self, existing_columns, new_columns):
+        columns = list(existing_columns)
+        if "Source_File" not in columns:
+            columns.append("Source_File")
+        return columns + [col for col in new_columns if col not in columns]
+
+    def duplicate_check_columns(self, columns):
+        if self.duplicate_keys:
+            check_cols = [col for col in self.duplicate_keys if col in columns]
+            if check_cols:
+                return check_cols
+        return [col for col in columns if col != "Source_File"]
+
+    def duplicate_mask(self, existing_keys, new_df, new_keys, check_cols):
+        # Each row's key columns are hashed into one 64-bit value, so the lookup
+        # is a vectorized search of the KeySet instead of a Python loop over tuples.
+        duplicates_mask = pd.Series(existing_keys.contains(new_keys.to_numpy()), index=new_keys.index)
+        # A row that repeats an earlier row of the same CSV is a duplicate too
+        duplicates_mask |= new_keys.duplicated()
+        # Blank key cells never matched in the tuple comparison, keep it that way
+        return duplicates_mask & ~new_df[check_cols].isna().any(axis=1)
+
+    def near_duplicate_mask(self, fuzzy_index, match_keys, duplicates_mask):
+        """duplicates_mask plus the rows whose keys are similar to a key in fuzzy_index"""
+        candidates = ~duplicates_mask & match_keys.notna()
+        if not candidates.any():
+            return duplicates_mask
+        duplicates_mask = duplicates_mask.copy()
+        duplicates_mask[candidates] = fuzzy_index.matches(match_keys[candidates].tolist())
+        return duplicates_mask
+
+    def match_spec(self):
+        return near_duplicates.match_spec(self.duplicate_match, self.match_decimals)
+
+    def match_keys(self, df, check_cols):
+        """Normalized key of every row, for normalized and fuzzy matching"""
+        return near_duplicates.normalized_keys(df, check_cols, self.match_decimals)
+
+    def index_rows(self, df, check_cols):
+        """Key hashes of df's rows as an array and, for fuzzy matching, their
+        normalized keys as a list (None otherwise)"""
+        if self.duplicate_match != "fuzzy":
+            return self.hash_key_rows(df, check_cols).to_numpy(), None
+        match_keys = self.match_keys(df, check_cols)
+        return pd.util.hash_pandas_object(match_keys, index=False).to_numpy(), match_keys.dropna().tolist()
+
+    def hash_key_rows(self, df, check_cols):
+        """Hash the key columns of every row into a single uint64 Series.
+
+        Two values share a hash only if they were equal in the tuple
+        comparison this replaced: numbers of any dtype are compared as floats
+        (1, 1.0 and True are the same key), text only matches text (7 and
+        "7" are different keys), and other objects only match objects of
+        their own type. So the hash does not depend on the dtype pandas
+        picked for each side. With normalized or fuzzy matching, the
+        normalized keys are hashed.
+        """
+        if self.duplicate_match != "exact":
+            return pd.util.hash_pandas_object(self.match_keys(df, check_cols), index=False)
+        keys = {col: self.hash_key_column(df[col]) for col in check_cols}
+        return pd.util.hash_pandas_object(pd.DataFrame(keys, index=df.index), index=False)
+
+    def hash_key_column(self, values):
+        """uint64 hash of every value of one key column, tagged with the kind of value"""
+        if pd.api.types.is_numeric_dtype(values):
+            hashes = tagged_hashes(pd.util.hash_array(values.to_numpy(dtype="float64", na_value=np.nan)), "number")
+            if pd.api.types.is_integer_dtype(values):
+                # Integers beyond 2**53 would lose precision as floats and could collide
+                large = ((values > 2 ** 53) | (values < -2 ** 53)).to_numpy(dtype=bool, na_value=False)
+                if large.any():
+                    hashes[large] = self.hash_key_objects(values.to_numpy(dtype=object)[large])
+            return hashes
+        objects = values.to_numpy(dtype=object)
+        if pd.api.types.infer_dtype(objects, skipna=True) in ("string", "empty"):
+            return tagged_hashes(pd.util.hash_array(objects), "str")
+        return self.hash_key_objects(objects)
+
+    def hash_key_objects(self, objects):
+        """hash_key_column for an object array of mixed values, one value at a time"""
+        hashes = np.empty(len(objects), dtype=np.uint64)
+        is_number = np.fromiter((isinstance(value, numbers.Real) and not is_large_int(value) for value in objects),
+                                dtype=bool, count=len(objects))
+        if is_number.any():
+            hashes[is_number] = tagged_hashes(pd.util.hash_array(objects[is_number].astype("float64")), "number")
+        others = objects[~is_number]
+        kinds = [value_kind(value) for value in others]
+        for kind in set(kinds):
+            of_kind = np.array([k == kind for k in kinds], dtype=bool)
+            values = others[of_kind]
+            if kind == "int":
+                values = np.array([str(int(value)) for value in values], dtype=object)
+            positions = np.flatnonzero(~is_number)[of_kind]
+            hashes[positions] = tagged_hashes(pd.util.hash_array(values), kind)
+        return hashes
+
+    def group_similar_files(self, csv_files):
+        return group_similar_files(csv_files)
+
+    def extract_base_name(self, file_name):
+        return extract_base_name(file_name)
+
+    def process_grouped_files(self, grouped_files):
+        if self.combine_sheets:
+            self.report_status("Creating Excel file with merged similar files...")
+            output_file = self.get_unique_filename(self.output_path)
+            if self.streaming:
+                self.stream_grouped_files(grouped_files, output_file)
+            else:
+                with self.combined_output(), self.frame_writer(output_file) as writer:
+                    sheet_index = 0
+                    total_groups = len(grouped_files)
+                    for base_name, file_list in grouped_files.items():
+                        self.check_cancelled()
+                        sheet_name = self.grouped_sheet_name(sheet_index, base_name, file_list)
+                        if len(file_list) > 1:
+                            self.report_status(f"Merging {len(file_list)} similar files for '{base_name}'...")
+                            merged_df = conversion_tasks.merge_csv_files(
+                                file_list, self.group_dtypes(file_list), self.csv_engine, self.stages,
+                                self.cancel_event)
+                            self.report_split(sheet_name, len(merged_df))
+                            self.write_sheet(writer, merged_df, output_file, sheet_name)
+                        else:
+                            self.report_status(f"Processing {os.path.basename(file_list[0])}...")
+                            df = self.read_csv(file_list[0])
+                            self.report_split(sheet_name, len(df))
+                            self.write_sheet(writer, df, output_file, sheet_name)
+                        sheet_index += 1
+                        progress_value = int(sheet_index / total_groups * 100)
+                        self.report_progress(progress_value)
+            merged_count = sum(1 for files in grouped_files.values() if len(files) > 1)
+            return True, self.combined_message(
+                f"Successfully created Excel file with {merged_count} merged groups: {os.path.basename(output_file)}")
+        else:
+            output_dir = Path(self.output_path)
+            total_groups = len(grouped_files)
+            tasks = []
+            for base_name, file_list in grouped_files.items():
+                if len(file_list) > 1:
+                    output_file = output_dir / f"{base_name}_merged.xlsx"
+                else:
+                    output_file = output_dir / f"{csv_sources.csv_stem(file_list[0])}.xlsx"
+                task = self.plan_task(file_list, output_file)
+                if task:
+                    tasks.append(task)
+            if not tasks:
+                return True, f"All {total_groups} file groups are already converted and unchanged"
+            failures = self.run_conversion_tasks(tasks)
+            merged_count = sum(1 for files in grouped_files.values() if len(files) > 1)
+            if failures:
+                return (len(failures) < total_groups,
+                        f"Processed {total_groups - len(failures)} of {total_groups} file groups "
+                        f"with {merged_count} merged groups{self.formats_note()}{self.skipped_note()}. "
+                        f"Failed: {'; '.join(failures)}")
+            else:
+                return True, (f"Successfully processed {total_groups} file groups with {merged_count} merged groups"
+                              f"{self.formats_note()}{self.skipped_note()}")
+
+    def grouped_sheet_name(self, sheet_index, base_name, file_list):
+        if len(file_list) > 1:
+            return self.sanitize_sheet_name(base_name)
+        if sheet_index < len(self.sheet_names) and self.sheet_names[sheet_index].strip():
+            return self.sanitize_sheet_name(self.sheet_names[sheet_index].strip())
+        return self.sanitize_sheet_name(csv_sources.csv_stem(file_list[0]))
+
+    def stream_grouped_files(self, grouped_files, output_file):
+        """Write every group to its own sheet chunk by chunk, without holding a group in memory"""
+        workbook = self.new_workbook(output_file)
+        total_groups = len(grouped_files)
+        with self.combined_output(workbook):
+            for i, (base_name, file_list) in enumerate(grouped_files.items()):
+                self.check_cancelled()
+                sheet_name = self.grouped_sheet_name(i, base_name, file_list)
+                on_chunk = lambda fraction: self.report_chunk_progress(int((i + fraction) / total_groups * 100))
+                columnar = self.columnar_writers(output_file, sheet_name)
+                try:
+                    if len(file_list) > 1:
+                        self.report_status(f"Streaming {len(file_list)} similar files for '{base_name}'...")
+                        rows = conversion_tasks.stream_group_to_sheet(
+                            workbook, file_list, sheet_name, self.chunk_size, on_chunk, self.group_dtypes(file_list),
+                            columnar, self.stages, csv_engine=self.csv_engine)
+                    else:
+                        self.report_status(f"Streaming {os.path.basename(file_list[0])}...")
+                        rows = conversion_tasks.stream_csv_to_sheet(
+                            workbook, file_list[0], sheet_name, self.chunk_size, on_chunk,
+                            self.csv_dtypes(file_list[0]), columnar, self.stages, csv_engine=self.csv_engine)
+                except BaseException:
+                    conversion_tasks.discard_columnar(columnar)
+                    raise
+                conversion_tasks.close_columnar(columnar, sheet_name, self.stages)
+                self.report_split(sheet_name, rows)
+                self.report_progress(int((i + 1) / total_groups * 100))
+        self.save_workbook(workbook, output_file)
+
+    def sanitize_sheet_name(self, name):
+        invalid_chars = ['\\', '/', '?', '*', '[', ']', ':']
+        for char in invalid_chars:
+            name = name.replace(char, '_')
+        if len(name) > 31:
+            name = name[:31]
+        return name
@@ -0,0 +1,495 @@
+"""
+Self-contained conversion tasks.
+
+A task converts one CSV, or merges one group of similar CSVs, into its own
+Excel file. Tasks only take plain, picklable arguments and never touch Qt,
+so ConversionWorker can run them inline or fan them out to a process pool.
+
+Conversions can be cancelled through an Event (threading or multiprocessing):
+it is checked before each file and after each streamed chunk, and a set
+event raises ConversionCancelled there.
+"""
+
+import datetime
+import os
+import re
+import signal
+from contextlib import closing
+from functools import lru_cache
+
+from columnar_output import COLUMNAR_FORMATS, ColumnarWriter, columnar_path, write_columnar
+from excel_writers import SheetWriter, frame_writer, iter_sheet_rows, new_workbook, write_frame
+import csv_sources
+import parallel_csv
+from lazy_import import lazy_module
+from stage_metrics import StageRecorder
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+# "c" is pandas' default parser; "pyarrow" parses with Arrow's multithreaded reader;
+# "parallel" splits large files into byte ranges parsed by the C parser in worker processes
+CSV_ENGINES = ("c", "pyarrow", "parallel")
+
+# Files written for every sheet: the Excel workbook and/or columnar copies
+OUTPUT_FORMATS = ("xlsx",) + COLUMNAR_FORMATS
+
+# Rows the C parser reads to check that Arrow typed the columns the same way
+ARROW_SAMPLE_ROWS = 10_000
+
+# Text like 0x1F, which Arrow reads as a number and the C parser keeps as text
+HEX_LITERAL = re.compile(rb"0[xX][0-9a-fA-F]")
+
+# Cancel event of the tasks run in a pool process, set by init_worker()
+worker_cancel_event = None
+
+
+class ConversionCancelled(Exception):
+    """The conversion was cancelled before it finished"""
+
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ConversionCancelled()
+
+
+@lru_cache(maxsize=None)
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def temporal_kind(values):
+    """"date" for columns of dates, "other" for any other date/time column, else None"""
+    if pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_timedelta64_dtype(values):
+        return "other"
+    if values.dtype != object:
+        return None
+    non_null = values.dropna()
+    if len(non_null) == 0:
+        return None
+    first = non_null.iloc[0]
+    if isinstance(first, datetime.date) and not isinstance(first, datetime.datetime):
+        return "date"
+    if isinstance(first, (datetime.datetime, datetime.time)):
+        return "other"
+    return None
+
+
+def differs_from_c_parser(df):
+    """Why the C parser would read the file Arrow read into df differently, or None"""
+    if df.columns.duplicated().any():
+        # The C parser renames repeated names to "a.1", ...; Arrow keeps them
+        return "repeated column names"
+    if df.empty:
+        # Arrow types the columns of a header-only file float64, the C parser object
+        return "no rows"
+    for col in df.columns:
+        if df[col].dtype == "float64":
+            values = df[col].to_numpy()
+            # Integers beyond int64 are uint64 or exact Python ints for the C parser,
+            # and lose precision as Arrow's float64
+            if (np.abs(values[np.isfinite(values)]) >= 2 ** 53).any():
+                return f"column {col!r} holds numbers too large for exact floats"
+    return None
+
+
+def has_hex_literal(csv_file):
+    """True if the CSV contains text that looks like a hexadecimal number"""
+    with csv_sources.open_csv(csv_file) as handle:
+        tail = b""
+        while True:
+            block = handle.read(1 << 24)
+            if not block:
+                return False
+            block = tail + block
+            # Plain substring tests are cheaper than the regex, and rarely match
+            if (b"0x" in block or b"0X" in block) and HEX_LITERAL.search(block):
+                return True
+            tail = block[-2:]
+
+
+def differs_from_sample(df, sample):
+    """Why the columns of df, read by Arrow, are typed differently than the C
+    parser typed the first rows of the same file (sample), or None"""
+    for col in sample.columns:
+        expected, actual = sample[col], df[col]
+        if actual.dtype == expected.dtype or expected.isna().all():
+            continue
+        if expected.dtype == "int64" and actual.dtype == "float64" and actual.isna().any():
+            # Blanks further down make the column float64 for the C parser too
+            continue
+        # e.g. integers written as +5, which Arrow reads as float64
+        return f"column {col!r} is {actual.dtype} in Arrow and {expected.dtype} in the C parser"
+    return None
+
+
+def read_csv_arrow(csv_file):
+    """Parse with Arrow's multithreaded reader into the frame the C parser would return.
+    Raises ValueError for files where that frame cannot be guaranteed."""
+    import pyarrow as pa
+
+    df = csv_sources.read_csv(csv_file, engine="pyarrow")
+    reason = differs_from_c_parser(df)
+    if reason is None and has_hex_literal(csv_file):
+        reason = "hexadecimal numbers"
+    if reason:
+        raise ValueError(f"{csv_file}: {reason}")
+    # Arrow also recognises dates and times, which the C parser leaves as text.
+    # Arrow only reads YYYY-MM-DD as a date, so isoformat() gives the text back;
+    # other date/time columns are read again as text.
+    reread = []
+    for col in df.columns:
+        kind = temporal_kind(df[col])
+        if kind == "date":
+            df[col] = pd.Series(pa.array(df[col]).cast(pa.string()).to_pandas(), index=df.index)
+        elif kind == "other":
+            reread.append(col)
+    if reread:
+        text = csv_sources.read_csv(csv_file, usecols=reread)
+        for col in reread:
+            df[col] = text[col]
+    # Blanks in object columns (e.g. booleans with gaps) are None here and NaN there
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].where(df[col].notna(), float("nan"))
+    reason = differs_from_sample(df, csv_sources.read_csv(csv_file, nrows=ARROW_SAMPLE_ROWS))
+    if reason:
+        raise ValueError(f"{csv_file}: {reason}")
+    return df
+
+
+def apply_dtypes(df, dtypes):
+    pinned = {col: dtype for col, dtype in (dtypes or {}).items() if col in df.columns}
+    if pinned:
+        try:
+            return df.astype(pinned)
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def read_csv(csv_file, dtypes=None, csv_engine="c"):
+    """pd.read_csv with pinned dtypes, falling back to inference if they do not fit.
+
+    With csv_engine="pyarrow" the file is parsed by Arrow when pyarrow is
+    installed; files Arrow cannot read, or would read differently, go
+    through the C parser instead.
+    With csv_engine="parallel", large files are parsed in byte ranges on
+    every core (see parallel_csv.py). Compressed files and zip members are
+    decompressed as they are parsed (see csv_sources.py).
+    """
+    if csv_engine == "parallel" and parallel_csv.worth_splitting(csv_file, parallel_csv.parse_workers()):
+        try:
+            return parallel_csv.read_csv(csv_file, dtypes)
+        except (ValueError, TypeError):
+            pass
+    if csv_engine == "pyarrow" and arrow_available():
+        try:
+            return apply_dtypes(read_csv_arrow(csv_file), dtypes)
+        except Exception:
+            # Whatever goes wrong, the C parser below still reads the file
+            pass
+    if dtypes:
+        try:
+            return csv_sources.read_csv(csv_file, dtype=dtypes)
+        except (ValueError, TypeError):
+            pass
+    return csv_sources.read_csv(csv_file)
+
+
+def iter_csv_chunks(csv_file, chunk_size, dtypes=None, csv_engine="c"):
+    """Yield (chunk, fraction of the file read) for a CSV read in chunks.
+
+    If a chunk does not fit the pinned dtypes, the rest of the file is read
+    again from that row on with inferred types. With csv_engine="parallel",
+    the chunks of a large file are parsed ahead in worker processes, and a
+    chunk that does not fit the pinned dtypes is read with inferred types.
+    """
+    if csv_engine == "parallel" and parallel_csv.worth_splitting(csv_file, parallel_csv.parse_workers()):
+        yield from parallel_csv.iter_chunks(csv_file, chunk_size, dtypes)
+        return
+    rows_read = 0
+    with csv_sources.open_csv(csv_file) as handle:
+        try:
+            for chunk in pd.read_csv(handle, chunksize=chunk_size, dtype=dtypes or None):
+                rows_read += len(chunk)
+                yield chunk, handle.fraction()
+            return
+        except (ValueError, TypeError):
+            if not dtypes:
+                raise
+    with csv_sources.open_csv(csv_file) as handle:
+        for chunk in pd.read_csv(handle, chunksize=chunk_size, skiprows=range(1, rows_read + 1)):
+            yield chunk, handle.fraction()
+
+
+def stream_csv_to_sheet(workbook, csv_file, sheet_name, chunk_size, on_chunk=None, dtypes=None, columnar=(),
+                        stages=None, cancel_event=None, csv_engine="c"):
+    """Copy a CSV into a new write-only sheet one chunk at a time.
+
+    Only one chunk of rows is held in memory, so peak usage depends on
+    chunk_size rather than on the size of the CSV. on_chunk is called after
+    each chunk with the fraction of the file read so far. Rows beyond
+    Excel's limit continue in sheet_name_part2, sheet_name_part3, ...
+    Each chunk also goes to the ColumnarWriters in columnar; workbook is
+    None when only those are written. Parsing and writing time is recorded
+    in stages, a StageRecorder. A set cancel_event stops it after a chunk.
+    csv_engine="parallel" parses the chunks of a large CSV ahead on every core.
+    """
+    if stages is None:
+        stages = StageRecorder()
+    name = os.path.basename(csv_file)
+    writer = SheetWriter(workbook, sheet_name) if workbook is not None else None
+    rows_written = 0
+    # Closed right away when the loop stops early, which stops parallel parsing
+    with closing(stages.iterate("parse", name, iter_csv_chunks(csv_file, chunk_size, dtypes, csv_engine),
+                                lambda item: len(item[0]))) as chunks:
+        for chunk, fraction in chunks:
+            write_chunk(writer, columnar, chunk, name, stages)
+            rows_written += len(chunk)
+            if on_chunk:
+                on_chunk(fraction)
+            check_cancelled(cancel_event)
+    if writer is not None and writer.header is None:
+        workbook.create_sheet(title=sheet_name)
+    return rows_written
+
+
+def write_chunk(writer, columnar, chunk, name, stages):
+    """Append chunk to a SheetWriter (if any) and to ColumnarWriters"""
+    if writer is not None:
+        with stages.stage("write", name, len(chunk)):
+            if writer.header is None:
+                writer.start(chunk.columns)
+            writer.append_rows(iter_sheet_rows(chunk))
+    if columnar:
+        with stages.stage("columnar", name, len(chunk)):
+            for columnar_writer in columnar:
+                columnar_writer.write(chunk)
+
+
+def close_columnar(columnar, name, stages):
+    if columnar:
+        with stages.stage("columnar", name):
+            for columnar_writer in columnar:
+                columnar_writer.close()
+
+
+def discard_columnar(columnar):
+    """Remove the partial files of ColumnarWriters that did not finish"""
+    for columnar_writer in columnar:
+        columnar_writer.discard()
+
+
+def merge_csv_files(file_list, dtypes=None, csv_engine="c", stages=None, cancel_event=None):
+    """Concatenate a group of CSVs with a leading Source_File column.
+
+    dtypes optionally maps each CSV path to the dtypes to read it with.
+    """
+    if stages is None:
+        stages = StageRecorder()
+    dtypes = dtypes or {}
+    dataframes = []
+    for csv_file in file_list:
+        check_cancelled(cancel_event)
+        with stages.stage("parse", os.path.basename(csv_file)) as measured:
+            df = read_csv(csv_file, dtypes.get(csv_file), csv_engine)
+            measured["rows"] = len(df)
+        if 'Source_File' in df.columns:
+            del df['Source_File']
+        # Inserted first, so the concatenated frame needs no reordering copy
+        df.insert(0, 'Source_File', os.path.basename(csv_file))
+        dataframes.append(df)
+    with stages.stage("concat", os.path.basename(file_list[0]), sum(len(df) for df in dataframes)):
+        return pd.concat(dataframes, ignore_index=True, sort=False)
+
+
+def merged_columns(file_list):
+    """Columns of the merged sheet, read from the headers only: Source_File, then
+    every column in order of first appearance"""
+    columns = ['Source_File']
+    seen = set(columns)
+    for csv_file in file_list:
+        for col in csv_sources.read_csv(csv_file, nrows=0).columns:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns
+
+
+def stream_group_to_sheet(workbook, file_list, sheet_name, chunk_size, on_chunk=None, dtypes=None, columnar=(),
+                          stages=None, cancel_event=None, csv_engine="c"):
+    """Merge a group of CSVs into a new write-only sheet one chunk at a time.
+
+    Produces the same sheet as merge_csv_files, but the column set is taken
+    from the headers up front and each file's rows are written as they are
+    read, so memory depends on chunk_size rather than on the size of the
+    group. on_chunk gets the fraction of the group's bytes read so far.
+    columnar, stages, cancel_event, csv_engine and a workbook of None work
+    as in stream_csv_to_sheet.
+    """
+    if stages is None:
+        stages = StageRecorder()
+    dtypes = dtypes or {}
+    columns = merged_columns(file_list)
+    writer = SheetWriter(workbook, sheet_name, columns) if workbook is not None else None
+
+    sizes = [max(csv_sources.source_size(csv_file), 1) for csv_file in file_list]
+    total_size = sum(sizes)
+    done_size = 0
+    rows_written = 0
+    for csv_file, size in zip(file_list, sizes):
+        source_file = os.path.basename(csv_file)
+        with closing(stages.iterate("parse", source_file,
+                                    iter_csv_chunks(csv_file, chunk_size, dtypes.get(csv_file), csv_engine),
+                                    lambda item: len(item[0]))) as chunks:
+            for chunk, fraction in chunks:
+                chunk = chunk.assign(Source_File=source_file).reindex(columns=columns)
+                write_chunk(writer, columnar, chunk, source_file, stages)
+                rows_written += len(chunk)
+                if on_chunk:
+                    on_chunk((done_size + fraction * size) / total_size)
+                check_cancelled(cancel_event)
+        done_size += size
+    return rows_written
+
+
+def convert_to_excel(csv_files, output_file, streaming=False, chunk_size=50000, on_chunk=None, dtypes=None,
+                     csv_engine="c", writer_engine="openpyxl", output_formats=("xlsx",), stages=None,
+                     cancel_event=None):
+    """Write one CSV, or a merged group of CSVs, to output_file.
+
+    output_formats lists what is written: "xlsx" for the workbook and any
+    of COLUMNAR_FORMATS for a copy next to it, e.g. output.parquet. The
+    time spent in each stage is recorded in stages, a StageRecorder. When
+    cancel_event is set, ConversionCancelled is raised and no partial
+    output is left behind.
+    """
+    if stages is None:
+        stages = StageRecorder()
+    dtypes = dtypes or {}
+    columnar_formats = [fmt for fmt in output_formats if fmt in COLUMNAR_FORMATS]
+    output_name = os.path.basename(str(output_file))
+    check_cancelled(cancel_event)
+    if streaming:
+        workbook = new_workbook(output_file, writer_engine) if "xlsx" in output_formats else None
+        columnar = [ColumnarWriter(columnar_path(output_file, fmt), fmt) for fmt in columnar_formats]
+        try:
+            if len(csv_files) > 1:
+                stream_group_to_sheet(workbook, csv_files, "Sheet1", chunk_size, on_chunk, dtypes, columnar, stages,
+                                      cancel_event, csv_engine)
+            else:
+                stream_csv_to_sheet(workbook, csv_files[0], "Sheet1", chunk_size, on_chunk,
+                                    dtypes.get(csv_files[0]), columnar, stages, cancel_event, csv_engine)
+        except BaseException:
+            # The workbook is only written when saved; the columnar files already exist
+            if workbook is not None:
+                workbook.discard()
+            discard_columnar(columnar)
+            raise
+        if workbook is not None:
+            with stages.stage("write", output_name):
+                workbook.save()
+        close_columnar(columnar, output_name, stages)
+    else:
+        if len(csv_files) > 1:
+            df = merge_csv_files(csv_files, dtypes, csv_engine, stages, cancel_event)
+        else:
+            with stages.stage("parse", os.path.basename(csv_files[0])) as measured:
+                df = read_csv(csv_files[0], dtypes.get(csv_files[0]), csv_engine)
+                measured["rows"] = len(df)
+        if "xlsx" in output_formats:
+            with stages.stage("write", output_name, len(df)):
+                with frame_writer(output_file, writer_engine) as writer:
+                    write_frame(writer, df, "Sheet1")
+        for fmt in columnar_formats:
+            with stages.stage("columnar", output_name, len(df)):
+                write_columnar(df, columnar_path(output_file, fmt), fmt)
+    return str(output_file)
+
+
+def init_worker(cancel_event):
+    global worker_cancel_event
+    worker_cancel_event = cancel_event
+    # Ctrl+C reaches the whole process group; the parent cancels through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def convert_in_worker(*args):
+    """convert_to_excel in a pool process; returns its stage records"""
+    stages = StageRecorder()
+    convert_to_excel(*args, stages=stages, cancel_event=worker_cancel_event)
+    return list(stages.records.values())
+
+
+def task_result(future, futures, cancel_event, pool_event):
+    """future.result(); once cancel_event is set, pool_event tells running
+    tasks to stop and the tasks that have not started are cancelled"""
+    from concurrent.futures import wait
+
+    if cancel_event is not None:
+        while not wait([future], timeout=0.2).done:
+            if cancel_event.is_set():
+                pool_event.set()
+                for pending in futures:
+                    pending.cancel()
+                break
+    return future.result()
+
+
+def run_tasks(tasks, max_workers=1, streaming=False, chunk_size=50000, on_chunk=None, dtypes=None,
+              csv_engine="c", writer_engine="openpyxl", output_formats=("xlsx",), stages=None,
+              cancel_event=None):
+    """Run (csv_files, output_file) tasks and yield (task, error) in task order.
+
+    With more than one worker the tasks are converted in a process pool,
+    otherwise inline, where on_chunk receives per-chunk progress. A failing
+    task yields its exception instead of stopping the batch. dtypes maps
+    CSV paths to pinned dtypes; writer_engine is one of excel_writers.WRITER_ENGINES
+    and output_formats a selection of OUTPUT_FORMATS. Stage measurements,
+    from the pool processes too, are added to stages. Tasks stopped by
+    cancel_event yield ConversionCancelled; inline, the next task raises it.
+    """
+    dtypes = dtypes or {}
+    if max_workers <= 1 or len(tasks) <= 1:
+        for csv_files, output_file in tasks:
+            check_cancelled(cancel_event)
+            try:
+                convert_to_excel(csv_files, output_file, streaming, chunk_size, on_chunk, dtypes, csv_engine,
+                                 writer_engine, output_formats, stages, cancel_event)
+                yield (csv_files, output_file), None
+            except Exception as e:
+                yield (csv_files, output_file), e
+        return
+
+    from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+    context = parallel_csv.pool_context()
+    # Tells the pool processes to stop; set from cancel_event while waiting for results
+    pool_event = context.Event()
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), mp_context=context,
+                             initializer=init_worker, initargs=(pool_event,)) as pool:
+        futures = [pool.submit(convert_in_worker, csv_files, output_file, streaming, chunk_size, None,
+                               {csv_file: dtypes.get(csv_file) for csv_file in csv_files}, csv_engine,
+                               writer_engine, output_formats)
+                   for csv_files, output_file in tasks]
+        try:
+            for task, future in zip(tasks, futures):
+                try:
+                    records = task_result(future, futures, cancel_event, pool_event)
+                    if stages is not None:
+                        stages.merge(records)
+                    yield task, None
+                except CancelledError:
+                    yield task, ConversionCancelled()
+                except Exception as e:
+                    yield task, e
+        finally:
+            # Also when the caller stops early: do not start the remaining tasks
+            pool_event.set()
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,200 @@
+"""
+Compressed CSVs and CSVs inside zip archives.
+
+Besides plain ``.csv`` files, the converter reads ``.csv.gz``, ``.csv.bz2``,
+``.csv.xz`` and ``.csv.zst`` files (the last needs the zstandard package)
+and the CSVs inside ``.zip`` archives. They are decompressed while the
+parser reads them, so nothing is unpacked to disk.
+
+A CSV inside an archive is addressed by a path below the archive, as if the
+archive were a folder: ``bundles/daily.zip/sales_20240101.csv``. Such paths
+have a base name and a folder like any other, so they are listed, grouped
+by extract_base_name and named in sheets and Source_File columns the same
+way as ordinary files.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zipfile
+
+from lazy_import import lazy_module
+
+pd = lazy_module("pandas")
+
+
+def zstd_reader(raw):
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading .zst files requires the zstandard package: pip install zstandard") from None
+    return zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+
+
+# Compression suffix -> opener of a decompressing stream over a binary file
+DECOMPRESSORS = {
+    ".gz": lambda raw: gzip.GzipFile(fileobj=raw, mode="rb"),
+    ".bz2": lambda raw: bz2.BZ2File(raw, mode="rb"),
+    ".xz": lambda raw: lzma.LZMAFile(raw, mode="rb"),
+    ".zst": zstd_reader,
+}
+
+ARCHIVE_SUFFIX = ".zip"
+
+
+def compression_suffix(name):
+    """The compression suffix of name (".gz", ...), or "" """
+    _, suffix = os.path.splitext(name)
+    suffix = suffix.lower()
+    return suffix if suffix in DECOMPRESSORS else ""
+
+
+def is_csv_name(name):
+    """True for .csv file names, compressed or not"""
+    name = name.lower()
+    suffix = compression_suffix(name)
+    return name[:len(name) - len(suffix)].endswith(".csv")
+
+
+def is_archive_name(name):
+    return name.lower().endswith(ARCHIVE_SUFFIX)
+
+
+def csv_stem(path):
+    """File name without its compression suffix and extension: what Path.stem
+    gives for plain files, "sales" for sales.csv.gz"""
+    name = os.path.basename(path)
+    suffix = compression_suffix(name)
+    return os.path.splitext(name[:len(name) - len(suffix)])[0]
+
+
+def split_archive_path(path):
+    """(archive, member name) for a CSV inside a zip archive, (path, None) otherwise"""
+    path = os.fspath(path)
+    if os.path.isfile(path):
+        return path, None
+    archive = os.path.dirname(path)
+    while archive and archive != os.path.dirname(archive):
+        if is_archive_name(archive) and os.path.isfile(archive):
+            member = os.path.relpath(path, archive).replace(os.sep, "/")
+            return archive, member
+        archive = os.path.dirname(archive)
+    return path, None
+
+
+def is_plain(path):
+    """True for an uncompressed file on disk, which can be memory-mapped"""
+    archive, member = split_archive_path(path)
+    return member is None and not compression_suffix(path)
+
+
+def archive_members(archive):
+    """Paths of the CSVs inside a zip archive, in archive order"""
+    try:
+        with zipfile.ZipFile(archive) as bundle:
+            names = [info.filename for info in bundle.infolist() if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile):
+        return []
+    return [os.path.join(archive, *name.split("/")) for name in names if is_csv_name(name)]
+
+
+def expand(path):
+    """The CSVs a path stands for: the members of a zip archive, or the path itself"""
+    if is_archive_name(path) and os.path.isfile(path):
+        return archive_members(path)
+    return [path]
+
+
+def source_stat(path):
+    """(size, mtime_ns) of a CSV source. A CSV inside an archive has its
+    uncompressed size and the archive's modification time."""
+    archive, member = split_archive_path(path)
+    stat = os.stat(archive)
+    if member is None:
+        return stat.st_size, stat.st_mtime_ns
+    try:
+        with zipfile.ZipFile(archive) as bundle:
+            return bundle.getinfo(member).file_size, stat.st_mtime_ns
+    except (KeyError, zipfile.BadZipFile) as e:
+        raise FileNotFoundError(f"{path}: {e}") from None
+
+
+def exists(path):
+    try:
+        source_stat(path)
+    except OSError:
+        return False
+    return True
+
+
+def source_size(path):
+    return source_stat(path)[0]
+
+
+class CsvStream(io.RawIOBase):
+    """Decompressed bytes of one CSV source, readable by pd.read_csv.
+
+    fraction() tells how much of the source has been read, measured on the
+    compressed bytes where there are any.
+    """
+
+    def __init__(self, stream, measured, size, resources=()):
+        super().__init__()
+        self.stream = stream
+        self.measured = measured
+        self.size = max(size, 1)
+        # Closed after the stream, innermost first
+        self.resources = list(resources)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def fraction(self):
+        return min(self.measured.tell() / self.size, 1.0)
+
+    def close(self):
+        if not self.closed:
+            try:
+                for resource in [self.stream] + self.resources:
+                    resource.close()
+            finally:
+                super().close()
+
+
+def open_csv(path):
+    """Binary stream of the CSV at path, decompressed on the fly"""
+    archive, member = split_archive_path(path)
+    if member is None:
+        raw = open(archive, "rb")
+        size = os.fstat(raw.fileno()).st_size
+    else:
+        try:
+            with zipfile.ZipFile(archive) as bundle:
+                # The member stays readable after the archive object is closed
+                size = bundle.getinfo(member).file_size
+                raw = bundle.open(member)
+        except (KeyError, zipfile.BadZipFile) as e:
+            raise FileNotFoundError(f"{path}: {e}") from None
+    suffix = compression_suffix(path)
+    if not suffix:
+        return CsvStream(raw, raw, size)
+    try:
+        stream = DECOMPRESSORS[suffix](raw)
+    except BaseException:
+        raw.close()
+        raise
+    return CsvStream(stream, raw, size, [raw])
+
+
+def read_csv(path, **kwargs):
+    """pd.read_csv of any CSV source. Plain files are handed to pandas by path,
+    so engines that read files natively still do."""
+    if is_plain(path):
+        return pd.read_csv(path, **kwargs)
+    with open_csv(path) as handle:
+        return pd.read_csv(handle, **kwargs)
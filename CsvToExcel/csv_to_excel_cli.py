@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Command-line interface for the CSV to Excel converter.
+
+Runs the same conversion engine as the GUI without importing PyQt5, so it
+works from cron, on servers without a display and in batch pipelines.
+
+Examples:
+  python csv_to_excel_cli.py data/*.csv --combine -o combined.xlsx
+  python csv_to_excel_cli.py exports/ --detect-similar -o out_dir
+  python csv_to_excel_cli.py daily_bundle.zip sales_*.csv.gz --detect-similar -o out_dir
+  python csv_to_excel_cli.py new/ --append master.xlsx --override --duplicate-keys ID,Date
+  python csv_to_excel_cli.py new/ --append master.xlsx --override --duplicate-keys Name --duplicate-match fuzzy
+  python csv_to_excel_cli.py --job nightly.json
+  python csv_to_excel_cli.py landing/ --watch --append master.xlsx --override
+
+A job file is JSON with a "jobs" list (or just the list). Each job uses the
+long option names with underscores as keys, e.g.
+  {"jobs": [{"name": "sales", "inputs": ["exports/sales"], "append": "master.xlsx",
+             "override": true, "duplicate_keys": ["ID"]}]}
+Relative paths in a job file are resolved against the job file's folder.
+"schema_cache" may be true (default location) or a path.
+
+Ctrl+C or SIGTERM stops the running job after its current file or chunk
+(press Ctrl+C twice to abort at once). With --resume, a job that writes one
+Excel file per CSV keeps a checkpoint journal, so running it again after it
+was stopped or crashed only converts the files that were not finished.
+
+--timings prints how long each stage of a job (parsing, merging, duplicate
+checks, writing) took and its peak memory; --stage-log appends the same
+measurements to a JSON-lines file for later comparison.
+"""
+
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import csv_sources
+from checkpoint_journal import DEFAULT_DIR as JOURNAL_DIR
+from conversion_engine import ConversionEngine, find_csv_files_recursive
+from conversion_cache import DEFAULT_PATH as CONVERSION_CACHE_PATH
+from conversion_tasks import CSV_ENGINES, OUTPUT_FORMATS
+from excel_writers import WRITER_ENGINES
+from near_duplicates import DUPLICATE_MATCHES
+from file_manifest import FileManifest
+from folder_watch import create_watcher
+from schema_cache import DEFAULT_PATH as SCHEMA_CACHE_PATH
+
+JOB_DEFAULTS = {
+    "inputs": [],
+    "output": "",
+    "combine": False,
+    "sheet_names": [],
+    "detect_similar": False,
+    "append": "",
+    "override": False,
+    "duplicate_keys": [],
+    "duplicate_match": "exact",
+    "match_decimals": 6,
+    "match_threshold": 0.9,
+    "stream": False,
+    "chunk_size": 50000,
+    "workers": 1,
+    "schema_cache": "",
+    "csv_engine": "c",
+    "changed_only": False,
+    "skip_unchanged": False,
+    "writer": "openpyxl",
+    "formats": ["xlsx"],
+    "timings": False,
+    "stage_log": "",
+    "resume": False,
+}
+
+
+def split_keys(value):
+    if isinstance(value, str):
+        return [key.strip() for key in value.split(',') if key.strip()]
+    return list(value or [])
+
+
+def collect_csv_files(inputs, manifests=None):
+    """Expand folders (recursively), glob patterns and plain file paths, keeping order.
+    A zip archive stands for the CSVs inside it.
+
+    If a manifests list is given, folders are scanned through a FileManifest,
+    which is appended to it.
+    """
+    csv_files = []
+    for item in inputs:
+        if os.path.isdir(item) and manifests is not None:
+            manifest = FileManifest(item)
+            manifests.append(manifest)
+            matches = manifest.scan()
+        elif os.path.isdir(item):
+            matches = find_csv_files_recursive(item)
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item, recursive=True))
+        else:
+            matches = [item]
+        for match in (csv_file for path in matches for csv_file in csv_sources.expand(path)):
+            if match not in csv_files:
+                csv_files.append(match)
+    return csv_files
+
+
+def load_jobs(job_file):
+    with open(job_file, encoding="utf-8") as handle:
+        data = json.load(handle)
+    jobs = data.get("jobs", []) if isinstance(data, dict) else data
+    base_dir = os.path.dirname(os.path.abspath(job_file))
+    loaded = []
+    for i, job in enumerate(jobs):
+        unknown = set(job) - set(JOB_DEFAULTS) - {"name"}
+        if unknown:
+            raise ValueError(f"{job_file}: unknown option(s) in job {i + 1}: {', '.join(sorted(unknown))}")
+        options = dict(JOB_DEFAULTS, **job)
+        options.setdefault("name", f"{os.path.basename(job_file)}#{i + 1}")
+        options["inputs"] = [os.path.join(base_dir, path) for path in options["inputs"]]
+        for key in ("output", "append", "stage_log"):
+            if options[key]:
+                options[key] = os.path.join(base_dir, options[key])
+        options["duplicate_keys"] = split_keys(options["duplicate_keys"])
+        options["formats"] = split_keys(options["formats"])
+        if options["schema_cache"] is True:
+            options["schema_cache"] = SCHEMA_CACHE_PATH
+        elif options["schema_cache"]:
+            options["schema_cache"] = os.path.join(base_dir, options["schema_cache"])
+        loaded.append(options)
+    return loaded
+
+
+def validate(options):
+    if options["csv_engine"] not in CSV_ENGINES:
+        return f"unknown csv_engine '{options['csv_engine']}' (choose from {', '.join(CSV_ENGINES)})"
+    if options["writer"] not in WRITER_ENGINES:
+        return f"unknown writer '{options['writer']}' (choose from {', '.join(WRITER_ENGINES)})"
+    if options["duplicate_match"] not in DUPLICATE_MATCHES:
+        return (f"unknown duplicate_match '{options['duplicate_match']}' "
+                f"(choose from {', '.join(DUPLICATE_MATCHES)})")
+    if not 0 < options["match_threshold"] <= 1:
+        return "match_threshold must be between 0 and 1"
+    unknown = [fmt for fmt in options["formats"] if fmt not in OUTPUT_FORMATS]
+    if unknown or not options["formats"]:
+        return f"formats must be some of {', '.join(OUTPUT_FORMATS)}"
+    if options["append"] and options["formats"] != ["xlsx"]:
+        return "Parquet and Feather output is only available when creating new files"
+    if options["append"]:
+        if not options["override"] and not options["output"]:
+            return "append mode needs --override or an --output file for the updated copy"
+    elif not options["output"]:
+        return "an --output file (combine) or folder is required"
+    return None
+
+
+def run_job(options, quiet=False, csv_files=None, manifests=None, cancel_event=None):
+    """Run one job; returns (success, message).
+
+    csv_files and manifests replace the files collected from the inputs,
+    e.g. for a batch of files reported by a watcher. Setting cancel_event
+    stops the job after its current file or chunk.
+    """
+    error = validate(options)
+    if error:
+        return False, error
+    if csv_files is None:
+        manifests = [] if options["changed_only"] else None
+        csv_files = collect_csv_files(options["inputs"], manifests)
+    if not csv_files:
+        return False, "No CSV files found"
+
+    append_mode = bool(options["append"])
+    status_callback = None if quiet else (lambda message: print(f"  {message}", flush=True))
+    engine = ConversionEngine(
+        csv_files,
+        options["output"],
+        True if append_mode else options["combine"],
+        options["sheet_names"],
+        options["detect_similar"],
+        append_mode,
+        options["override"],
+        options["append"],
+        options["duplicate_keys"],
+        streaming=options["stream"],
+        chunk_size=options["chunk_size"],
+        max_workers=options["workers"],
+        schema_cache_path=options["schema_cache"] or None,
+        csv_engine=options["csv_engine"],
+        manifests=manifests,
+        conversion_cache_path=CONVERSION_CACHE_PATH if options["skip_unchanged"] else None,
+        writer_engine=options["writer"],
+        output_formats=options["formats"],
+        duplicate_match=options["duplicate_match"],
+        match_decimals=options["match_decimals"],
+        match_threshold=options["match_threshold"],
+        stage_log_path=options["stage_log"] or None,
+        journal_dir=JOURNAL_DIR if options["resume"] else None,
+        cancel_event=cancel_event,
+        status_callback=status_callback,
+    )
+    result = engine.run()
+    if options["timings"]:
+        for line in engine.stage_summary():
+            print(f"  {line}", flush=True)
+    return result
+
+
+def cancel_on_signals(cancel_event):
+    """Ctrl+C and SIGTERM set cancel_event, so the running job stops cleanly;
+    a second Ctrl+C aborts at once"""
+    def on_signal(signum, frame):
+        if signum == signal.SIGINT and cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        print("Cancelling after the current file or chunk...", flush=True)
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+
+def watch(options, debounce, polling=False, quiet=False):
+    """Append every batch of CSVs that lands in the input folders until interrupted"""
+    error = validate(options)
+    if error:
+        return False, error
+    folders = [item for item in options["inputs"] if os.path.isdir(item)]
+    if len(folders) != len(options["inputs"]):
+        return False, "--watch needs folders as inputs"
+    if not options["append"] or not options["override"]:
+        return False, "--watch needs --append and --override, so each batch goes into the same workbook"
+
+    manifests = [FileManifest(folder) for folder in folders] if options["changed_only"] else None
+    if manifests:
+        # Catch up on files that arrived while nobody was watching
+        pending = [path for manifest in manifests for path in manifest.scan()]
+        if pending:
+            success, message = run_job(options, quiet, pending, manifests)
+            print(f"{'OK' if success else 'FAILED'} [{options['name']}] {message}", flush=True)
+
+    watcher = create_watcher(folders, debounce, polling=polling)
+    # A service manager stops the watch with SIGTERM; finish the current batch first
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    print(f"Watching {', '.join(folders)} ({type(watcher).__name__}), press Ctrl+C to stop", flush=True)
+    batches = 0
+    try:
+        for batch in watcher.batches():
+            batches += 1
+            print(f"{time.strftime('%H:%M:%S')} {len(batch)} new CSV file(s)", flush=True)
+            success, message = run_job(options, quiet, batch, manifests)
+            print(f"{'OK' if success else 'FAILED'} [{options['name']}] {message}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    return True, f"Stopped watching after {batches} batches"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="CSV files (.csv, .csv.gz, .csv.bz2, .csv.xz, .csv.zst), zip archives of CSVs, "
+                             "folders (searched recursively) or glob patterns")
+    parser.add_argument("-o", "--output",
+                        help="output Excel file (--combine, --append copy) or output folder")
+    parser.add_argument("--combine", action="store_true",
+                        help="combine all CSVs into one Excel file with one sheet per CSV")
+    parser.add_argument("--sheet-names", nargs="+", default=[], metavar="NAME",
+                        help="sheet names for --combine, in the same order as the CSV files")
+    parser.add_argument("--detect-similar", action="store_true",
+                        help="merge files with similar names (e.g. file_2024 and file_2025)")
+    parser.add_argument("--append", metavar="EXISTING_XLSX",
+                        help="append the CSV rows to this existing Excel file")
+    parser.add_argument("--override", action="store_true",
+                        help="write into the existing file (append) or overwrite existing outputs")
+    parser.add_argument("--duplicate-keys", default="", metavar="COLS",
+                        help="comma-separated columns that identify duplicate rows when appending")
+    parser.add_argument("--duplicate-match", choices=DUPLICATE_MATCHES, default="exact",
+                        help="how key values are compared when appending: exactly; normalized (case, "
+                             "whitespace and Unicode forms ignored, numbers rounded); or fuzzy (normalized, "
+                             "plus text that is at least --match-threshold similar) (default: %(default)s)")
+    parser.add_argument("--match-decimals", type=int, default=JOB_DEFAULTS["match_decimals"], metavar="N",
+                        help="with normalized or fuzzy matching, round numbers to N decimals (default: %(default)s)")
+    parser.add_argument("--match-threshold", type=float, default=JOB_DEFAULTS["match_threshold"], metavar="RATIO",
+                        help="with fuzzy matching, how similar (0-1) each text key must be (default: %(default)s)")
+    parser.add_argument("--stream", action="store_true", help="read CSVs in chunks to keep memory low")
+    parser.add_argument("--chunk-size", type=int, default=JOB_DEFAULTS["chunk_size"],
+                        help="rows per chunk with --stream (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for one-Excel-file-per-CSV conversion (default: 1)")
+    parser.add_argument("--schema-cache", nargs="?", const=SCHEMA_CACHE_PATH, default="", metavar="PATH",
+                        help="remember column types of recurring files in PATH "
+                             f"(default when given without PATH: {SCHEMA_CACHE_PATH})")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="c",
+                        help="CSV parser: pandas' C parser; multithreaded pyarrow, falling back to the C parser "
+                             "when pyarrow is missing or cannot read a file; or parallel, which splits large CSVs "
+                             "into byte ranges parsed by the C parser on every core (default: %(default)s)")
+    parser.add_argument("--writer", choices=WRITER_ENGINES, default="openpyxl",
+                        help="backend for new Excel files: openpyxl, or xlsxwriter in constant-memory mode, "
+                             "which is faster and keeps memory flat (default: %(default)s)")
+    parser.add_argument("--formats", default="xlsx", metavar="LIST",
+                        help=f"comma-separated files to write for each sheet, from {', '.join(OUTPUT_FORMATS)}; "
+                             "columnar files go next to the workbook, e.g. --formats xlsx,parquet "
+                             "(default: %(default)s)")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="only convert CSVs in the input folders that are new or changed since the last "
+                             "successful run; a combined workbook or group of similar files is rebuilt from all "
+                             "of its CSVs when any of them changed")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help="when writing one Excel file per CSV or group, skip those whose output "
+                             "already exists and was made from the same content and options")
+    parser.add_argument("--resume", action="store_true",
+                        help="when writing one Excel file per CSV or group, keep a checkpoint journal so that "
+                             "running the job again after it was stopped or crashed skips the finished files")
+    parser.add_argument("--timings", action="store_true",
+                        help="print the time, rows per second and peak memory of each stage after each job")
+    parser.add_argument("--stage-log", default="", metavar="PATH",
+                        help="append each job's per-stage measurements to this JSON-lines file")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and append CSVs as they arrive in the input folders "
+                             "(needs --append and --override)")
+    parser.add_argument("--debounce", type=float, default=2.0, metavar="SECONDS",
+                        help="with --watch, wait until no file arrived for this long before converting "
+                             "(default: %(default)s)")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, poll the folders instead of using inotify")
+    parser.add_argument("--job", action="append", default=[], metavar="JOB_JSON",
+                        help="run the jobs from a JSON job file (can be repeated)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the result of each job")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    jobs = []
+    try:
+        for job_file in args.job:
+            jobs.extend(load_jobs(job_file))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.inputs:
+        jobs.append(dict(
+            JOB_DEFAULTS,
+            name="command line",
+            inputs=args.inputs,
+            output=args.output or "",
+            combine=args.combine,
+            sheet_names=args.sheet_names,
+            detect_similar=args.detect_similar,
+            append=args.append or "",
+            override=args.override,
+            duplicate_keys=split_keys(args.duplicate_keys),
+            duplicate_match=args.duplicate_match,
+            match_decimals=args.match_decimals,
+            match_threshold=args.match_threshold,
+            stream=args.stream,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            schema_cache=args.schema_cache,
+            csv_engine=args.csv_engine,
+            changed_only=args.changed_only,
+            skip_unchanged=args.skip_unchanged,
+            writer=args.writer,
+            formats=split_keys(args.formats),
+            timings=args.timings,
+            stage_log=args.stage_log,
+            resume=args.resume,
+        ))
+    if not jobs:
+        parser.error("give CSV inputs or at least one --job file")
+    if args.watch:
+        if args.job or not args.inputs:
+            parser.error("--watch works with folders given on the command line, not with --job")
+        success, message = watch(jobs[-1], args.debounce, args.poll, args.quiet)
+        print(f"{'OK' if success else 'FAILED'} [{jobs[-1]['name']}] {message}", flush=True)
+        return 0 if success else 1
+
+    cancel_event = threading.Event()
+    cancel_on_signals(cancel_event)
+    failed = 0
+    for i, options in enumerate(jobs):
+        if cancel_event.is_set():
+            print(f"Cancelled; {len(jobs) - i} job(s) not run", flush=True)
+            return 1
+        if not args.quiet:
+            print(f"Job '{options['name']}':", flush=True)
+        success, message = run_job(options, args.quiet, cancel_event=cancel_event)
+        print(f"{'OK' if success else 'FAILED'} [{options['name']}] {message}", flush=True)
+        failed += not success
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
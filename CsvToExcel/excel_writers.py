@@ -0,0 +1,245 @@
+"""
+Writer backends for new Excel files.
+
+Every mode that creates a workbook from scratch writes through the small
+interface here: new_workbook() gives a workbook whose create_sheet(title)
+returns a sheet with append(row), save() writes the file and discard()
+abandons it without writing anything. Two backends
+are available:
+
+* "openpyxl": openpyxl's write-only workbook; DataFrames are written with
+  pandas' ExcelWriter, exactly as before.
+* "xlsxwriter": xlsxwriter in constant_memory mode, which flushes each row
+  to a temporary file as soon as the next one starts, so memory stays flat
+  however large the sheet. DataFrames are written row by row through the
+  same sheets, since pandas writes cells column by column.
+
+Editing an existing workbook (append mode) is not done here; see
+xlsx_append.py.
+"""
+
+import itertools
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+
+from lazy_import import lazy_module
+
+pd = lazy_module("pandas")
+openpyxl = lazy_module("openpyxl")
+
+WRITER_ENGINES = ("openpyxl", "xlsxwriter")
+
+# Rows per Excel sheet, header row included. Longer data continues in
+# <sheet>_part2, <sheet>_part3, ... sheets.
+MAX_SHEET_ROWS = 1048576
+
+
+@lru_cache(maxsize=None)
+def xlsxwriter_available():
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_engine(engine):
+    """engine, or "openpyxl" when xlsxwriter is asked for but not installed"""
+    if engine == "xlsxwriter" and not xlsxwriter_available():
+        return "openpyxl"
+    return engine
+
+
+def iter_sheet_rows(df):
+    # Missing values become empty cells, like DataFrame.to_excel does
+    values = df.astype(object).where(df.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def sheet_parts(rows):
+    """Number of sheets needed for rows data rows"""
+    return max(1, -(-rows // (MAX_SHEET_ROWS - 1)))
+
+
+def part_sheet_name(sheet_name, part):
+    """Name of part 1, 2, 3, ... of a split sheet: name, name_part2, name_part3, ..."""
+    if part == 1:
+        return sheet_name
+    suffix = f"_part{part}"
+    return sheet_name[:31 - len(suffix)] + suffix
+
+
+class OpenpyxlWorkbook:
+    """openpyxl write-only workbook saved to output_file"""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.workbook = openpyxl.Workbook(write_only=True)
+
+    def create_sheet(self, title):
+        return self.workbook.create_sheet(title=title)
+
+    def save(self):
+        self.workbook.save(self.output_file)
+
+    def discard(self):
+        # Finishes the sheets' temporary files, which would otherwise be closed mid-write at exit
+        for worksheet in self.workbook.worksheets:
+            if not worksheet.closed:
+                worksheet.close()
+
+
+class XlsxwriterSheet:
+    """Appends rows to an xlsxwriter worksheet; the first row is a bold header"""
+
+    def __init__(self, worksheet, header_format):
+        self.worksheet = worksheet
+        self.header_format = header_format
+        self.row = 0
+
+    def append(self, values):
+        if self.row == 0:
+            self.worksheet.write_row(0, 0, values, self.header_format)
+        else:
+            self.worksheet.write_row(self.row, 0, values)
+        self.row += 1
+
+
+class XlsxwriterWorkbook:
+    """xlsxwriter workbook in constant_memory mode saved to output_file"""
+
+    def __init__(self, output_file):
+        import xlsxwriter
+
+        self.workbook = xlsxwriter.Workbook(str(output_file), {
+            "constant_memory": True,
+            # Cell text is data, never a formula or a hyperlink
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "nan_inf_to_errors": True,
+            "remove_timezone": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        })
+        # Same look as the header pandas writes
+        self.header_format = self.workbook.add_format(
+            {"bold": True, "border": 1, "align": "center", "valign": "top"})
+        self.titles = set()
+
+    def create_sheet(self, title):
+        # Like openpyxl, a title that is already taken gets a number appended
+        unique_title = title
+        counter = 1
+        while unique_title.lower() in self.titles:
+            unique_title = f"{title[:31 - len(str(counter))]}{counter}"
+            counter += 1
+        self.titles.add(unique_title.lower())
+        return XlsxwriterSheet(self.workbook.add_worksheet(unique_title), self.header_format)
+
+    def save(self):
+        self.workbook.close()
+
+    def discard(self):
+        # xlsxwriter only creates the file when it is saved
+        pass
+
+
+def new_workbook(output_file, engine="openpyxl"):
+    """A new, empty workbook written by engine, falling back to openpyxl"""
+    if resolve_engine(engine) == "xlsxwriter":
+        return XlsxwriterWorkbook(output_file)
+    return OpenpyxlWorkbook(output_file)
+
+
+@contextmanager
+def frame_writer(output_file, engine="openpyxl", stages=None):
+    """Target for write_frame(): a pandas ExcelWriter with openpyxl, a
+    constant-memory workbook with xlsxwriter. The file is saved on exit,
+    measured as a "write" stage when stages (a StageRecorder) is given.
+    If the block raises (e.g. a cancelled conversion), no partial file is kept."""
+    if resolve_engine(engine) == "xlsxwriter":
+        target = XlsxwriterWorkbook(output_file)
+        save = target.save
+    else:
+        target = pd.ExcelWriter(output_file, engine="openpyxl")
+        save = target.close
+    try:
+        yield target
+    except BaseException:
+        if not isinstance(target, XlsxwriterWorkbook):
+            discard_frame_writer(target, output_file)
+        # xlsxwriter only creates the file when it is saved
+        raise
+    if stages is None:
+        save()
+    else:
+        with stages.stage("write", os.path.basename(str(output_file))):
+            save()
+
+
+def discard_frame_writer(writer, output_file):
+    """Close a pandas ExcelWriter, which creates its file up front, and remove the file"""
+    try:
+        writer.close()
+    except Exception:
+        # e.g. no sheet was written yet
+        pass
+    try:
+        os.remove(output_file)
+    except OSError:
+        pass
+
+
+class SheetWriter:
+    """Appends rows to a write-only sheet and rolls over into name_part2,
+    name_part3, ... sheets, each starting with the header, whenever Excel's
+    row limit is reached"""
+
+    def __init__(self, workbook, sheet_name, header=None):
+        self.workbook = workbook
+        self.sheet_name = sheet_name
+        self.header = None
+        self.worksheet = None
+        self.parts = 0
+        self.sheet_rows = 0
+        if header is not None:
+            self.start(header)
+
+    def start(self, header):
+        self.header = [str(col) for col in header]
+        self.new_part()
+
+    def new_part(self):
+        self.parts += 1
+        self.worksheet = self.workbook.create_sheet(title=part_sheet_name(self.sheet_name, self.parts))
+        self.worksheet.append(self.header)
+        self.sheet_rows = 1
+
+    def append_rows(self, rows):
+        rows = iter(rows)
+        while True:
+            space = MAX_SHEET_ROWS - self.sheet_rows
+            written = 0
+            for row in itertools.islice(rows, space):
+                self.worksheet.append(row)
+                written += 1
+            self.sheet_rows += written
+            if written < space:
+                return
+            following = next(rows, None)
+            if following is None:
+                return
+            self.new_part()
+            rows = itertools.chain([following], rows)
+
+
+def write_frame(writer, df, sheet_name):
+    """Write df into a frame_writer() target, split over name, name_part2, ...
+    sheets if it is too long"""
+    if isinstance(writer, XlsxwriterWorkbook):
+        SheetWriter(writer, sheet_name, df.columns).append_rows(iter_sheet_rows(df))
+        return
+    step = MAX_SHEET_ROWS - 1
+    for part in range(1, sheet_parts(len(df)) + 1):
+        rows = df.iloc[(part - 1) * step:part * step] if len(df) > step else df
+        rows.to_excel(writer, sheet_name=part_sheet_name(sheet_name, part), index=False)
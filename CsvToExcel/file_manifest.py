@@ -0,0 +1,129 @@
+"""
+File manifest of a scanned folder.
+
+Remembers, for every CSV under a root folder, its size, modification time
+and content hash, plus the hash it had when it was last converted
+successfully. That lets a conversion skip the files that have not changed
+since the previous run. Hashes are only computed for files whose size or
+modification time changed, so unchanged files are never read again.
+Compressed CSVs and the CSVs inside zip archives are listed too (see
+csv_sources.py).
+"""
+
+import hashlib
+import json
+import os
+
+import csv_sources
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".csv_to_excel", "manifests")
+
+
+def walk_csv_files(folder_path):
+    """Yield the path of every CSV below folder_path, using os.scandir.
+
+    Matches .csv files like Path.rglob("*.csv") (case-insensitively only where
+    the file system is), plus compressed CSVs and, for every zip archive, the
+    paths of the CSVs inside it. Symlinked folders are not followed, so link
+    loops are harmless.
+    """
+    pending = [str(folder_path)]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif csv_sources.is_csv_name(os.path.normcase(entry.name)) and entry.is_file():
+                            yield entry.path
+                        elif csv_sources.is_archive_name(os.path.normcase(entry.name)) and entry.is_file():
+                            yield from csv_sources.archive_members(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with csv_sources.open_csv(path) as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """Size, mtime and content hash of every CSV below one root folder"""
+
+    VERSION = 1
+
+    def __init__(self, root, manifest_dir=DEFAULT_DIR):
+        self.root = os.path.abspath(root)
+        name = hashlib.sha1(os.path.normcase(self.root).encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(manifest_dir, f"{name}.json")
+        # relative path -> {"size": int, "mtime_ns": int, "hash": str or None, "done": str or None}
+        self.files = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION and data.get("root") == self.root:
+            self.files = data.get("files", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"version": self.VERSION, "root": self.root, "files": self.files}, handle)
+        os.replace(temp_path, self.path)
+
+    def relative_path(self, path):
+        """Path relative to the root, or None for files outside it"""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep) or os.path.isabs(relative):
+            return None
+        return relative
+
+    def scan(self):
+        """Sorted paths of every CSV below the root; forgets files that are gone"""
+        csv_files = sorted(walk_csv_files(self.root))
+        present = {self.relative_path(path) for path in csv_files}
+        self.files = {relative: entry for relative, entry in self.files.items() if relative in present}
+        return csv_files
+
+    def contains(self, path):
+        return self.relative_path(path) is not None
+
+    def current_entry(self, path):
+        """Entry of path refreshed from its current size and mtime"""
+        relative = self.relative_path(path)
+        size, mtime_ns = csv_sources.source_stat(path)
+        entry = self.files.get(relative)
+        if entry is None or entry["size"] != size or entry["mtime_ns"] != mtime_ns:
+            entry = {"size": size, "mtime_ns": mtime_ns, "hash": None,
+                     "done": entry["done"] if entry else None}
+            self.files[relative] = entry
+        return entry
+
+    def is_changed(self, path):
+        """True if path is new or its content differs from the last successful run"""
+        entry = self.current_entry(path)
+        if entry["done"] is None:
+            return True
+        if entry["hash"] is None:
+            entry["hash"] = file_hash(path)
+        return entry["hash"] != entry["done"]
+
+    def mark_done(self, paths):
+        """Record the current content of paths as converted"""
+        for path in paths:
+            entry = self.current_entry(path)
+            if entry["hash"] is None:
+                entry["hash"] = file_hash(path)
+            entry["done"] = entry["hash"]
@@ -0,0 +1,199 @@
+"""
+Watch folders for newly arrived CSV files.
+
+A watcher yields batches of CSV paths that were written or moved into the
+watched folders (recursively); a zip archive arriving yields the CSVs inside
+it. Events are collected until the folders have
+been quiet for a debounce window, so a burst of files arrives as one batch
+and a file that is still being written is only reported once it is complete.
+
+On Linux, inotify is used through ctypes, without extra packages; elsewhere,
+or if inotify is unavailable, the folders are polled.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import csv_sources
+from file_manifest import walk_csv_files
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_csv(path):
+    """True for CSVs, compressed CSVs and zip archives, which may hold CSVs"""
+    name = os.path.normcase(path)
+    return csv_sources.is_csv_name(name) or csv_sources.is_archive_name(name)
+
+
+class FolderWatcher:
+    """Base class: subclasses implement wait(timeout) -> set of changed CSV paths"""
+
+    def __init__(self, folders, debounce=2.0, poll_interval=1.0):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.stopped = False
+
+    def wait(self, timeout):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+    def batches(self):
+        """Yield sorted lists of new or rewritten CSV files until stop() is called"""
+        pending = set()
+        last_event = 0.0
+        try:
+            while not self.stopped:
+                if pending:
+                    timeout = max(0.0, last_event + self.debounce - time.monotonic())
+                else:
+                    timeout = self.poll_interval
+                arrived = self.wait(timeout)
+                if arrived:
+                    pending |= arrived
+                    last_event = time.monotonic()
+                elif pending and time.monotonic() - last_event >= self.debounce:
+                    batch = sorted(path for path in pending if csv_sources.exists(path))
+                    pending = set()
+                    if batch:
+                        yield batch
+        finally:
+            self.close()
+
+
+class PollingWatcher(FolderWatcher):
+    """Detects new and changed CSVs by comparing size and mtime between scans"""
+
+    def __init__(self, folders, debounce=2.0, poll_interval=1.0):
+        super().__init__(folders, debounce, poll_interval)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for folder in self.folders:
+            for path in walk_csv_files(folder):
+                try:
+                    snapshot[path] = csv_sources.source_stat(path)
+                except OSError:
+                    continue
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+        snapshot = self.scan()
+        arrived = {path for path, stamp in snapshot.items() if self.snapshot.get(path) != stamp}
+        self.snapshot = snapshot
+        return arrived
+
+
+class InotifyWatcher(FolderWatcher):
+    """Uses Linux inotify: close-after-write and move-in events, new subfolders are watched too"""
+
+    def __init__(self, folders, debounce=2.0, poll_interval=1.0):
+        super().__init__(folders, debounce, poll_interval)
+        self.libc = load_libc()
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.started = time.time()
+        try:
+            for folder in self.folders:
+                self.add_tree(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+        self.watches[wd] = directory
+
+    def add_tree(self, folder):
+        self.add_watch(folder)
+        for root, dirs, _ in os.walk(folder):
+            for name in dirs:
+                self.add_watch(os.path.join(root, name))
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        arrived = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                arrived |= self.recent_files()
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in the new folder before its watch exists
+                    self.add_tree(path)
+                    arrived |= set(walk_csv_files(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_csv(name):
+                arrived.update(csv_sources.expand(path))
+        return arrived
+
+    def recent_files(self):
+        """After an event queue overflow: every CSV modified since watching started"""
+        recent = set()
+        for folder in self.folders:
+            for path in walk_csv_files(folder):
+                try:
+                    if csv_sources.source_stat(path)[1] / 1e9 >= self.started:
+                        recent.add(path)
+                except OSError:
+                    continue
+        return recent
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def create_watcher(folders, debounce=2.0, poll_interval=1.0, polling=False):
+    """An InotifyWatcher on Linux when possible, a PollingWatcher otherwise"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders, debounce, poll_interval)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folders, debounce, poll_interval)
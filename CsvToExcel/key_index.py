@@ -0,0 +1,155 @@
+"""
+Sidecar duplicate index for append mode.
+
+Stores, for every sheet of a workbook, the column layout, the row count and
+the 64-bit hashes of each row's duplicate-check columns, plus how the keys
+were matched (see near_duplicates.py) and, for fuzzy matching, the
+normalized key of every row. The file sits next
+to the workbook (``<workbook>.keyidx``) and is only trusted while the
+workbook's size and modification time match the ones recorded when the
+index was written, so any outside edit simply forces a rebuild.
+"""
+
+import json
+import os
+
+from lazy_import import lazy_module
+
+np = lazy_module("numpy")
+
+
+class KeyIndex:
+    """Row-key hashes of every sheet in one workbook"""
+
+    # 2: exact keys are hashed together with the kind of each value
+    VERSION = 2
+    SUFFIX = ".keyidx"
+
+    def __init__(self, workbook_path):
+        self.workbook_path = str(workbook_path)
+        # sheet name -> {"columns": [...], "key_cols": [...], "rows": int, "hashes": uint64 array,
+        #                "match": match spec, "keys": normalized keys (fuzzy matching) or None}
+        self.sheets = {}
+
+    @classmethod
+    def index_path(cls, workbook_path):
+        return str(workbook_path) + cls.SUFFIX
+
+    @staticmethod
+    def stamp(workbook_path):
+        stat = os.stat(workbook_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def load(cls, workbook_path):
+        """Return the saved index for workbook_path, or None if it is missing or stale"""
+        path = cls.index_path(workbook_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != cls.VERSION or meta.get("stamp") != cls.stamp(workbook_path):
+                    return None
+                index = cls(workbook_path)
+                for i, sheet in enumerate(meta["sheets"]):
+                    index.sheets[sheet["name"]] = {
+                        "columns": sheet["columns"],
+                        "key_cols": sheet["key_cols"],
+                        "rows": sheet["rows"],
+                        "hashes": data[f"hashes_{i}"],
+                        # Indexes written before other match modes existed are exact
+                        "match": sheet.get("match", "exact"),
+                        "keys": None,
+                    }
+                    if sheet.get("keys") is not None:
+                        index.sheets[sheet["name"]]["keys"] = cls.unpack_keys(data[f"keys_{i}"], sheet["keys"])
+        except (OSError, ValueError, KeyError):
+            return None
+        return index
+
+    @staticmethod
+    def pack_keys(keys):
+        # Normalized keys never contain a line break, so they are stored as one UTF-8 text
+        return np.frombuffer("\n".join(keys).encode("utf-8"), dtype=np.uint8)
+
+    @staticmethod
+    def unpack_keys(blob, count):
+        return blob.tobytes().decode("utf-8").split("\n") if count else []
+
+    def set_sheet(self, sheet_name, columns, key_cols, rows, hashes, match="exact", keys=None):
+        self.sheets[sheet_name] = {
+            "columns": list(columns),
+            "key_cols": list(key_cols),
+            "rows": int(rows),
+            "hashes": np.asarray(hashes, dtype=np.uint64),
+            "match": match,
+            "keys": keys,
+        }
+
+    def save(self, workbook_path=None):
+        """Write the index next to the workbook, stamped with its current size and mtime"""
+        if workbook_path is not None:
+            self.workbook_path = str(workbook_path)
+        meta = {"version": self.VERSION, "stamp": self.stamp(self.workbook_path), "sheets": []}
+        arrays = {}
+        for i, (name, entry) in enumerate(self.sheets.items()):
+            keys = entry.get("keys")
+            meta["sheets"].append({
+                "name": name,
+                "columns": entry["columns"],
+                "key_cols": entry["key_cols"],
+                "rows": entry["rows"],
+                "match": entry.get("match", "exact"),
+                "keys": None if keys is None else len(keys),
+            })
+            arrays[f"hashes_{i}"] = np.asarray(entry["hashes"], dtype=np.uint64)
+            if keys is not None:
+                arrays[f"keys_{i}"] = self.pack_keys(keys)
+
+        path = self.index_path(self.workbook_path)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as handle:
+            np.savez(handle, meta=np.array(json.dumps(meta, default=str)), **arrays)
+        os.replace(temp_path, path)
+
+
+class KeySet:
+    """Growing set of row-key hashes with vectorized membership tests.
+
+    Hashes are kept in a few sorted runs that are searched with searchsorted.
+    Each batch of added hashes becomes a new run, and runs are merged like
+    the digits of a binary counter, so there are only O(log n) of them and
+    adding n hashes in any number of batches costs O(n log n) in total,
+    instead of rebuilding a lookup table of everything seen so far for
+    every batch.
+    """
+
+    def __init__(self, hashes=()):
+        self.runs = []
+        self.add(hashes)
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        """Boolean array: which of hashes are in the set"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes):
+        hashes = np.sort(np.asarray(hashes, dtype=np.uint64))
+        if not len(hashes):
+            return
+        self.runs.append(hashes)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            # Two sorted runs, which the stable sort merges in linear time
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]), kind="stable")
+
+    def values(self):
+        return np.concatenate(self.runs) if self.runs else np.empty(0, dtype=np.uint64)
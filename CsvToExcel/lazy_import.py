@@ -0,0 +1,34 @@
+"""
+Deferred imports for the heavy data libraries.
+
+pandas, numpy and openpyxl together take far longer to import than the
+rest of the application. Modules bind them through lazy_module() instead,
+so the GUI window and the command-line --help appear immediately and the
+libraries are only loaded when the first conversion touches them.
+"""
+
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_module(name):
+    return LazyModule(name)
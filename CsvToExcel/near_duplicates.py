@@ -0,0 +1,285 @@
+"""
+Normalized and fuzzy duplicate matching.
+
+Exact matching compares the key columns of two rows value by value. The
+other two modes compare a canonical key instead:
+
+* "normalized": text is Unicode-normalized (NFKC), case-folded and has its
+  whitespace collapsed and trimmed; numbers, and text that reads as a number,
+  are rounded to a number of decimals, so " ACME  Ltd" and "acme ltd", or
+  0.1 + 0.2 and 0.3, are the same key. Duplicates are still found with one
+  hash lookup per row.
+* "fuzzy": rows whose normalized keys are not equal are also duplicates when
+  every text column is at least `threshold` similar (difflib's ratio) and
+  every number is equal after rounding.
+
+Comparing each new row with every existing one would be O(n*m), so fuzzy
+candidates come from a blocking index instead: the text of each key is
+MinHashed over its byte bigrams, and the signature is cut into bands. Two
+rows become candidates only if they share a whole band and have the same
+numbers, and only the candidates are compared with difflib. Rows with
+similar text share a band with high probability, rows with different text
+almost never, so the work grows about linearly with the number of rows.
+Very crowded buckets are capped, which keeps it linear on repetitive data
+at the price of possibly missing a near-duplicate there.
+"""
+
+from difflib import SequenceMatcher
+
+from lazy_import import lazy_module
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+DUPLICATE_MATCHES = ("exact", "normalized", "fuzzy")
+
+# Separates the columns of a key; marks a column that holds a number
+COLUMN_SEPARATOR = "\x1f"
+NUMBER_MARK = "\x1d"
+
+# MinHash signature of BANDS * BAND_ROWS values. With 3 rows per band, two
+# texts sharing 70% of their bigrams become candidates 99% of the time and
+# texts sharing 30% about a quarter of the time.
+BANDS = 12
+BAND_ROWS = 3
+# Candidates taken from one bucket of one band per row
+BUCKET_CAP = 16
+# Rows MinHashed at a time, to bound the memory used by the bigram arrays
+SIGNATURE_CHUNK = 100000
+
+
+def match_spec(match, decimals):
+    """Identifies how the keys of a sheet were hashed: "exact", "normalized:6", ..."""
+    return "exact" if match == "exact" else f"{match}:{decimals}"
+
+
+def normalize_text(values):
+    text = values.astype(str).str.normalize("NFKC")
+    return text.str.replace(r"\s+", " ", regex=True).str.strip().str.casefold()
+
+
+def normalize_numbers(values, decimals):
+    """Numbers as canonical strings: whole numbers without a decimal point, others rounded"""
+    if pd.api.types.is_integer_dtype(values):
+        return NUMBER_MARK + values.astype("int64").astype(str)
+    floats = values.astype("float64").round(decimals) + 0.0
+    whole = (floats == np.floor(floats)) & (floats.abs() < 2 ** 53)
+    text = floats.astype(str)
+    text[whole] = floats[whole].astype("int64").astype(str)
+    return NUMBER_MARK + text
+
+
+def normalize_column(values, decimals):
+    """One key column as canonical strings; blank cells stay missing"""
+    blank = values.isna()
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+        numbers = pd.Series(np.nan, index=values.index)
+    elif pd.api.types.is_numeric_dtype(values):
+        numbers = values
+    else:
+        try:
+            numbers = pd.to_numeric(values.where(~blank), errors="coerce")
+        except (TypeError, ValueError):
+            numbers = pd.Series(np.nan, index=values.index)
+    if pd.api.types.is_numeric_dtype(values) and not numbers.isna().any():
+        result = normalize_numbers(numbers, decimals).astype(object)
+    else:
+        is_number = numbers.notna() & np.isfinite(numbers.astype("float64"))
+        result = pd.Series(None, index=values.index, dtype=object)
+        if is_number.any():
+            result[is_number] = normalize_numbers(numbers[is_number].astype("float64"), decimals)
+        is_text = ~is_number & ~blank
+        if is_text.any():
+            result[is_text] = normalize_text(values[is_text])
+    result[blank] = None
+    return result
+
+
+def normalized_keys(df, check_cols, decimals=6):
+    """Canonical key of every row of df (an object Series); missing if a key cell is blank"""
+    if not check_cols:
+        return pd.Series("", index=df.index, dtype=object)
+    columns = [normalize_column(df[col], decimals) for col in check_cols]
+    keys = columns[0]
+    for column in columns[1:]:
+        keys = keys + COLUMN_SEPARATOR + column
+    return keys.where(pd.concat(columns, axis=1).notna().all(axis=1), None).astype(object)
+
+
+def key_parts(keys):
+    """(text, number hash) of each key: its text columns joined, and a hash of its numbers"""
+    split = pd.Series(keys, dtype=object).str.split(COLUMN_SEPARATOR, expand=True)
+    text = pd.Series("", index=split.index, dtype=object)
+    numbers = pd.Series("", index=split.index, dtype=object)
+    for col in split.columns:
+        values = split[col].fillna("")
+        is_number = values.str.startswith(NUMBER_MARK)
+        text = text + values.where(~is_number, "") + COLUMN_SEPARATOR
+        numbers = numbers + values.where(is_number, "") + COLUMN_SEPARATOR
+    return text, pd.util.hash_pandas_object(numbers, index=False).to_numpy()
+
+
+def mix(values):
+    """splitmix64 finalizer on a uint64 array"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def minhash_signatures(texts):
+    """(rows, BANDS * BAND_ROWS) MinHash signature of the byte bigrams of every text"""
+    # Every text is padded with spaces, so it has at least one bigram and its
+    # first and last characters count as much as the others
+    blob = np.frombuffer("\n".join(f" {text} " for text in texts).encode("utf-8"), dtype=np.uint8)
+    separator = blob == 10
+    valid = ~(separator[:-1] | separator[1:])
+    positions = np.flatnonzero(valid)
+    bigrams = (blob[positions].astype(np.uint64) << np.uint64(8)) | blob[positions + 1]
+    segment = np.cumsum(separator)[positions]
+    starts = np.searchsorted(segment, np.arange(len(texts)))
+
+    first = mix(bigrams * np.uint64(0x9E3779B97F4A7C15))
+    second = mix(bigrams * np.uint64(0xC2B2AE3D27D4EB4F)) | np.uint64(1)
+    signatures = np.empty((len(texts), BANDS * BAND_ROWS), dtype=np.uint64)
+    for i in range(BANDS * BAND_ROWS):
+        signatures[:, i] = np.minimum.reduceat(first + np.uint64(i) * second, starts)
+    return signatures
+
+
+def band_keys(keys):
+    """(rows, BANDS) bucket of every key in each band, and whether it has any text to block on"""
+    text, number_hashes = key_parts(keys)
+    has_text = (text.str.strip(COLUMN_SEPARATOR) != "").to_numpy()
+    bands = np.zeros((len(text), BANDS), dtype=np.uint64)
+    texts = text.tolist()
+    for start in range(0, len(texts), SIGNATURE_CHUNK):
+        signatures = minhash_signatures(texts[start:start + SIGNATURE_CHUNK])
+        for band in range(BANDS):
+            bucket = number_hashes[start:start + SIGNATURE_CHUNK] ^ np.uint64(band)
+            for row in range(BAND_ROWS):
+                bucket = mix(bucket ^ signatures[:, band * BAND_ROWS + row])
+            bands[start:start + SIGNATURE_CHUNK, band] = bucket
+    return bands, has_text
+
+
+def similar(key, other, threshold):
+    """True if every column of two keys matches: numbers exactly, text at least threshold similar"""
+    for value, other_value in zip(key.split(COLUMN_SEPARATOR), other.split(COLUMN_SEPARATOR)):
+        if value == other_value:
+            continue
+        if value.startswith(NUMBER_MARK) or other_value.startswith(NUMBER_MARK):
+            return False
+        matcher = SequenceMatcher(None, value, other_value, autojunk=False)
+        if (matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold
+                or matcher.ratio() < threshold):
+            return False
+    return True
+
+
+class SortedBands:
+    """Band buckets of some rows, sorted per band for searchsorted lookups"""
+
+    def __init__(self, bands, first_row):
+        self.order = np.argsort(bands, axis=0, kind="stable")
+        self.buckets = np.take_along_axis(bands, self.order, axis=0)
+        self.order += first_row
+
+    def candidates(self, bands):
+        """(query row, indexed row) pairs sharing a bucket, at most BUCKET_CAP per band"""
+        queries, rows = [], []
+        for band in range(BANDS):
+            buckets = self.buckets[:, band]
+            low = np.searchsorted(buckets, bands[:, band], side="left")
+            counts = np.minimum(np.searchsorted(buckets, bands[:, band], side="right") - low, BUCKET_CAP)
+            total = int(counts.sum())
+            if not total:
+                continue
+            query = np.repeat(np.arange(len(bands)), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            queries.append(query)
+            rows.append(self.order[np.repeat(low, counts) + offsets, band])
+        return queries, rows
+
+
+class FuzzyIndex:
+    """Normalized keys of a sheet's rows with their blocking index"""
+
+    def __init__(self, threshold, keys=()):
+        self.threshold = threshold
+        self.keys = []
+        # Bands of every key, in a buffer that grows geometrically so adding
+        # rows costs amortized O(rows). Rows past the sorted part are looked
+        # up in a small tail, sorted once and kept until more rows arrive;
+        # everything is re-sorted once the tail gets large.
+        self.buffer = np.empty((0, BANDS), dtype=np.uint64)
+        self.sorted = None
+        self.sorted_rows = 0
+        self.tail = None
+        self.add(keys)
+
+    @property
+    def bands(self):
+        return self.buffer[:len(self.keys)]
+
+    def add(self, keys):
+        keys = [key for key in keys if key is not None]
+        if not keys:
+            return
+        bands, has_text = band_keys(keys)
+        rows = len(self.keys)
+        if rows + len(keys) > len(self.buffer):
+            buffer = np.empty((max(rows + len(keys), 2 * len(self.buffer)), BANDS), dtype=np.uint64)
+            buffer[:rows] = self.buffer[:rows]
+            self.buffer = buffer
+        # Keys without text only ever match exactly, which the hash lookup already does
+        self.buffer[rows:rows + len(keys)] = np.where(has_text[:, None], bands, np.uint64(0))
+        self.keys.extend(keys)
+        self.tail = None
+        if len(self.keys) - self.sorted_rows > max(1024, self.sorted_rows // 4):
+            self.sorted = SortedBands(self.bands, 0)
+            self.sorted_rows = len(self.keys)
+
+    def matches(self, keys):
+        """Boolean array: which of keys is similar to an indexed key"""
+        keys = list(keys)
+        found = np.zeros(len(keys), dtype=bool)
+        if not keys or not self.keys:
+            return found
+        bands, has_text = band_keys(keys)
+        queries, rows = [], []
+        parts = [self.sorted] if self.sorted is not None else []
+        if self.sorted_rows < len(self.keys):
+            if self.tail is None:
+                self.tail = SortedBands(self.bands[self.sorted_rows:], self.sorted_rows)
+            parts.append(self.tail)
+        for part in parts:
+            part_queries, part_rows = part.candidates(bands)
+            queries.extend(part_queries)
+            rows.extend(part_rows)
+        if not queries:
+            return found
+        queries = np.concatenate(queries)
+        rows = np.concatenate(rows)
+        keep = has_text[queries]
+        pairs, shared = np.unique(queries[keep].astype(np.int64) * len(self.keys) + rows[keep],
+                                  return_counts=True)
+        # Candidates sharing more bands are more likely to match, so each row's
+        # best candidate is tried first, then its second best for the rows
+        # still unmatched, and so on
+        order = np.lexsort((-shared, pairs // len(self.keys)))
+        queries, rows = np.divmod(pairs[order], len(self.keys))
+        first = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+        rank = np.arange(len(queries)) - np.repeat(first, np.diff(np.r_[first, len(queries)]))
+        round_number = 0
+        while len(queries):
+            current = rank == round_number
+            for query, row in zip(queries[current].tolist(), rows[current].tolist()):
+                if similar(keys[query], self.keys[row], self.threshold):
+                    found[query] = True
+            later = ~current & ~found[queries]
+            queries, rows, rank = queries[later], rows[later], rank[later]
+            round_number += 1
+        return found
+
@@ -0,0 +1,215 @@
+"""
+Parallel parsing of one large CSV.
+
+The file is memory-mapped and cut into byte ranges that end at row
+boundaries. Each range is parsed by pandas' C parser in a worker process,
+with the header row put in front of it, and the frames come back in file
+order. Workers only receive the file name and their offsets, and map the
+file themselves, so no data is copied between processes on the way in.
+
+A line break inside a quoted field is not a row boundary. Whether a byte
+offset is inside quotes follows from the number of quote characters before
+it, so the quotes of every stretch between two candidate cut points are
+counted in parallel first, and each cut then moves forward to the first
+line break outside quotes. This assumes RFC 4180 quoting (fields that
+contain quotes are quoted, and quotes inside them are doubled); files with
+stray quotes in unquoted fields may be cut in the wrong place. If the
+ranges cannot be parsed consistently, the file is read in one piece.
+
+Column types are inferred per range. A column that comes out as text in
+some ranges and as numbers in others is parsed as text in all of them, so
+the result is the frame pd.read_csv(low_memory=False) would return. (The
+default pd.read_csv infers types per internal chunk too, and leaves such a
+column as a mix of numbers and text.)
+"""
+
+import io
+import mmap
+import os
+
+import csv_sources
+from lazy_import import lazy_module
+
+pd = lazy_module("pandas")
+
+# Smaller files are parsed in one piece; starting the workers costs more than it saves
+MIN_PARALLEL_SIZE = 64 << 20
+# Bytes per range when the whole file is read at once
+RANGE_SIZE = 32 << 20
+# Bytes scanned at a time while looking for a row boundary
+SCAN_BLOCK = 1 << 20
+
+
+def pool_context():
+    """Start method of the worker processes: forkserver where there is one,
+    else spawn. Pools are started from the GUI's worker thread while Qt's own
+    threads run, and a forked child could inherit a lock one of them holds."""
+    import multiprocessing
+
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # The server imports pandas once, so the workers it forks do not each have to
+    context.set_forkserver_preload(["pandas"])
+    return context
+
+
+def parse_workers():
+    """Processes to parse with: one per core, or 1 inside a pool process,
+    where the conversions already run in parallel"""
+    import multiprocessing
+
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count() or 1
+
+
+def worth_splitting(csv_file, workers):
+    """Only uncompressed files can be mapped and cut into byte ranges"""
+    return workers > 1 and csv_sources.is_plain(csv_file) and os.path.getsize(csv_file) >= MIN_PARALLEL_SIZE
+
+
+def open_map(csv_file):
+    with open(csv_file, "rb") as handle:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def row_end(data, position, in_quotes=False):
+    """Offset just past the first line break at or after position that is
+    outside quotes; in_quotes tells whether position is inside a quoted field"""
+    size = len(data)
+    while position < size:
+        block = data[position:position + SCAN_BLOCK]
+        start = 0
+        while True:
+            line_break = block.find(b"\n", start)
+            if line_break < 0:
+                in_quotes ^= block.count(b'"', start) % 2 == 1
+                break
+            in_quotes ^= block.count(b'"', start, line_break) % 2 == 1
+            if not in_quotes:
+                return position + line_break + 1
+            start = line_break + 1
+        position += len(block)
+    return size
+
+
+def count_quotes(csv_file, start, end):
+    """Quote characters in bytes start..end of the file"""
+    quotes = 0
+    with open_map(csv_file) as data:
+        for position in range(start, end, SCAN_BLOCK):
+            quotes += data[position:min(position + SCAN_BLOCK, end)].count(b'"')
+    return quotes
+
+
+def parse_range(csv_file, header_end, start, end, dtypes=None, text_columns=()):
+    """The rows in bytes start..end as a DataFrame, with the header in bytes 0..header_end.
+    Pinned dtypes that do not fit are dropped; text_columns are read as text."""
+    with open_map(csv_file) as data:
+        buffer = data[:header_end] + data[start:end]
+    text = {col: str for col in text_columns}
+    if dtypes:
+        try:
+            return pd.read_csv(io.BytesIO(buffer), dtype=dict(dtypes, **text))
+        except (ValueError, TypeError):
+            pass
+    return pd.read_csv(io.BytesIO(buffer), dtype=text or None)
+
+
+def header_end(csv_file):
+    with open_map(csv_file) as data:
+        return row_end(data, 0)
+
+
+def split_ranges(csv_file, pool, target_size, start):
+    """Byte ranges of the rows after offset start, about target_size bytes each,
+    cut at line breaks outside quotes"""
+    size = os.path.getsize(csv_file)
+    cuts = list(range(start + target_size, size, target_size))
+    if not cuts:
+        return [(start, size)] if start < size else []
+    stretches = list(zip([start] + cuts, cuts))
+    quotes = pool.map(count_quotes, [csv_file] * len(stretches), *zip(*stretches))
+    bounds = [start]
+    in_quotes = False
+    with open_map(csv_file) as data:
+        for cut, stretch_quotes in zip(cuts, quotes):
+            in_quotes ^= stretch_quotes % 2 == 1
+            bound = row_end(data, cut, in_quotes)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def is_text(dtype):
+    return dtype == object or pd.api.types.is_string_dtype(dtype)
+
+
+def mixed_columns(frames):
+    """Columns that are text in some frames and not in others"""
+    mixed = []
+    for col in frames[0].columns:
+        kinds = {is_text(frame[col].dtype) for frame in frames if frame[col].notna().any()}
+        if len(kinds) > 1:
+            mixed.append(col)
+    return mixed
+
+
+def read_csv(csv_file, dtypes=None, workers=None):
+    """The whole CSV as one DataFrame, parsed in byte ranges by workers processes"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or parse_workers()
+    first_row = header_end(csv_file)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+        size = os.path.getsize(csv_file) - first_row
+        target_size = max(min(RANGE_SIZE, -(-size // workers)), SCAN_BLOCK)
+        ranges = split_ranges(csv_file, pool, target_size, first_row)
+        if len(ranges) <= 1:
+            return parse_range(csv_file, first_row, first_row, os.path.getsize(csv_file), dtypes)
+        frames = list(pool.map(parse_range, *zip(*[(csv_file, first_row, start, end, dtypes)
+                                                   for start, end in ranges])))
+        if any(list(frame.columns) != list(frames[0].columns) for frame in frames):
+            raise ValueError(f"{csv_file}: byte ranges parsed with different columns")
+        mixed = mixed_columns(frames)
+        if mixed:
+            reparse = [i for i, frame in enumerate(frames) if not all(is_text(frame[col].dtype) for col in mixed)]
+            futures = {i: pool.submit(parse_range, csv_file, first_row, *ranges[i], dtypes, mixed) for i in reparse}
+            for i, future in futures.items():
+                frames[i] = future.result()
+    return pd.concat(frames, ignore_index=True)
+
+
+def estimated_row_size(csv_file, start):
+    with open_map(csv_file) as data:
+        sample = data[start:start + SCAN_BLOCK]
+    return max(len(sample) / max(sample.count(b"\n"), 1), 1)
+
+
+def iter_chunks(csv_file, chunk_size, dtypes=None, workers=None):
+    """Yield (chunk, fraction of the file read) in file order, with ranges of
+    about chunk_size rows parsed ahead by workers processes. At most two
+    ranges per worker are in memory at a time."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or parse_workers()
+    first_row = header_end(csv_file)
+    size = max(os.path.getsize(csv_file), 1)
+    target_size = max(int(chunk_size * estimated_row_size(csv_file, first_row)), SCAN_BLOCK)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+    try:
+        ranges = split_ranges(csv_file, pool, target_size, first_row)
+        pending = []
+        for start, end in ranges:
+            pending.append((end, pool.submit(parse_range, csv_file, first_row, start, end, dtypes)))
+            if len(pending) > 2 * workers:
+                end, future = pending.pop(0)
+                yield future.result(), end / size
+        for end, future in pending:
+            yield future.result(), end / size
+    finally:
+        # Also when the reader stops early, e.g. a cancelled conversion
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,98 @@
+"""
+Schema cache for recurring CSV sources.
+
+Files that share a base name (``sales_2024.csv``, ``sales_2025.csv``) are
+usually exports of the same feed. The first time such a family is seen, its
+column types are inferred from a sample and saved; later reads pass them to
+read_csv as fixed dtypes. That skips type inference, keeps the types of the
+whole family consistent, and stores low-cardinality text columns as
+categories to save memory.
+"""
+
+import json
+import os
+
+import csv_sources
+from lazy_import import lazy_module
+
+pd = lazy_module("pandas")
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".csv_to_excel", "schema_cache.json")
+
+
+class SchemaCache:
+    """Column dtypes per family of CSV files, persisted as JSON"""
+
+    VERSION = 1
+    SAMPLE_ROWS = 10000
+    # Text columns with at most this share of distinct values become categories
+    CATEGORY_RATIO = 0.5
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = str(path)
+        self.schemas = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.schemas = data.get("schemas", {})
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"version": self.VERSION, "schemas": self.schemas}, handle, indent=1)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def dtypes_for(self, key, csv_file):
+        """dtypes for read_csv, inferred from a sample of csv_file the first time key is seen"""
+        if key not in self.schemas:
+            self.record(key, csv_sources.read_csv(csv_file, nrows=self.SAMPLE_ROWS))
+        return dict(self.schemas[key])
+
+    def record(self, key, df):
+        """Learn the schema of df, merged with what is already known for key.
+
+        Columns the family disagrees on are widened (Int64 and float64 give
+        float64) or dropped, so a family settles on types every file fits.
+        """
+        schema = self.infer_schema(df)
+        known = self.schemas.get(key)
+        if known is not None:
+            for col, dtype in list(schema.items()):
+                if col not in known or known[col] == dtype:
+                    continue
+                if {known[col], dtype} == {"Int64", "float64"}:
+                    schema[col] = "float64"
+                else:
+                    del schema[col]
+        self.schemas[key] = schema
+        self.changed = True
+
+    @classmethod
+    def infer_schema(cls, df):
+        """Map each pinnable column of df to a dtype name; free text is left to pandas"""
+        schema = {}
+        for col in df.columns:
+            values = df[col]
+            if pd.api.types.is_bool_dtype(values):
+                schema[str(col)] = "boolean"
+            elif pd.api.types.is_integer_dtype(values):
+                # Nullable, so blanks further down the file do not break the read
+                schema[str(col)] = "Int64"
+            elif pd.api.types.is_float_dtype(values):
+                schema[str(col)] = "float64"
+            elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+                non_null = values.dropna()
+                if len(non_null) > 1 and non_null.nunique() <= len(non_null) * cls.CATEGORY_RATIO:
+                    schema[str(col)] = "category"
+        return schema
@@ -0,0 +1,167 @@
+"""
+Per-stage timing and memory measurements of a conversion.
+
+Work is measured in stages, per input file or sheet:
+
+* parse: reading a CSV into a DataFrame (each chunk when streaming)
+* concat: merging the frames of a group of similar files
+* index: reading an existing workbook to build its duplicate index
+* dedup: finding the duplicate rows of a CSV
+* write: writing rows to an Excel sheet (each chunk when streaming)
+* columnar: writing Parquet or Feather copies
+
+Every stage records its duration, the rows it handled and the peak resident
+memory of the process while it ran. Repeated measurements of the same stage
+and item, such as the chunks of a streamed file, add up into one record.
+Peak memory is exact on Linux, where the kernel's high-water mark is reset
+at the start of each stage; elsewhere the resident memory at the end of the
+stage is used when psutil is installed.
+"""
+
+import datetime
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+STAGES = ("parse", "concat", "index", "dedup", "write", "columnar")
+
+DEFAULT_LOG_PATH = os.path.join(os.path.expanduser("~"), ".csv_to_excel", "stage_log.jsonl")
+
+
+@lru_cache(maxsize=None)
+def has_proc_status():
+    return sys.platform.startswith("linux") and os.path.exists("/proc/self/status")
+
+
+def reset_peak():
+    """Start a new peak memory measurement (Linux only)"""
+    if has_proc_status():
+        try:
+            with open("/proc/self/clear_refs", "w") as handle:
+                handle.write("5")
+        except OSError:
+            pass
+
+
+def peak_memory_mb():
+    """Peak resident memory since the last reset_peak(), in MB, or None if unknown"""
+    if has_proc_status():
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1 << 20)
+
+
+class StageRecorder:
+    """Collects stage records; on_record gets each record whenever it is updated"""
+
+    def __init__(self, on_record=None):
+        self.on_record = on_record
+        # (stage, item) -> {"stage", "item", "seconds", "rows", "peak_mb", "count"}
+        self.records = {}
+        # Peaks seen by the stages that are running, outermost first
+        self.running = []
+
+    @contextmanager
+    def stage(self, name, item=None, rows=None):
+        """Measure the with-block as stage name of item; set the rows handled
+        through the yielded dict if they are not known up front"""
+        measured = {"rows": rows}
+        if self.running:
+            # The reset below would hide the enclosing stage's peak so far
+            self.running[-1] = max(self.running[-1] or 0, peak_memory_mb() or 0)
+        reset_peak()
+        self.running.append(None)
+        start = time.perf_counter()
+        try:
+            yield measured
+        finally:
+            seconds = time.perf_counter() - start
+            peak = peak_memory_mb()
+            earlier = self.running.pop()
+            if peak is not None and earlier is not None:
+                peak = max(peak, earlier)
+            if self.running and peak is not None:
+                self.running[-1] = max(self.running[-1] or 0, peak)
+            self.add(name, item, seconds, measured["rows"], peak)
+
+    def iterate(self, name, item, iterable, rows=None):
+        """Yield from iterable, measuring only the time spent producing each value
+        (e.g. parsing a chunk) as stage name; rows(value) gives its rows"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name, item) as measured:
+                value = next(iterator, StopIteration)
+                if value is not StopIteration and rows:
+                    measured["rows"] = rows(value)
+            if value is StopIteration:
+                return
+            yield value
+
+    def add(self, name, item, seconds, rows=None, peak_mb=None, count=1):
+        key = (name, item)
+        record = self.records.get(key)
+        if record is None:
+            record = {"stage": name, "item": item, "seconds": 0.0, "rows": 0, "peak_mb": None, "count": 0}
+            self.records[key] = record
+        record["seconds"] += seconds
+        record["rows"] += rows or 0
+        record["count"] += count
+        if peak_mb is not None:
+            record["peak_mb"] = max(record["peak_mb"] or 0, peak_mb)
+        if self.on_record:
+            self.on_record(dict(record))
+
+    def merge(self, records):
+        """Add records measured elsewhere, e.g. in a worker process"""
+        for record in records:
+            self.add(record["stage"], record["item"], record["seconds"], record["rows"], record["peak_mb"],
+                     record["count"])
+
+    def summary(self):
+        return summarize(self.records.values())
+
+    def save(self, path, **fields):
+        """Append one JSON line with fields, every record and the summary to the log at path"""
+        entry = dict(fields, time=datetime.datetime.now().isoformat(timespec="seconds"),
+                     stages=list(self.records.values()), summary=self.summary())
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(entry) + "\n")
+
+
+def summarize(records):
+    """Totals per stage: seconds, rows, peak memory and the number of items"""
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record["stage"], {"stage": record["stage"], "seconds": 0.0, "rows": 0,
+                                                    "peak_mb": None, "items": 0})
+        total["seconds"] += record["seconds"]
+        total["rows"] += record["rows"]
+        total["items"] += 1
+        if record["peak_mb"] is not None:
+            total["peak_mb"] = max(total["peak_mb"] or 0, record["peak_mb"])
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    return sorted(totals.values(), key=lambda total: order.get(total["stage"], len(order)))
+
+
+def summary_lines(summary):
+    """Human-readable lines for summarize()'s totals"""
+    lines = []
+    for total in summary:
+        line = f"{total['stage']:<8} {total['seconds']:>8.2f} s"
+        if total["rows"]:
+            line += f"  {total['rows']:>11,} rows  {total['rows'] / max(total['seconds'], 1e-9):>11,.0f} rows/s"
+        if total["peak_mb"] is not None:
+            line += f"  peak {total['peak_mb']:,.0f} MB"
+        line += f"  ({total['items']} {'item' if total['items'] == 1 else 'items'})"
+        lines.append(line)
+    return lines
@@ -0,0 +1,415 @@
+"""
+Incremental writer for existing .xlsx workbooks.
+
+An .xlsx file is a zip archive with one XML part per worksheet. Instead of
+loading the whole workbook and saving it again, XlsxAppender only rewrites
+the worksheet parts that receive rows: new rows are spliced in just before
+``</sheetData>`` as inline-string cells, so the shared string table does
+not change either. Every other part, including untouched sheets, is copied
+through unchanged. Sheets written with a namespace prefix (``<x:row>``) get
+prefixed rows, and rows or cells without the optional ``r`` attribute are
+numbered by their position, as Excel does.
+"""
+
+import datetime
+import math
+import numbers
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+
+from excel_writers import MAX_SHEET_ROWS
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+WORKSHEET_REL_TYPE = REL_NS + "/worksheet"
+WORKSHEET_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+ROOT = re.compile(rb'<(?:(\w+):)?worksheet\b[^>]*>')
+ROW_REF = re.compile(rb'\sr="(\d+)"')
+CELL_REF = re.compile(rb'\sr="([A-Z]+)\d+"')
+ILLEGAL_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+XML_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+BLOCK_SIZE = 1 << 20
+# Keeps a <row ...> tag intact across block boundaries while scanning
+SCAN_OVERLAP = 1024
+ZIP64_THRESHOLD = 1 << 30
+
+
+def escape(text):
+    # xml.sax.saxutils would pull in urllib at import time
+    return text.translate(XML_ESCAPES)
+
+
+def column_letter(index):
+    """1 -> A, 27 -> AA"""
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def cell_xml(ref, value):
+    """XML for one cell, or an empty string for a blank cell"""
+    if value is None or (isinstance(value, str) and value == ""):
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Integral):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        if math.isnan(value):
+            return ""
+        if not math.isinf(value):
+            return f'<c r="{ref}"><v>{value!r}</v></c>'
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    text = ILLEGAL_XML_CHARS.sub("", str(value))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def copy_info(info):
+    """Fresh ZipInfo for writing a member, so the source archive's entry is not modified"""
+    copied = zipfile.ZipInfo(info.filename, info.date_time)
+    copied.compress_type = info.compress_type
+    copied.external_attr = info.external_attr
+    copied.create_system = info.create_system
+    return copied
+
+
+def row_xml(row_number, values, first_column=1):
+    cells = "".join(cell_xml(f"{column_letter(first_column + i)}{row_number}", value)
+                    for i, value in enumerate(values))
+    return f'<row r="{row_number}">{cells}</row>'.encode("utf-8")
+
+
+def prefixed(xml, prefix):
+    """xml written by row_xml/cell_xml with every element in the namespace
+    prefix (b"x:"); text is escaped, so every "<" starts a tag"""
+    if not prefix:
+        return xml
+    return xml.replace(b"<", b"<" + prefix).replace(b"<" + prefix + b"/", b"</" + prefix)
+
+
+class SheetPatterns:
+    """Regexes for the elements of a worksheet part whose elements are written
+    with prefix, e.g. b"x:" for <x:row>, or b"" for the usual <row>"""
+
+    def __init__(self, prefix=b""):
+        self.prefix = prefix
+        p = re.escape(prefix)
+        self.row = re.compile(rb"<" + p + rb"row\b([^>]*)>")
+        self.sheet_data_open = re.compile(rb"<" + p + rb"sheetData\s*(/?)>")
+        self.sheet_data_close = b"</" + prefix + b"sheetData>"
+        self.first_row = re.compile(rb"<" + p + rb"row\b([^>]*?)(?:/>|>(.*?)</" + p + rb"row>)", re.S)
+        self.cell = re.compile(rb"<" + p + rb"c\b([^>]*)>")
+        self.dimension = re.compile(rb"<" + p + rb'dimension ref="[^"]*"\s*/>')
+
+
+class XlsxAppender:
+    """Queue rows for sheets of an existing workbook and write only those sheets"""
+
+    def __init__(self, workbook_path):
+        self.workbook_path = str(workbook_path)
+        self.appends = {}
+        self.new_sheets = []
+        with zipfile.ZipFile(self.workbook_path) as archive:
+            self.workbook_part = self.find_workbook_part(archive)
+            self.rels_part = posixpath.join(posixpath.dirname(self.workbook_part), "_rels",
+                                            posixpath.basename(self.workbook_part) + ".rels")
+            self.sheet_parts = self.read_sheet_parts(archive)
+            self.part_names = set(archive.namelist())
+
+    @staticmethod
+    def find_workbook_part(archive):
+        root = ElementTree.fromstring(archive.read("_rels/.rels"))
+        for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship"):
+            if rel.get("Type", "").endswith("/officeDocument"):
+                return rel.get("Target").lstrip("/")
+        return "xl/workbook.xml"
+
+    def resolve_target(self, target):
+        if target.startswith("/"):
+            return target.lstrip("/")
+        return posixpath.normpath(posixpath.join(posixpath.dirname(self.workbook_part), target))
+
+    def read_sheet_parts(self, archive):
+        rels = ElementTree.fromstring(archive.read(self.rels_part))
+        targets = {rel.get("Id"): self.resolve_target(rel.get("Target"))
+                   for rel in rels.iter(f"{{{PKG_REL_NS}}}Relationship")}
+        workbook = ElementTree.fromstring(archive.read(self.workbook_part))
+        parts = {}
+        for sheet in workbook.iter(f"{{{MAIN_NS}}}sheet"):
+            parts[sheet.get("name")] = targets.get(sheet.get(f"{{{REL_NS}}}id"))
+        return parts
+
+    @property
+    def sheet_names(self):
+        return list(self.sheet_parts) + [name for name, _, _ in self.new_sheets]
+
+    def find_sheet(self, sheet_name):
+        """The sheet whose name matches sheet_name the way Excel compares
+        names (ignoring case), or None"""
+        folded = sheet_name.casefold()
+        for name in self.sheet_names:
+            if name.casefold() == folded:
+                return name
+        return None
+
+    def append_rows(self, sheet_name, rows, extra_header=()):
+        """Queue rows below the data of an existing sheet.
+
+        extra_header lists header cells to add after the last cell of the
+        first row, for columns that did not exist in the sheet before.
+        """
+        if sheet_name not in self.sheet_parts:
+            raise KeyError(f"Worksheet named '{sheet_name}' not found")
+        self.appends[self.sheet_parts[sheet_name]] = (rows, list(extra_header))
+
+    def add_sheet(self, sheet_name, header, rows):
+        """Queue a new sheet with a header row followed by rows; returns its name.
+
+        Excel does not allow two sheets whose names only differ in case, so,
+        like openpyxl, a name that is already taken gets a number appended.
+        """
+        unique_name = sheet_name
+        counter = 1
+        while self.find_sheet(unique_name) is not None:
+            unique_name = f"{sheet_name[:31 - len(str(counter))]}{counter}"
+            counter += 1
+        self.new_sheets.append((unique_name, list(header), rows))
+        return unique_name
+
+    def save(self, output_path=None):
+        """Write the workbook to output_path (default: in place)"""
+        output_path = str(output_path or self.workbook_path)
+        directory = os.path.dirname(os.path.abspath(output_path))
+        handle, temp_path = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+        os.close(handle)
+        try:
+            with zipfile.ZipFile(self.workbook_path) as source, \
+                    zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as target:
+                new_parts = self.plan_new_sheets()
+                for info in source.infolist():
+                    if info.filename in self.appends:
+                        self.write_appended_part(source, target, info)
+                    elif new_parts and info.filename == self.workbook_part:
+                        target.writestr(copy_info(info), self.add_workbook_sheets(source.read(info), new_parts))
+                    elif new_parts and info.filename == self.rels_part:
+                        target.writestr(copy_info(info), self.add_workbook_rels(source.read(info), new_parts))
+                    elif new_parts and info.filename == "[Content_Types].xml":
+                        target.writestr(copy_info(info), self.add_content_types(source.read(info), new_parts))
+                    else:
+                        large = info.file_size > ZIP64_THRESHOLD
+                        with source.open(info) as src, target.open(copy_info(info), "w", force_zip64=large) as dst:
+                            shutil.copyfileobj(src, dst, BLOCK_SIZE)
+                now = datetime.datetime.now().timetuple()[:6]
+                for part, rel_id, sheet_name, header, rows in new_parts:
+                    info = zipfile.ZipInfo(part, now)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with target.open(info, "w") as dst:
+                        self.write_new_sheet(dst, header, rows)
+            if os.path.exists(output_path):
+                shutil.copymode(output_path, temp_path)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.workbook_path = output_path
+        return output_path
+
+    # --- Existing sheets ---
+
+    def scan_sheet(self, source, info):
+        """(SheetPatterns of the part, number of its last row).
+
+        The r attribute of rows is optional: a row without it follows the
+        row before it.
+        """
+        patterns = None
+        last_row = row = 0
+        carry = b""
+        with source.open(info) as src:
+            while True:
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    break
+                buffer = carry + block
+                if patterns is None:
+                    patterns = self.sheet_patterns(buffer, info)
+                end = 0
+                for match in patterns.row.finditer(buffer):
+                    number = ROW_REF.search(match.group(1))
+                    row = int(number.group(1)) if number else row + 1
+                    last_row = max(last_row, row)
+                    end = match.end()
+                # Tags before end are counted; a tag cut off by the block boundary is completed next time
+                carry = buffer[max(end, len(buffer) - SCAN_OVERLAP):]
+        if patterns is None:
+            raise ValueError(f"Unsupported worksheet layout in {info.filename}")
+        return patterns, last_row
+
+    @staticmethod
+    def sheet_patterns(head, info):
+        root = ROOT.search(head)
+        if root is None:
+            raise ValueError(f"Unsupported worksheet layout in {info.filename}")
+        if root.group(1) is None:
+            return SheetPatterns()
+        # Written with a prefix for the spreadsheet namespace, e.g. <x:worksheet xmlns:x="...">
+        declaration = b"xmlns:" + root.group(1) + b'="' + MAIN_NS.encode() + b'"'
+        if declaration not in root.group(0):
+            raise ValueError(f"Unsupported worksheet layout in {info.filename}")
+        return SheetPatterns(root.group(1) + b":")
+
+    def write_appended_part(self, source, target, info):
+        rows, extra_header = self.appends[info.filename]
+        patterns, last_row = self.scan_sheet(source, info)
+        prefix = patterns.prefix
+        next_row = last_row + 1
+        large = info.file_size > ZIP64_THRESHOLD
+        with source.open(info) as src, target.open(copy_info(info), "w", force_zip64=large) as dst:
+            head = b""
+            # Read up to the end of the first row so the header can be extended
+            while True:
+                block = src.read(BLOCK_SIZE)
+                head += block
+                opening = patterns.sheet_data_open.search(head)
+                if opening and (opening.group(1) or patterns.first_row.search(head, opening.end())
+                                or patterns.sheet_data_close in head[opening.end():]):
+                    break
+                if not block:
+                    raise ValueError(f"Unsupported worksheet layout in {info.filename}")
+            head = patterns.dimension.sub(b"", head, count=1)
+            opening = patterns.sheet_data_open.search(head)
+            if opening.group(1):
+                # Empty sheet written as <sheetData/>
+                dst.write(head[:opening.start()] + b"<" + prefix + b"sheetData>")
+                if extra_header:
+                    dst.write(prefixed(row_xml(1, extra_header), prefix))
+                    next_row = max(next_row, 2)
+                self.write_rows(dst, rows, next_row, prefix)
+                dst.write(patterns.sheet_data_close + head[opening.end():])
+                shutil.copyfileobj(src, dst, BLOCK_SIZE)
+                return
+            head = self.extend_header(head, opening.end(), extra_header, patterns)
+            if extra_header and next_row == 1:
+                next_row = 2
+
+            # Copy the rest, holding back enough bytes to find </sheetData>
+            buffer = head
+            while True:
+                position = buffer.find(patterns.sheet_data_close)
+                if position != -1:
+                    dst.write(buffer[:position])
+                    self.write_rows(dst, rows, next_row, prefix)
+                    dst.write(buffer[position:])
+                    shutil.copyfileobj(src, dst, BLOCK_SIZE)
+                    return
+                keep = len(patterns.sheet_data_close) - 1
+                dst.write(buffer[:-keep])
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    raise ValueError(f"Unsupported worksheet layout in {info.filename}")
+                buffer = buffer[-keep:] + block
+
+    def extend_header(self, head, data_start, extra_header, patterns):
+        if not extra_header:
+            return head
+        prefix = patterns.prefix
+        first_row = patterns.first_row.search(head, data_start)
+        number = ROW_REF.search(first_row.group(1)) if first_row else None
+        if first_row is None or (number and number.group(1) != b"1"):
+            # No header row yet: insert one in front of the existing rows
+            return head[:data_start] + prefixed(row_xml(1, extra_header), prefix) + head[data_start:]
+        content = first_row.group(2) or b""
+        # Like rows, a cell without an r attribute follows the cell before it
+        used = 0
+        for cell in patterns.cell.finditer(content):
+            ref = CELL_REF.search(cell.group(1))
+            used = self.column_number(ref.group(1).decode()) if ref else used + 1
+        attributes = re.sub(rb'\sspans="[^"]*"', b"", first_row.group(1)).rstrip(b"/")
+        new_cells = "".join(cell_xml(f"{column_letter(used + i + 1)}1", value)
+                            for i, value in enumerate(extra_header)).encode("utf-8")
+        return (head[:first_row.start()] + b"<" + prefix + b"row" + attributes + b">" + content
+                + prefixed(new_cells, prefix) + b"</" + prefix + b"row>" + head[first_row.end():])
+
+    @staticmethod
+    def column_number(letters):
+        number = 0
+        for char in letters:
+            number = number * 26 + ord(char) - 64
+        return number
+
+    @staticmethod
+    def write_rows(dst, rows, first_row, prefix=b""):
+        for offset, values in enumerate(rows):
+            if first_row + offset > MAX_SHEET_ROWS:
+                raise ValueError(f"More than Excel's limit of {MAX_SHEET_ROWS} rows in one sheet")
+            dst.write(prefixed(row_xml(first_row + offset, values), prefix))
+
+    # --- New sheets ---
+
+    def plan_new_sheets(self):
+        planned = []
+        taken = set(self.part_names)
+        sheets_dir = posixpath.join(posixpath.dirname(self.workbook_part), "worksheets")
+        with zipfile.ZipFile(self.workbook_path) as archive:
+            rels = archive.read(self.rels_part).decode("utf-8")
+        rel_ids = {int(n) for n in re.findall(r'Id="rId(\d+)"', rels)}
+        next_rel = max(rel_ids, default=0) + 1
+        number = 1
+        for sheet_name, header, rows in self.new_sheets:
+            while posixpath.join(sheets_dir, f"sheet{number}.xml") in taken:
+                number += 1
+            part = posixpath.join(sheets_dir, f"sheet{number}.xml")
+            taken.add(part)
+            planned.append((part, f"rId{next_rel}", sheet_name, header, rows))
+            next_rel += 1
+        return planned
+
+    def add_workbook_sheets(self, xml, new_parts):
+        text = xml.decode("utf-8")
+        sheet_ids = [int(n) for n in re.findall(r'<sheet\b[^>]*\ssheetId="(\d+)"', text)]
+        next_id = max(sheet_ids, default=0) + 1
+        prefix = re.search(r'xmlns:(\w+)="' + re.escape(REL_NS) + '"', text)
+        elements = []
+        for part, rel_id, sheet_name, _, _ in new_parts:
+            if prefix:
+                rel_attr = f'{prefix.group(1)}:id="{rel_id}"'
+            else:
+                rel_attr = f'xmlns:r="{REL_NS}" r:id="{rel_id}"'
+            elements.append(f'<sheet name="{escape(sheet_name)}" sheetId="{next_id}" {rel_attr}/>')
+            next_id += 1
+        text = re.sub(r'(</sheets>)', lambda m: "".join(elements) + m.group(1), text, count=1)
+        return text.encode("utf-8")
+
+    def add_workbook_rels(self, xml, new_parts):
+        text = xml.decode("utf-8")
+        base = posixpath.dirname(self.workbook_part)
+        elements = "".join(
+            f'<Relationship Id="{rel_id}" Type="{WORKSHEET_REL_TYPE}" Target="{posixpath.relpath(part, base)}"/>'
+            for part, rel_id, _, _, _ in new_parts)
+        return text.replace("</Relationships>", elements + "</Relationships>", 1).encode("utf-8")
+
+    def add_content_types(self, xml, new_parts):
+        text = xml.decode("utf-8")
+        elements = "".join(f'<Override PartName="/{part}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>'
+                           for part, _, _, _, _ in new_parts)
+        return text.replace("</Types>", elements + "</Types>", 1).encode("utf-8")
+
+    def write_new_sheet(self, dst, header, rows):
+        dst.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  + f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheetData>'.encode("utf-8"))
+        dst.write(row_xml(1, header))
+        self.write_rows(dst, rows, 2)
+        dst.write(b"</sheetData></worksheet>")